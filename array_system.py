@@ -0,0 +1,151 @@
+""" Array-backed System """
+
+from dataclasses import dataclass
+import time
+import numpy as np
+import clock
+from probability_transition_function import ProbabilityTransitionFunction
+from stats import RunStats
+from timestamp_heap import TimestampHeap
+from system import JumpObserver, get_queue_state, set_queue_state
+
+@dataclass
+class ArraySystem:
+    """ Same dynamics as System, but the state lives in contiguous arrays:
+    - n: the torus' size
+    - occupancy: uint8 array with 1 where there's a particle and 0 otherwise
+    - next_times: float64 array with the next triggering time of each clock (-1 if erased)
+    - rates: float64 array with the clock rate of each site
+    - transition_function: a transition function that accepts (a position, the torus size) and returns a new position
+    - event_queue: a queue with clock expiry events
+    - current_time: the current time
+    - observers: the jump observers notified before each particle jump
+    - stats: the run statistics (None unless the instrumentation is enabled)
+    """
+    n: int
+    occupancy: np.ndarray
+    next_times: np.ndarray
+    rates: np.ndarray
+    transition_function: ProbabilityTransitionFunction
+    event_queue: TimestampHeap
+    current_time: float
+    observers: list[JumpObserver]
+    stats: RunStats | None
+
+    def __init__(self, n: int, occupancy: list[int], rates: list[float], transition_function: ProbabilityTransitionFunction):
+        self.n = n
+        self.occupancy = np.array(occupancy, dtype=np.uint8)
+        self.next_times = np.full(n, -1, dtype=np.float64)
+        self.rates = np.array(rates, dtype=np.float64)
+        self.transition_function = transition_function
+        self.event_queue = TimestampHeap()
+        self.current_time = 0
+        self.observers = []
+        self.stats = None
+
+        # Mean waiting time of each clock, computed only once
+        self.scales = 1 / self.rates
+
+        # Fill up the queue
+        for idx in np.flatnonzero(self.occupancy).tolist():
+            self.restart_clock(idx, 0)
+            self.event_queue.add_or_update(idx, self.get_next_trigger_time(idx))
+
+    def is_empty(self, position: int) -> bool:
+        """ Returns whether a position is empty or not """
+        return self.occupancy[position] == 0
+
+    def restart_clock(self, position: int, current_time: float) -> None:
+        """ Restarts the clock of a given position """
+        self.next_times[position] = current_time + self.scales[position] * clock.random_source.exponential()
+
+    def erase_clock(self, position: int) -> None:
+        """ Erases the clock of a given position """
+        self.next_times[position] = -1
+
+    def get_next_trigger_time(self, position: int) -> float:
+        """ Get the triggering time of the clock of a given position """
+        return float(self.next_times[position])
+
+    def get_occupancy(self) -> np.ndarray:
+        """ Returns the occupancy array (1 if there's a particle, 0 otherwise) """
+        return self.occupancy
+
+    def add_observer(self, observer: JumpObserver) -> None:
+        """ Adds an observer notified before each particle jump """
+        self.observers.append(observer)
+
+    def move(self, position: int, new_position: int) -> None:
+        """ Moves a particle to a new position.
+        It assumes the new position is empty
+        """
+        if not self.is_empty(new_position):
+            raise AssertionError("Position is occupied")
+        if self.is_empty(position):
+            raise AssertionError("No particle is position")
+
+        # Notify observers while the state is still the one before the jump
+        if self.stats is None:
+            for observer in self.observers:
+                observer(position, new_position, self.current_time)
+        else:
+            self.stats.notify(self.observers, position, new_position, self.current_time)
+
+        # Update state
+        self.occupancy[new_position] = 1
+        self.occupancy[position] = 0
+
+    def clock_triggered(self, position: int, current_time: float) -> None:
+        """ Implements the trigerring of a clock and try to move a particle """
+        # Get new position for particle
+        new_position = self.transition_function(position, self.n)
+
+        # Check if site occupied
+        if not self.is_empty(new_position):
+            # If so, restart the clock
+            self.restart_clock(position, current_time)
+            self.event_queue.add_or_update(position, self.get_next_trigger_time(position))
+        else:
+            # If empty, move particle and restart clock at new position
+            self.move(position, new_position)
+
+            self.restart_clock(new_position, current_time)
+            self.event_queue.add_or_update(new_position, self.get_next_trigger_time(new_position))
+
+            self.erase_clock(position)
+            self.event_queue.remove_key(position)
+
+    def process_next_event(self) -> None:
+        """ Processes the next event """
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
+        result = self.event_queue.pop_min()
+        if result is None:
+            raise AssertionError("No more events in the queue")
+
+        position = result[0]
+        self.current_time = result[1]
+
+        if stats is None:
+            self.clock_triggered(position, self.current_time)
+            return
+
+        if self.get_next_trigger_time(position) != self.current_time:
+            stats.stale_entries += 1
+        start = stats.selected(position, start, len(self.event_queue) + 1)
+        self.clock_triggered(position, self.current_time)
+        stats.processed(start)
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the state as arrays: occupancy, clock times, event queue and current time """
+        return {"occupancy": self.occupancy.copy(), "next_times": self.next_times.copy(), **get_queue_state(self.event_queue),
+                "current_time": np.float64(self.current_time)}
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        self.occupancy[:] = state["occupancy"]
+        self.next_times[:] = state["next_times"]
+        set_queue_state(self.event_queue, state)
+        self.current_time = float(state["current_time"])
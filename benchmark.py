@@ -0,0 +1,221 @@
+""" Benchmark """
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+import importlib.util
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import numpy as np
+import clock
+from simulator import ENGINES, EVENT_RECORDING, GRID_RECORDING, RECORDINGS, Simulator, SimulatorConfig
+from system import create_initial_state
+
+# Taichi engine (only benchmarked if taichi is installed)
+TAICHI_ENGINE = "taichi"
+TAICHI_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulator_optimized_with_taichi")
+
+# Default grid of the benchmark cases
+SIZES = [100, 1000, 10000]
+DENSITIES = [0.1, 0.5]
+ALPHAS = [1.0]
+BETAS = [1.0]
+
+# Default simulated time of each case
+BENCHMARK_TIME = 10.0
+
+# Relative drop of events per second (or growth of peak memory) reported as a regression
+REGRESSION_THRESHOLD = 0.1
+
+@dataclass
+class BenchmarkCase:
+    """ A benchmark case: a simulation run until max_time """
+    engine: str
+    n: int
+    density: float
+    alpha: float
+    beta: float
+    max_time: float
+    recording: str = GRID_RECORDING
+
+    def key(self) -> tuple:
+        """ Returns the key identifying the case in a results file """
+        return tuple(asdict(self).values())
+
+@dataclass
+class BenchmarkResult:
+    """ Measurements of a benchmark case:
+    - events: the number of processed clock events
+    - wall_time: the wall-clock seconds spent processing them (setup excluded)
+    - events_per_second: events / wall_time
+    - wall_time_per_time_unit: wall_time / simulated time
+    - peak_rss_mb: the peak resident memory of the process that ran the case
+    - queue_size: the number of entries of the event queue at the end of the run
+      (the heap of the clock engines, the event sets of the superposition and n-fold engines,
+      the particles weighted by the Fenwick engine, the tournament tree in Taichi)
+    - stale_entries: the entries of the event queue that no longer match a clock
+    """
+    case: BenchmarkCase
+    events: int
+    wall_time: float
+    events_per_second: float
+    wall_time_per_time_unit: float
+    peak_rss_mb: float
+    queue_size: int
+    stale_entries: int
+
+def peak_rss_mb() -> float:
+    """ Returns the peak resident memory of the current process in MB """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def queue_sizes(system) -> tuple[int, int]:
+    """ Returns the size of the system's event queue and its number of stale entries """
+    if hasattr(system, "event_queue"):
+        # The indexed heap updates its entries in place, so every entry has a key in the position map
+        queue = system.event_queue
+        return len(queue.heap), len(queue.heap) - len(queue.index)
+    if hasattr(system, "bulk_moves"):
+        return len(system.bulk_moves) + len(system.moves_at_0), 0
+    if hasattr(system, "tree"):
+        return system.num_particles, 0
+    return len(system.occupied), 0
+
+def run_case(case: BenchmarkCase, seed: int | None = None) -> BenchmarkResult:
+    """ Runs a case of the pure Python engines and measures it """
+    clock.seed_rng(seed)
+    simulator = Simulator(SimulatorConfig(n=case.n, alpha=case.alpha, beta=case.beta, density=case.density,
+                                          max_time=case.max_time, engine=case.engine, recording=case.recording))
+    simulator.setup()
+    system = simulator.system
+    record_events = case.recording == EVENT_RECORDING
+
+    # Same loop as Simulator.run, counting the events
+    events = 0
+    start = time.perf_counter()
+    while system.current_time < case.max_time:
+        system.process_next_event()
+        events += 1
+        if record_events:
+            simulator.update_metrics(system)
+    wall_time = time.perf_counter() - start
+
+    return measured(case, events, wall_time, *queue_sizes(system))
+
+def run_taichi_case(case: BenchmarkCase, seed: int | None = None) -> BenchmarkResult:
+    """ Runs a case of the Taichi ExclusionProcess (all the events in a single kernel launch) and measures it """
+    import taichi as ti
+    sys.path.insert(0, TAICHI_DIRECTORY)
+    from exclusion_process import ExclusionProcess
+
+    ti.init(arch=ti.cpu)
+    clock.seed_rng(seed)
+    exclusion_process = ExclusionProcess(particles=create_initial_state(case.n, case.density), alpha=case.alpha, beta=case.beta,
+                                         max_particles_per_site=1, seed=seed)
+    exclusion_process.setup()
+
+    # Compile the kernel before timing it (no event happens at time 0)
+    exclusion_process.run_until(0.0)
+    ti.sync()
+
+    start = time.perf_counter()
+    exclusion_process.run_until(case.max_time)
+    ti.sync()
+    wall_time = time.perf_counter() - start
+
+    events = int(exclusion_process.calls_per_site.to_numpy().sum())
+    return measured(case, events, wall_time, exclusion_process.tree.shape[0], 0)
+
+def measured(case: BenchmarkCase, events: int, wall_time: float, queue_size: int, stale_entries: int) -> BenchmarkResult:
+    """ Returns the result of a case run in the current process """
+    return BenchmarkResult(case, events, wall_time, events / wall_time if wall_time > 0 else 0.0, wall_time / case.max_time,
+                           peak_rss_mb(), queue_size, stale_entries)
+
+def run_isolated(case: BenchmarkCase, seed: int | None = None) -> BenchmarkResult:
+    """ Runs a case in a fresh process, so its peak memory isn't mixed with the other cases' """
+    runner = run_taichi_case if case.engine == TAICHI_ENGINE else run_case
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(runner, case, seed).result()
+
+def benchmark_cases(engines: list[str], sizes: list[int], densities: list[float], alphas: list[float], betas: list[float],
+                    max_time: float, recording: str) -> list[BenchmarkCase]:
+    """ Returns the cases of the grid (the Taichi engine is skipped if taichi isn't installed) """
+    if TAICHI_ENGINE in engines and importlib.util.find_spec("taichi") is None:
+        print("taichi is not installed, skipping the taichi engine")
+        engines = [engine for engine in engines if engine != TAICHI_ENGINE]
+    return [BenchmarkCase(engine, n, density, alpha, beta, max_time, recording)
+            for engine, n, density, alpha, beta in itertools.product(engines, sizes, densities, alphas, betas)]
+
+def save_results(path: str, results: list[BenchmarkResult]) -> None:
+    """ Writes the results as JSON """
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"results": [asdict(result) for result in results]}, file, indent=2)
+
+def load_results(path: str) -> list[BenchmarkResult]:
+    """ Reads the results written by save_results """
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    return [BenchmarkResult(**{**result, "case": BenchmarkCase(**result["case"])}) for result in data["results"]]
+
+def compare(results: list[BenchmarkResult], baseline: list[BenchmarkResult], threshold: float = REGRESSION_THRESHOLD) -> list[BenchmarkResult]:
+    """ Prints the ratios of the results to the baseline's (for the cases in both) and returns the regressions:
+    the cases whose events per second dropped, or whose peak memory grew, by more than the threshold
+    """
+    baseline_results = {result.case.key(): result for result in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline_results.get(result.case.key())
+        if reference is None:
+            continue
+        speed = result.events_per_second / reference.events_per_second if reference.events_per_second > 0 else np.inf
+        memory = result.peak_rss_mb / reference.peak_rss_mb
+        regression = speed < 1 - threshold or memory > 1 + threshold
+        if regression:
+            regressions.append(result)
+        print(f"{describe(result.case):<56} speed x{speed:6.2f}  memory x{memory:6.2f}{'  REGRESSION' if regression else ''}")
+    return regressions
+
+def describe(case: BenchmarkCase) -> str:
+    """ Returns a short description of a case """
+    return f"{case.engine} n={case.n} density={case.density} alpha={case.alpha} beta={case.beta}"
+
+parser = argparse.ArgumentParser(description="Benchmark of the simulation engines")
+parser.add_argument("-engines", type=str, nargs="+", default=ENGINES, choices=ENGINES + [TAICHI_ENGINE], help="Engines to benchmark")
+parser.add_argument("-n", type=int, nargs="+", default=SIZES, help="Torus sizes")
+parser.add_argument("-density", type=float, nargs="+", default=DENSITIES, help="Densities of particles")
+parser.add_argument("-alpha", type=float, nargs="+", default=ALPHAS, help="Alpha parameters for clock rate at site 0")
+parser.add_argument("-beta", type=float, nargs="+", default=BETAS, help="Beta parameters for clock rate at site 0")
+parser.add_argument("-time", type=float, default=BENCHMARK_TIME, help="Simulated time of each case")
+parser.add_argument("-recording", type=str, default=GRID_RECORDING, choices=RECORDINGS, help="Metrics recording mode")
+parser.add_argument("-seed", type=int, default=0, help="Seed of every case (so runs of the same case process the same events)")
+parser.add_argument("-output", type=str, default="benchmark.json", help="Results file")
+parser.add_argument("-baseline", type=str, default=None, help="Results file to compare against")
+parser.add_argument("-threshold", type=float, default=REGRESSION_THRESHOLD, help="Relative change reported as a regression")
+
+def main():
+    """ Main """
+    args = parser.parse_args()
+    cases = benchmark_cases(args.engines, args.n, args.density, args.alpha, args.beta, args.time, args.recording)
+
+    results = []
+    for case in cases:
+        result = run_isolated(case, args.seed)
+        results.append(result)
+        print(f"{describe(case):<56} {result.events:>10} events  {result.events_per_second:>12.0f} events/s  "
+              f"{result.wall_time_per_time_unit:>9.4f} s/time unit  {result.peak_rss_mb:>8.1f} MB  "
+              f"queue {result.queue_size} ({result.stale_entries} stale)")
+    save_results(args.output, results)
+
+    if args.baseline is not None:
+        regressions = compare(results, load_results(args.baseline), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
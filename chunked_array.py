@@ -0,0 +1,204 @@
+""" Chunked array """
+
+from collections import OrderedDict
+import json
+import os
+from typing import Any, Callable
+import numpy as np
+
+# Size in bytes of the chunks (the chunk size is the number of records that fit in it)
+CHUNK_BYTES = 16 * 1024 * 1024
+
+# Number of chunk files kept memory-mapped at once
+MAPPED_CHUNKS = 16
+
+# Metadata file of a directory-backed chunked array
+METADATA_FILE = "metadata.json"
+
+class ChunkedArray:
+    """ ChunkedArray is an append-only array of fixed-shape records stored by chunks:
+    - the full chunks are npy files (chunk_000000.npy, ...), memory-mapped only when they are read
+    - the last chunk is kept in memory until it is full (or flushed)
+    - a metadata file keeps the record dtype and shape, the chunk size and the number of records,
+      so another process can open the array while it grows
+    Without a directory, the full chunks are kept in memory instead.
+
+    It behaves like a list of values: append, len, iteration, indexing and slicing.
+    Values are converted to records with encode and back with decode (if given),
+    and read returns the raw records of a range, reading only the chunks it spans.
+    """
+    def __init__(self, directory: str | None, dtype: Any, shape: tuple = (), chunk_size: int | None = None,
+                 encode: Callable | None = None, decode: Callable | None = None):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        if chunk_size is None:
+            chunk_size = max(1, CHUNK_BYTES // max(1, self.dtype.itemsize * int(np.prod(self.shape))))
+        self.chunk_size = chunk_size
+        self.encode = encode
+        self.decode = decode
+
+        self.buffer = np.empty((chunk_size, *self.shape), dtype=self.dtype)  # Last chunk
+        self.tail = 0  # Number of records in the last chunk
+        self.full_chunks = 0
+        self.chunks: list[np.ndarray] = []  # Full chunks (without a directory)
+        self.mapped: OrderedDict[int, np.ndarray] = OrderedDict()  # Recently read chunk files
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def open(cls, directory: str, encode: Callable | None = None, decode: Callable | None = None) -> "ChunkedArray":
+        """ Opens the chunked array stored in a directory """
+        with open(os.path.join(directory, METADATA_FILE), encoding="utf-8") as file:
+            metadata = json.load(file)
+        dtype = np.lib.format.descr_to_dtype(to_descr(metadata["dtype"]))
+        array = cls(directory, dtype, tuple(metadata["shape"]), metadata["chunk_size"], encode, decode)
+        array.restore(metadata["count"])
+        return array
+
+    def __len__(self) -> int:
+        return self.full_chunks * self.chunk_size + self.tail
+
+    def chunk_path(self, chunk: int) -> str:
+        """ Returns the file of a chunk """
+        return os.path.join(self.directory, f"chunk_{chunk:06d}.npy")
+
+    def write_metadata(self) -> None:
+        """ Writes the metadata file (through a temporary file, so readers never see a partial one) """
+        metadata = {
+            "dtype": np.lib.format.dtype_to_descr(self.dtype),
+            "shape": list(self.shape),
+            "chunk_size": self.chunk_size,
+            "count": len(self),
+        }
+        path = os.path.join(self.directory, METADATA_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(metadata, file)
+        os.replace(path + ".tmp", path)
+
+    def append(self, value: Any) -> None:
+        """ Appends a value """
+        self.buffer[self.tail] = value if self.encode is None else self.encode(value)
+        self.tail += 1
+        if self.tail == self.chunk_size:
+            self.store_chunk()
+
+    def extend(self, records: np.ndarray) -> None:
+        """ Appends raw records """
+        start = 0
+        while start < len(records):
+            count = min(len(records) - start, self.chunk_size - self.tail)
+            self.buffer[self.tail:self.tail + count] = records[start:start + count]
+            self.tail += count
+            start += count
+            if self.tail == self.chunk_size:
+                self.store_chunk()
+
+    def store_chunk(self) -> None:
+        """ Stores the full last chunk and starts a new one """
+        if self.directory is None:
+            self.chunks.append(self.buffer.copy())
+        else:
+            np.save(self.chunk_path(self.full_chunks), self.buffer)
+            self.mapped.pop(self.full_chunks, None)
+        self.full_chunks += 1
+        self.tail = 0
+        if self.directory is not None:
+            self.write_metadata()
+
+    def flush(self) -> None:
+        """ Writes the last (partial) chunk and the metadata, so the array can be opened with all its records """
+        if self.directory is None:
+            return
+        if self.tail > 0:
+            np.save(self.chunk_path(self.full_chunks), self.buffer[:self.tail])
+            self.mapped.pop(self.full_chunks, None)
+        self.write_metadata()
+
+    def restore(self, count: int) -> None:
+        """ Keeps only the first count records (e.g. the ones recorded until a checkpoint).
+        In a directory, the records are read from the stored chunks, even if they were written by another instance
+        """
+        full_chunks, tail = divmod(count, self.chunk_size)
+        # The last chunk's records are already in the buffer only if they were appended by this instance
+        if tail > 0 and not (full_chunks == self.full_chunks and tail <= self.tail):
+            self.buffer[:tail] = self.stored_chunk(full_chunks)[:tail]
+        self.chunks = self.chunks[:full_chunks]
+        self.mapped.clear()
+        self.full_chunks = full_chunks
+        self.tail = tail
+        if self.directory is not None:
+            self.write_metadata()
+
+    def stored_chunk(self, chunk: int) -> np.ndarray:
+        """ Returns a stored chunk (memory-mapped, if it is in a directory) """
+        if self.directory is None:
+            return self.chunks[chunk]
+        if chunk not in self.mapped:
+            if len(self.mapped) == MAPPED_CHUNKS:
+                self.mapped.popitem(last=False)
+            self.mapped[chunk] = np.load(self.chunk_path(chunk), mmap_mode="r")
+        self.mapped.move_to_end(chunk)
+        return self.mapped[chunk]
+
+    def chunk(self, chunk: int) -> np.ndarray:
+        """ Returns the records of a chunk """
+        if chunk == self.full_chunks:
+            return self.buffer[:self.tail]
+        return self.stored_chunk(chunk)
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """ Returns (a copy of) the records start, ..., stop - 1 """
+        stop = min(stop, len(self))
+        if start >= stop:
+            return np.empty((0, *self.shape), dtype=self.dtype)
+        parts = []
+        for chunk in range(start // self.chunk_size, (stop - 1) // self.chunk_size + 1):
+            offset = chunk * self.chunk_size
+            parts.append(self.chunk(chunk)[max(start - offset, 0):stop - offset])
+        return np.concatenate(parts)
+
+    def searchsorted(self, value: float, side: str = "left", field: str | None = None) -> int:
+        """ Returns the index where value would be inserted into the sorted records (or their field) """
+        def keys(records: np.ndarray) -> np.ndarray:
+            return records if field is None else records[field]
+
+        # First chunk whose last key is after the value, then a binary search inside it
+        num_chunks = self.full_chunks + (self.tail > 0)
+        low, high = 0, num_chunks
+        while low < high:
+            middle = (low + high) // 2
+            last = keys(self.chunk(middle))[-1]
+            if last > value or (side == "left" and last == value):
+                high = middle
+            else:
+                low = middle + 1
+        if low == num_chunks:
+            return len(self)
+        return low * self.chunk_size + int(np.searchsorted(keys(self.chunk(low)), value, side=side))
+
+    def get_value(self, record: np.ndarray) -> Any:
+        """ Returns the value of a record """
+        return record if self.decode is None else self.decode(record)
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return [self.get_value(record) for record in self.read(start, stop)[::step]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ChunkedArray index out of range")
+        chunk, offset = divmod(index, self.chunk_size)
+        return self.get_value(np.array(self.chunk(chunk)[offset]))
+
+    def __iter__(self):
+        for chunk in range(self.full_chunks + 1):
+            for record in np.array(self.chunk(chunk)):
+                yield self.get_value(record)
+
+def to_descr(descr: Any) -> Any:
+    """ Converts a dtype description read from JSON (lists instead of tuples) back to a NumPy one """
+    if isinstance(descr, str):
+        return descr
+    return [tuple(field) for field in descr]
@@ -2,6 +2,7 @@
 
 from dataclasses import dataclass
 from datetime import datetime
+import json
 from typing import Callable
 import numpy as np
 
@@ -12,11 +13,76 @@ nanoseconds = now.timestamp() * 1_000_000_000
 SEED = int(nanoseconds % 1000)
 rng = np.random.default_rng(SEED)
 
+# Number of values drawn at once by the buffered random source
+BLOCK_SIZE = 4096
+
+class BufferedRandom:
+    """ Random source that draws large blocks of values with NumPy and serves them one at a time.
+    Each block is refilled lazily when it runs out, so the per-draw cost is a list pop
+    instead of a NumPy call (and an array allocation).
+    It serves:
+    - standard exponential values (scale 1)
+    - uniform values in [0, 1)
+    - jump directions (-1 or 1)
+    """
+    def __init__(self, generator: np.random.Generator, block_size: int = BLOCK_SIZE):
+        self.block_size = block_size
+        self.set_generator(generator)
+
+    def set_generator(self, generator: np.random.Generator) -> None:
+        """ Sets the underlying generator and discards the buffered values """
+        self.generator = generator
+        self.exponentials: list[float] = []
+        self.uniforms: list[float] = []
+        self.directions: list[int] = []
+
+    def exponential(self) -> float:
+        """ Returns a standard exponential value """
+        if not self.exponentials:
+            self.exponentials = self.generator.standard_exponential(self.block_size).tolist()
+        return self.exponentials.pop()
+
+    def uniform(self) -> float:
+        """ Returns a uniform value in [0, 1) """
+        if not self.uniforms:
+            self.uniforms = self.generator.random(self.block_size).tolist()
+        return self.uniforms.pop()
+
+    def direction(self) -> int:
+        """ Returns -1 or 1 with equal probability """
+        if not self.directions:
+            self.directions = (2 * self.generator.integers(0, 2, size=self.block_size) - 1).tolist()
+        return self.directions.pop()
+
+random_source = BufferedRandom(rng)
+
+def seed_rng(seed: int | np.random.SeedSequence | None) -> None:
+    """ Reseeds the module's random number generator (and its buffered random source) """
+    global rng
+    rng = np.random.default_rng(seed)
+    random_source.set_generator(rng)
+
+def get_random_state() -> dict[str, np.ndarray]:
+    """ Returns the state of the random number generator (as JSON) and the values buffered by the random source """
+    return {
+        "bit_generator": np.array(json.dumps(rng.bit_generator.state)),
+        "exponentials": np.array(random_source.exponentials, dtype=np.float64),
+        "uniforms": np.array(random_source.uniforms, dtype=np.float64),
+        "directions": np.array(random_source.directions, dtype=np.int8),
+    }
+
+def set_random_state(state: dict[str, np.ndarray]) -> None:
+    """ Restores a state returned by get_random_state, so the following draws are the same """
+    rng.bit_generator.state = json.loads(str(state["bit_generator"]))
+    random_source.set_generator(rng)
+    random_source.exponentials = state["exponentials"].tolist()
+    random_source.uniforms = state["uniforms"].tolist()
+    random_source.directions = state["directions"].tolist()
+
 def exponential_generator(scale: float) -> ClockGenerator:
     """ Returns a generator for the exponential distribution """
     def generator() -> float:
-        global rng
-        return rng.exponential(scale=scale, size=1)[0]
+        return scale * random_source.exponential()
     return generator
 
 @dataclass
@@ -0,0 +1,127 @@
+""" Ensemble runner """
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+import numpy as np
+import clock
+from metrics import HEAT_MAP_POINTS, EmpiricalMeasureMetric, PositionProfileMetric, SampledEmpiricalMeasure, distinct_values, site_points
+from observables import DensityProfileMetric
+from replica_system import create_replica_system
+from simulator import GRID_RECORDING, Simulator, SimulatorConfig
+from time_grid import linear_time_grid
+from welford import WelfordStats
+
+@dataclass
+class ReplicaResult:
+    """ Compact result of a replica, reduced to what the heat map needs:
+    - timestamps: the grid recording times
+    - counts: array (states x HEAT_MAP_POINTS) with the number of particles at sites i with i/n <= x
+      at each heat map point x, for each distinct state (the smallest unsigned type that fits)
+    - index: the distinct state at each recording time
+    - n: the torus size
+    """
+    timestamps: np.ndarray
+    counts: np.ndarray
+    index: np.ndarray
+    n: int
+
+def heat_map_points() -> np.ndarray:
+    """ Returns the points of [0, 1] where the heat map evaluates the empirical measures """
+    return np.linspace(0, 1, HEAT_MAP_POINTS)
+
+def run_replica(config: SimulatorConfig, seed: np.random.SeedSequence) -> ReplicaResult:
+    """ Runs a replica with its own random stream and returns its cumulative counts at the heat map points on the time grid """
+    clock.seed_rng(seed)
+
+    # Grid recording makes the timestamps of all replicas line up
+    simulator = Simulator(replace(config, recording=GRID_RECORDING))
+    simulator.setup()
+    metrics = simulator.run()
+
+    # The state between two jumps is shared by its grid points, so each distinct state is reduced once
+    profile = metrics[PositionProfileMetric]
+    distinct, index = distinct_values(profile.values)
+    sites = np.searchsorted(site_points(config.n), heat_map_points(), side="right")
+    counts = np.array([np.searchsorted(np.sort(positions), sites) for positions in distinct], dtype=np.int64).reshape(len(distinct), len(sites))
+    counts = counts.astype(np.min_scalar_type(counts.max(initial=0)))
+    return ReplicaResult(np.array(profile.timestamps), counts, index.astype(np.int32), config.n)
+
+def run_ensemble(config: SimulatorConfig, replicas: int, workers: int, seed: int | None = None) -> list[ReplicaResult]:
+    """ Runs independent replicas on a process pool.
+    Each replica gets its own random stream spawned from the root seed
+    """
+    seeds = np.random.SeedSequence(seed).spawn(replicas)
+    if workers <= 1:
+        return [run_replica(config, replica_seed) for replica_seed in seeds]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_replica, [config] * replicas, seeds))
+
+def run_profile_replica(config: SimulatorConfig, seed: np.random.SeedSequence) -> WelfordStats:
+    """ Runs a replica with its own random stream and returns the time-weighted statistics of its density profile """
+    clock.seed_rng(seed)
+
+    # The profile is only sampled at the stopping time
+    simulator = Simulator(replace(config, recording=GRID_RECORDING, time_grid=[config.max_time]))
+    simulator.setup()
+    metrics = simulator.run()
+    return metrics[DensityProfileMetric].values[-1]
+
+def run_profile_ensemble(config: SimulatorConfig, replicas: int, workers: int, seed: int | None = None) -> tuple[WelfordStats, WelfordStats]:
+    """ Runs independent replicas on a process pool and merges their time-averaged density profiles
+    (config.profile_bins bins) without keeping any per-event data. Returns:
+    - the pooled time-weighted statistics of all the replicas (mean and variance in time and across replicas)
+    - the statistics of the replicas' time averages, one value per replica (mean and confidence interval)
+    """
+    seeds = np.random.SeedSequence(seed).spawn(replicas)
+    if workers <= 1:
+        results = [run_profile_replica(config, replica_seed) for replica_seed in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_profile_replica, [config] * replicas, seeds))
+
+    pooled = WelfordStats.empty(config.profile_bins)
+    ensemble = WelfordStats.empty(config.profile_bins)
+    for result in results:
+        pooled.merge(result)
+        ensemble.add(result.mean)
+    return pooled, ensemble
+
+def to_empirical_measure_metric(result: ReplicaResult) -> EmpiricalMeasureMetric:
+    """ Rebuilds the empirical measure metric of a replica (exact at the heat map points) """
+    metric = EmpiricalMeasureMetric()
+    points = heat_map_points()
+    measures = [SampledEmpiricalMeasure(points, row, result.n) for row in result.counts]
+    metric.values = [measures[state] for state in result.index.tolist()]
+    metric.timestamps = result.timestamps.tolist()
+    return metric
+
+def lockstep_profile_ensemble(config: SimulatorConfig, replicas: int, seed: int | None = None) -> WelfordStats:
+    """ Runs the replicas in lock-step in a single process and returns the statistics of their time-averaged
+    density profiles (config.profile_bins bins), one value per replica, like the second result of run_profile_ensemble
+    """
+    if not 0 < config.profile_bins <= config.n:
+        raise ValueError(f"The density profile needs between 1 and {config.n} bins, got {config.profile_bins}")
+    clock.seed_rng(seed)
+    system = create_replica_system(config, replicas)
+    system.run(config.max_time, [])
+
+    # Bins of consecutive sites, as in DensityProfileMetric
+    starts = np.searchsorted(np.arange(config.n) * config.profile_bins // config.n, np.arange(config.profile_bins))
+    widths = np.diff(np.append(starts, config.n))
+    densities = np.add.reduceat(system.time_averaged_occupancy(), starts, axis=1) / widths
+
+    ensemble = WelfordStats.empty(config.profile_bins)
+    for density in densities:
+        ensemble.add(density)
+    return ensemble
+
+def lockstep_density_profile(config: SimulatorConfig, replicas: int, seed: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """ Runs the replicas in lock-step in a single process and returns
+    the time grid and the ensemble-averaged density profile (time grid x n)
+    """
+    clock.seed_rng(seed)
+    time_grid = config.time_grid
+    if time_grid is None:
+        time_grid = linear_time_grid(config.max_time)
+    system = create_replica_system(config, replicas)
+    return np.asarray(time_grid), system.run(config.max_time, time_grid)
@@ -0,0 +1,128 @@
+""" Fenwick System """
+
+from dataclasses import dataclass
+import time
+import numpy as np
+import clock
+from fenwick_tree import FenwickTree
+from probability_transition_function import ProbabilityTransitionFunction
+from stats import RunStats
+from system import JumpObserver
+
+@dataclass
+class FenwickSystem:
+    """ Rejection-free engine for arbitrary per-site rates.
+
+    Like the superposition engine, the particles' clocks are superposed into a single exponential clock,
+    here of rate sum(rate(i) over the occupied sites i). The triggered particle is sampled proportionally
+    to its site's rate with a Fenwick tree over the occupied sites' rates, and a jump only updates the
+    weights of its two sites, so each event costs O(log n) whatever the rate profile
+    (slow regions, random environments, several slow sites...).
+
+    The system is characterized by:
+    - n: the torus' size
+    - occupancy: uint8 array with 1 where there's a particle and 0 otherwise
+    - rates: the clock rate of each site
+    - tree: Fenwick tree with weight rate(i) at each occupied site i (0 at the empty ones)
+    - transition_function: a transition function that accepts (a position, the torus size) and returns a new position
+    - current_time: the current time
+    - observers: the jump observers notified before each particle jump
+    - stats: the run statistics (None unless the instrumentation is enabled)
+    """
+    n: int
+    occupancy: np.ndarray
+    rates: list[float]
+    tree: FenwickTree
+    transition_function: ProbabilityTransitionFunction
+    current_time: float
+    observers: list[JumpObserver]
+    stats: RunStats | None
+
+    def __init__(self, n: int, occupancy: list[int], rates: list[float], transition_function: ProbabilityTransitionFunction):
+        self.n = n
+        self.occupancy = np.array(occupancy, dtype=np.uint8)
+        self.rates = [float(rate) for rate in rates]
+        self.tree = FenwickTree([rate if occupied else 0.0 for rate, occupied in zip(self.rates, self.occupancy.tolist())])
+        self.num_particles = int(self.occupancy.sum())
+        self.transition_function = transition_function
+        self.current_time = 0
+        self.observers = []
+        self.stats = None
+
+    def is_empty(self, position: int) -> bool:
+        """ Returns whether a position is empty or not """
+        return self.occupancy[position] == 0
+
+    def get_occupancy(self) -> np.ndarray:
+        """ Returns the occupancy array (1 if there's a particle, 0 otherwise) """
+        return self.occupancy
+
+    def total_rate(self) -> float:
+        """ Returns the rate of the superposed clock """
+        return self.tree.total()
+
+    def add_observer(self, observer: JumpObserver) -> None:
+        """ Adds an observer notified before each particle jump """
+        self.observers.append(observer)
+
+    def move(self, position: int, new_position: int) -> None:
+        """ Moves a particle to a new position.
+        It assumes the new position is empty
+        """
+        if not self.is_empty(new_position):
+            raise AssertionError("Position is occupied")
+        if self.is_empty(position):
+            raise AssertionError("No particle is position")
+
+        # Notify observers while the state is still the one before the jump
+        if self.stats is None:
+            for observer in self.observers:
+                observer(position, new_position, self.current_time)
+        else:
+            self.stats.notify(self.observers, position, new_position, self.current_time)
+
+        # Update state
+        self.occupancy[new_position] = 1
+        self.occupancy[position] = 0
+        self.tree.update(position, 0.0)
+        self.tree.update(new_position, self.rates[new_position])
+
+    def select_position(self, total_rate: float) -> int:
+        """ Selects the position whose clock triggered, proportionally to its rate """
+        return self.tree.find(clock.random_source.uniform() * total_rate)
+
+    def process_next_event(self) -> None:
+        """ Processes the next event """
+        total_rate = self.total_rate()
+        if total_rate <= 0:
+            raise AssertionError("No more events in the queue")
+
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
+        self.current_time += clock.random_source.exponential() / total_rate
+        position = self.select_position(total_rate)
+        if stats is not None:
+            start = stats.selected(position, start, self.num_particles)
+
+        # Try to move the triggered particle (a blocked jump changes nothing, clocks are memoryless)
+        new_position = self.transition_function(position, self.n)
+        if self.is_empty(new_position):
+            self.move(position, new_position)
+
+        if stats is not None:
+            stats.processed(start)
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the state as arrays: occupancy, Fenwick tree partial sums and updates since its last rebuild, and current time """
+        return {"occupancy": self.occupancy.copy(), "tree": np.array(self.tree.tree, dtype=np.float64),
+                "tree_updates": np.int64(self.tree.updates), "current_time": np.float64(self.current_time)}
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        self.occupancy[:] = state["occupancy"]
+        self.tree = FenwickTree([rate if occupied else 0.0 for rate, occupied in zip(self.rates, self.occupancy.tolist())])
+        # The partial sums carry the rounding of the past updates, so they are restored as saved
+        self.tree.restore(state["tree"].tolist(), int(state["tree_updates"]))
+        self.current_time = float(state["current_time"])
@@ -0,0 +1,91 @@
+""" FenwickTree """
+
+import itertools
+
+class FenwickTree:
+    """ FenwickTree (binary indexed tree) keeps non-negative weights and allows, in O(log n):
+    - update of a weight
+    - prefix sums (and the total weight)
+    - search of the index whose weight interval contains a value, i.e. weighted sampling
+
+    Node i (1-based) holds the sum of the weights i - lowbit(i), ..., i - 1, where lowbit(i) = i & -i.
+
+    An update only adds a delta to the partial sums, so rounding errors accumulate in them
+    (e.g. a node of weights that all went back to 0 may hold a tiny residue). The tree is rebuilt
+    from the weights every size updates, which keeps the error bounded at an amortized O(1) per update.
+    """
+    def __init__(self, weights: list[float]):
+        self.size = len(weights)
+        self.weights: list[float] = [float(weight) for weight in weights]  # Weight of each index
+        self.tree: list[float] = []  # Partial sums (node 0 is unused)
+        self.updates = 0  # Number of updates since the last rebuild
+        self.rebuild()
+
+        # Largest power of 2 not above the size (first step of the search)
+        self.top = 1 << (self.size.bit_length() - 1) if self.size > 0 else 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def rebuild(self) -> None:
+        """ Recomputes the partial sums from the weights in O(n): each node adds its sum to its parent """
+        self.tree = [0.0] * (self.size + 1)
+        for node in range(1, self.size + 1):
+            self.tree[node] += self.weights[node - 1]
+            parent = node + (node & -node)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[node]
+        self.updates = 0
+
+    def restore(self, tree: list[float], updates: int) -> None:
+        """ Replaces the partial sums and the number of updates since the last rebuild with saved ones
+        (e.g. from a checkpoint), keeping their exact rounding and the next rebuild
+        """
+        self.tree = [float(value) for value in tree]
+        self.updates = updates
+
+    def update(self, index: int, weight: float) -> None:
+        """ Sets the weight of an index """
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+        node = index + 1
+        while node <= self.size:
+            self.tree[node] += delta
+            node += node & -node
+
+        self.updates += 1
+        if self.updates >= self.size:
+            self.rebuild()
+
+    def prefix_sum(self, count: int) -> float:
+        """ Returns the sum of the weights of the indexes 0, ..., count - 1 """
+        total = 0.0
+        node = count
+        while node > 0:
+            total += self.tree[node]
+            node -= node & -node
+        return total
+
+    def total(self) -> float:
+        """ Returns the sum of all the weights """
+        return self.prefix_sum(self.size)
+
+    def find(self, value: float) -> int:
+        """ Returns the index i such that prefix_sum(i) <= value < prefix_sum(i + 1), for 0 <= value < total() """
+        index = 0
+        step = self.top
+        while step > 0:
+            node = index + step
+            if node <= self.size and self.tree[node] <= value:
+                index = node
+                value -= self.tree[node]
+            step >>= 1
+
+        # Rounding may land just past the last positive weight or on an empty index: take the closest positive weight
+        index = min(index, self.size - 1)
+        if self.weights[index] > 0:
+            return index
+        for candidate in itertools.chain(range(index - 1, -1, -1), range(index + 1, self.size)):
+            if self.weights[candidate] > 0:
+                return candidate
+        raise AssertionError("All the weights are 0")
@@ -0,0 +1,43 @@
+""" IndexedSet """
+
+class IndexedSet:
+    """ IndexedSet is a set of integers that allows, in O(1):
+    - addition and removal of an item
+    - membership test
+    - uniform sampling of an item
+
+    Items are kept in a dense list and a dictionary stores the index of each item,
+    so a removal swaps the last item into the freed slot.
+    """
+    def __init__(self, items: list[int] | None = None):
+        self.items: list[int] = []  # Dense list of items
+        self.index: dict[int, int] = {}  # Dictionary to store the list index of each item
+        for item in items or []:
+            self.add(item)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, item: int) -> bool:
+        return item in self.index
+
+    def add(self, item: int) -> None:
+        """ Adds an item (no-op if already present) """
+        if item in self.index:
+            return
+        self.index[item] = len(self.items)
+        self.items.append(item)
+
+    def remove(self, item: int) -> None:
+        """ Removes an item (no-op if not present) """
+        idx = self.index.pop(item, None)
+        if idx is None:
+            return
+        last = self.items.pop()
+        if idx < len(self.items):
+            self.items[idx] = last
+            self.index[last] = idx
+
+    def choice(self, uniform: float) -> int:
+        """ Returns the item selected by a uniform value in [0, 1) """
+        return self.items[int(uniform * len(self.items))]
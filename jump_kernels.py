@@ -0,0 +1,171 @@
+""" Jump kernels """
+
+import numpy as np
+from clock import random_source
+
+# Jump kernels selectable from the command line
+SYMMETRIC_JUMPS = "symmetric" # nearest-neighbour, left or right with equal probability
+ASYMMETRIC_JUMPS = "asymmetric" # nearest-neighbour, right with probability p and left with probability 1 - p
+FINITE_RANGE_JUMPS = "finite_range" # uniform distance in 1, ..., range, right with probability p
+LONG_RANGE_JUMPS = "long_range" # distance d with probability proportional to d^-(1 + exponent), right with probability p
+JUMP_KERNELS = [SYMMETRIC_JUMPS, ASYMMETRIC_JUMPS, FINITE_RANGE_JUMPS, LONG_RANGE_JUMPS]
+
+class AliasTable:
+    """ AliasTable samples an index of a discrete distribution in O(1) with Walker's alias method
+    (built with Vose's algorithm in O(k) for k indexes):
+    - probability: the probability of keeping each column
+    - alias: the index returned instead when a column is not kept
+
+    A uniform value u in [0, 1) picks the column int(u * k), and its fractional part decides
+    between the column and its alias, so a sample needs a single uniform value.
+    """
+    def __init__(self, weights: list[float]):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim != 1 or len(weights) == 0:
+            raise ValueError("An alias table needs at least one weight")
+        if (weights < 0).any() or weights.sum() <= 0:
+            raise ValueError("The weights must be non-negative and not all 0")
+
+        self.size = len(weights)
+        scaled = weights * (self.size / weights.sum())
+        self.probability = np.ones(self.size, dtype=np.float64)
+        self.alias = np.arange(self.size, dtype=np.int64)
+
+        # Each column below 1 is topped up by a column above 1, which keeps the rest
+        small = [index for index in range(self.size) if scaled[index] < 1.0]
+        large = [index for index in range(self.size) if scaled[index] >= 1.0]
+        while small and large:
+            column, donor = small.pop(), large[-1]
+            self.probability[column] = scaled[column]
+            self.alias[column] = donor
+            scaled[donor] -= 1.0 - scaled[column]
+            if scaled[donor] < 1.0:
+                small.append(large.pop())
+        # The remaining columns are full up to rounding
+
+        # Lists are faster than arrays for the scalar sampling. u * k may round up to k for u close to 1:
+        # the extra column always returns its alias, the last index
+        self.probability_list: list[float] = self.probability.tolist() + [0.0]
+        self.alias_list: list[int] = self.alias.tolist() + [self.size - 1]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def sample(self, uniform: float) -> int:
+        """ Returns the index sampled by a uniform value in [0, 1) """
+        scaled = uniform * self.size
+        column = int(scaled)
+        if scaled - column < self.probability_list[column]:
+            return column
+        return self.alias_list[column]
+
+    def sample_batch(self, uniforms: np.ndarray) -> np.ndarray:
+        """ Returns the indexes sampled by an array of uniform values in [0, 1) """
+        scaled = np.asarray(uniforms, dtype=np.float64) * self.size
+        columns = np.minimum(scaled.astype(np.int64), self.size - 1)
+        return np.where(scaled - columns < self.probability[columns], columns, self.alias[columns])
+
+    def probabilities(self) -> np.ndarray:
+        """ Returns the distribution represented by the table """
+        probabilities = self.probability / self.size
+        np.add.at(probabilities, self.alias, (1.0 - self.probability) / self.size)
+        return probabilities
+
+class JumpKernel:
+    """ JumpKernel is a translation-invariant jump distribution p(x, y) = p(y - x) on the torus,
+    sampled in O(1) per jump with an alias table over its displacements:
+    - displacements: the jump displacements (non-zero, negative to the left)
+    - table: the alias table of the displacements' probabilities
+
+    A kernel is a ProbabilityTransitionFunction: kernel(position, n) returns a jump's target, drawn with
+    one value of the shared random source (like the symmetric transition, so checkpoints stay bit-exact).
+    sample_targets draws the targets of many jumps at once for the vectorized engines.
+    """
+    def __init__(self, displacements: list[int], weights: list[float]):
+        self.displacements = np.asarray(displacements, dtype=np.int64)
+        if len(self.displacements) != len(weights):
+            raise ValueError(f"Expected {len(self.displacements)} weights, got {len(weights)}")
+        if (self.displacements == 0).any():
+            raise ValueError("A jump displacement can't be 0")
+        self.table = AliasTable(weights)
+        self.displacement_list: list[int] = self.displacements.tolist()
+
+    @property
+    def nearest_neighbour(self) -> bool:
+        """ Returns whether every jump is to a nearest neighbour """
+        return bool((np.abs(self.displacements) == 1).all())
+
+    def probabilities(self) -> dict[int, float]:
+        """ Returns the probability of each displacement """
+        probabilities = self.table.probabilities()
+        return {displacement: float(probability) for displacement, probability in zip(self.displacement_list, probabilities)}
+
+    def drift(self) -> float:
+        """ Returns the mean displacement of a jump """
+        return float(self.displacements @ self.table.probabilities())
+
+    def check(self, n: int) -> None:
+        """ Raises a ValueError if a jump isn't shorter than half a torus of size n.
+        The jump observers only get the sites of a jump and take the shortest way between them
+        (see observables.jump_displacement), which is the jump's own displacement only below n/2
+        """
+        if (2 * np.abs(self.displacements) >= n).any():
+            raise ValueError(f"Jump displacements must be shorter than half the torus size {n}, "
+                             f"got a displacement of {int(np.abs(self.displacements).max())}")
+
+    def __call__(self, position: int, n: int) -> int:
+        """ Returns the target of a jump from a position """
+        return (position + self.displacement_list[self.table.sample(random_source.uniform())]) % n
+
+    def sample_displacements(self, generator: np.random.Generator, size: int) -> np.ndarray:
+        """ Returns the displacements of size jumps """
+        return self.displacements[self.table.sample_batch(generator.random(size))]
+
+    def sample_targets(self, positions: np.ndarray, n: int, generator: np.random.Generator) -> np.ndarray:
+        """ Returns the target of a jump from each position """
+        return (positions + self.sample_displacements(generator, len(positions))) % n
+
+    def alias_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Returns the displacements, keep probabilities and aliases as arrays (e.g. to copy them to a device) """
+        return self.displacements.copy(), self.table.probability.copy(), self.table.alias.copy()
+
+def asymmetric_kernel(p: float) -> JumpKernel:
+    """ Nearest-neighbour jumps: right with probability p, left with probability 1 - p """
+    return finite_range_kernel(1, p)
+
+def finite_range_kernel(jump_range: int, p: float = 0.5) -> JumpKernel:
+    """ Jumps to a uniform distance in 1, ..., jump_range: right with probability p, left with probability 1 - p """
+    if not 0 <= p <= 1:
+        raise ValueError(f"The probability of a right jump must be in [0, 1], got {p}")
+    if jump_range < 1:
+        raise ValueError(f"The jump range must be at least 1, got {jump_range}")
+    distances = list(range(1, jump_range + 1))
+    return JumpKernel([-distance for distance in distances] + distances,
+                      [(1 - p) / jump_range] * jump_range + [p / jump_range] * jump_range)
+
+def long_range_kernel(n: int, exponent: float, p: float = 0.5, jump_range: int | None = None) -> JumpKernel:
+    """ Jumps to a distance d with probability proportional to d^-(1 + exponent),
+    up to jump_range (default: half the torus, so each displacement is the shortest way to its target):
+    right with probability p, left with probability 1 - p
+    """
+    if not 0 <= p <= 1:
+        raise ValueError(f"The probability of a right jump must be in [0, 1], got {p}")
+    jump_range = (n - 1) // 2 if jump_range is None else jump_range
+    if jump_range < 1:
+        raise ValueError(f"The jump range must be at least 1, got {jump_range}")
+    distances = np.arange(1, jump_range + 1)
+    weights = distances ** -(1.0 + exponent)
+    weights /= weights.sum()
+    return JumpKernel(np.concatenate([-distances, distances]), np.concatenate([(1 - p) * weights, p * weights]))
+
+def create_jump_kernel(name: str, n: int, p: float = 0.5, jump_range: int | None = None, exponent: float = 1.0) -> JumpKernel | None:
+    """ Returns the named jump kernel (None for the symmetric jumps, handled by the symmetric transition) """
+    if name == SYMMETRIC_JUMPS:
+        return None
+    if name == ASYMMETRIC_JUMPS:
+        return asymmetric_kernel(p)
+    if name == FINITE_RANGE_JUMPS:
+        return finite_range_kernel(1 if jump_range is None else jump_range, p)
+    if name == LONG_RANGE_JUMPS:
+        return long_range_kernel(n, exponent, p, jump_range)
+    raise ValueError(f"Unknown jump kernel: {name}")
@@ -1,8 +1,18 @@
 """ Main """
 
 import argparse
-from metrics import EmpiricalMeasureMetric, heat_map
-from simulator import Simulator, SimulatorConfig, animate_matrics
+import os
+import numpy as np
+from ensemble import lockstep_density_profile, lockstep_profile_ensemble, run_ensemble, run_profile_ensemble, to_empirical_measure_metric
+from jump_kernels import JUMP_KERNELS, SYMMETRIC_JUMPS, create_jump_kernel
+from metrics import heat_map
+from observables import (BondCurrentMetric, DensityProfileMetric, OccupationTimeMetric, TaggedDisplacementMetric, plot_density_profile,
+                         plot_ensemble_profiles, plot_time_averaged_profile)
+from simulator import (CHECKPOINT_INTERVAL, ENGINES, EVENT_RECORDING, OBJECT_ENGINE, RECORDINGS, TRAJECTORY_RECORDING,
+                       Simulator, SimulatorConfig, animate_matrics)
+from site_rates import load_site_rates
+from stats import PROGRESS_INTERVAL
+from time_grid import DEFAULT_TIME_STEP, linear_time_grid, log_time_grid
 
 parser = argparse.ArgumentParser(description="Simple Exclusion Process Simulator with alpha/(n^beta) rate at site 0")
 parser.add_argument("-n", type=int, default=100, help="Torus size")
@@ -10,6 +20,44 @@ parser.add_argument("-alpha", type=float, default=100.0, help="Alpha parameter f
 parser.add_argument("-beta", type=float, default=1.0, help="Beta parameter for clock rate at site 0")
 parser.add_argument("-density", type=float, default=0.1, help="Density of particles")
 parser.add_argument("-time", type=int, default=10000, help="Stopping time")
+parser.add_argument("-engine", type=str, default=OBJECT_ENGINE, choices=ENGINES, help="Simulation engine")
+parser.add_argument("-recording", type=str, default=EVENT_RECORDING, choices=RECORDINGS, help="Metrics recording mode")
+parser.add_argument("-frames", type=int, default=300, help="Number of frames rebuilt from a recorded trajectory")
+parser.add_argument("-dt", type=float, default=DEFAULT_TIME_STEP, help="Time step of the grid recording")
+parser.add_argument("-log_points", type=int, default=0, help="Number of log-spaced points of the grid recording (overrides -dt)")
+parser.add_argument("-replicas", type=int, default=1, help="Number of replicas (more than 1 runs the ensemble heat map analysis)")
+parser.add_argument("-lockstep", action="store_true", help="Run the replicas in lock-step in a single process (ensemble-averaged density profile on the time grid, or time-averaged with -profile_bins)")
+parser.add_argument("-workers", type=int, default=os.cpu_count(), help="Number of worker processes for the replicas")
+parser.add_argument("-render_workers", type=int, default=os.cpu_count(), help="Number of worker processes rendering the animation frames")
+parser.add_argument("-store", type=str, default=None, help="Directory where the recorded metrics and trajectory are stored (instead of memory)")
+parser.add_argument("-checkpoint", type=str, default=None, help="Checkpoint file, saved periodically during the run (the run resumes from it if it exists)")
+parser.add_argument("-checkpoint_interval", type=float, default=CHECKPOINT_INTERVAL, help="Wall-clock seconds between two checkpoints")
+parser.add_argument("-observables", action="store_true", help="Record the current across the bond (0, 1), the occupation time of site 0 and the tagged displacements")
+parser.add_argument("-profile_bins", type=int, default=0, help="Number of bins of the time-averaged density profile (with -replicas, plotted with its confidence interval)")
+parser.add_argument("-site_rates", type=str, default=None, help="Text file with the clock rate of each site (overrides -alpha and -beta)")
+parser.add_argument("-jump", type=str, default=SYMMETRIC_JUMPS, choices=JUMP_KERNELS, help="Jump kernel")
+parser.add_argument("-p", type=float, default=0.5, help="Probability of a right jump (asymmetric, finite_range and long_range jumps)")
+parser.add_argument("-jump_range", type=int, default=None, help="Maximum jump distance (finite_range and long_range jumps)")
+parser.add_argument("-jump_exponent", type=float, default=1.0, help="Exponent of the long_range jumps (a distance d has weight d^-(1 + exponent))")
+parser.add_argument("-stats", action="store_true", help="Collect the run statistics (event counters and phase timers) and print a progress line")
+parser.add_argument("-progress_interval", type=float, default=PROGRESS_INTERVAL, help="Wall-clock seconds between two progress lines (with -stats)")
+parser.add_argument("-seed", type=int, default=None, help="Root seed of the replicas' random streams")
+
+def get_time_grid(args) -> list[float]:
+    """ Returns the grid recording times """
+    if args.log_points > 0:
+        return log_time_grid(args.time, args.log_points)
+    return linear_time_grid(args.time, args.dt)
+
+def get_site_rates(args) -> list[float] | None:
+    """ Returns the site rates read from the -site_rates file (None for the default profile) """
+    if args.site_rates is None:
+        return None
+    return load_site_rates(args.site_rates)
+
+def get_jump_kernel(args):
+    """ Returns the jump kernel of the -jump arguments (None for the symmetric jumps) """
+    return create_jump_kernel(args.jump, args.n, args.p, args.jump_range, args.jump_exponent)
 
 def main():
     """ Main """
@@ -20,17 +68,44 @@ def main():
         beta=args.beta,
         density=args.density,
         max_time=args.time,
+        engine=args.engine,
+        recording=args.recording,
+        time_grid=get_time_grid(args),
+        store=args.store,
+        instrument=args.stats,
+        observables=args.observables,
+        profile_bins=args.profile_bins,
+        site_rates=get_site_rates(args),
+        jump_kernel=get_jump_kernel(args),
     )
 
     # Run the simulation
     simulator = Simulator(config)
     simulator.setup()
-    metrics = simulator.run()
+    if args.checkpoint is not None and os.path.exists(args.checkpoint):
+        simulator.load_checkpoint(args.checkpoint)
+    metrics = simulator.run(args.checkpoint, args.checkpoint_interval, args.progress_interval)
+    if simulator.stats is not None:
+        print(simulator.stats.progress_line(simulator.system.current_time, config.max_time))
+
+    if config.observables:
+        print_observables(metrics)
+    if config.profile_bins > 0:
+        plot_time_averaged_profile(metrics[DensityProfileMetric].values[-1])
+
+    # Rebuild the metrics from the event log
+    if config.recording == TRAJECTORY_RECORDING:
+        metrics = simulator.replay_trajectory(np.linspace(0, config.max_time, args.frames))
 
     # Animate the metrics
-    animate_matrics(metrics, config)
+    animate_matrics(metrics, config, args.render_workers)
+
+def print_observables(metrics: dict) -> None:
+    """ Prints the last recorded value of the observables """
+    print(f"Current across bond (0, 1): {metrics[BondCurrentMetric].values[-1]}")
+    print(f"Occupation time of site 0: {metrics[OccupationTimeMetric].values[-1]:.4f}")
+    print(f"Mean squared displacement: {metrics[TaggedDisplacementMetric].mean_squared_displacement()[-1]:.4f}")
 
-# TODO
 def analyse_several_executions():
     """ Analyses several executions with a heat map animation per time interval"""
     args = parser.parse_args()
@@ -40,17 +115,35 @@ def analyse_several_executions():
         beta=args.beta,
         density=args.density,
         max_time=args.time,
+        engine=args.engine,
+        time_grid=get_time_grid(args),
+        profile_bins=args.profile_bins,
+        site_rates=get_site_rates(args),
+        jump_kernel=get_jump_kernel(args),
     )
-    repetitions = 10
-    all_metrics = []
-    for _ in range(repetitions):
-        simulator = Simulator(config)
-        simulator.setup()
-        metrics = simulator.run()
-        all_metrics.append(metrics)
 
-    heat_map([metric[EmpiricalMeasureMetric] for metric in all_metrics])
+    # Vectorized replicas of the same configuration, whatever the engine
+    if args.lockstep:
+        if config.profile_bins > 0:
+            plot_density_profile(lockstep_profile_ensemble(config, args.replicas, args.seed))
+        else:
+            plot_ensemble_profiles(*lockstep_density_profile(config, args.replicas, args.seed))
+        return
+
+    # Merge the replicas' time-averaged density profiles
+    if config.profile_bins > 0:
+        _, ensemble = run_profile_ensemble(config, args.replicas, args.workers, args.seed)
+        plot_density_profile(ensemble)
+        return
+
+    # Run the replicas on a process pool
+    results = run_ensemble(config, args.replicas, args.workers, args.seed)
+
+    heat_map([to_empirical_measure_metric(result) for result in results])
 
 
 if __name__ == "__main__":
-    main()
+    if parser.parse_args().replicas > 1:
+        analyse_several_executions()
+    else:
+        main()
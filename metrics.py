@@ -2,12 +2,39 @@
 
 import abc
 from dataclasses import dataclass
-from typing import Callable
+from functools import lru_cache
+import bisect
+import os
 
 from matplotlib.animation import FuncAnimation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 import numpy as np
+from chunked_array import ChunkedArray
 from system import System
+from video import write_video
+
+# Number of frames read at once from a metric's values
+FRAME_WINDOW = 64
+
+# Size of the animation figures in inches and their resolution
+FIGURE_SIZE = (15, 8)
+FIGURE_DPI = 100
+FIGURE_PIXELS = (FIGURE_SIZE[0] * FIGURE_DPI, FIGURE_SIZE[1] * FIGURE_DPI)
+
+# Number of points of [0, 1] where the heat map evaluates the empirical measures
+HEAT_MAP_POINTS = 100
+
+def create_figure() -> tuple[Figure, FigureCanvasAgg]:
+    """ Creates an off-screen animation figure (usable in worker processes) """
+    fig = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+    return fig, FigureCanvasAgg(fig)
+
+def figure_bytes(canvas: FigureCanvasAgg) -> bytes:
+    """ Draws a figure and returns its raw RGB bytes """
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[:, :, :3].tobytes()
 
 @dataclass
 class Metric(abc.ABC):
@@ -22,108 +49,298 @@ class Metric(abc.ABC):
     values: list
     timestamps: list[float]
 
+    # Whether the value changes between two jumps (so a value can't be reused for later timestamps)
+    varies_between_jumps = False
+
+    # Whether the value is only recorded at the stopping time (e.g. accumulated statistics of O(n) size,
+    # too large to be kept at every event)
+    recorded_at_end = False
+
+    def attach(self, system: System) -> None:
+        """ Attaches the metric to a system (e.g. to observe its jumps) before the simulation starts.
+        Observers are notified in the order they were added, so metrics must be attached
+        after any observer that records them before a jump
+        """
+
     def add(self, state: System, timestamp: float) -> None:
         """ Adds a new value with a timestamp """
-        self.values.append(self.getter(state))
+        self.add_occupancy(state.get_occupancy(), timestamp)
+
+    def add_occupancy(self, occupancy: np.ndarray, timestamp: float) -> None:
+        """ Adds a new value, computed from an occupancy array, with a timestamp """
+        self.values.append(self.getter(occupancy))
         self.timestamps.append(timestamp)
 
-    def animate(self, torus_size: int) -> None:
-        """ Creates an animation through time """
+    def animate(self, torus_size: int, workers: int | None = None, start_time: float | None = None, end_time: float | None = None) -> None:
+        """ Creates an animation through time (between start_time and end_time), rendered by a number of worker processes """
+
+    def record_spec(self, n: int) -> tuple[np.dtype, tuple, callable, callable]:
+        """ Returns how a value of a torus of size n is stored as a fixed-shape record:
+        the record dtype and shape, and the functions converting a value to a record and back
+        """
+        raise NotImplementedError(f"{self.name} values can't be stored")
+
+    def store(self, directory: str, n: int, reopen: bool = False) -> None:
+        """ Keeps the values and timestamps in chunked arrays on disk instead of lists in memory.
+        With reopen, the values already stored in the directory are kept (e.g. to read a finished run)
+        """
+        dtype, shape, encode, decode = self.record_spec(n)
+        values_directory = os.path.join(directory, "values")
+        timestamps_directory = os.path.join(directory, "timestamps")
+        if reopen:
+            self.values = ChunkedArray.open(values_directory, encode, decode)
+            self.timestamps = ChunkedArray.open(timestamps_directory, decode=float)
+        else:
+            self.values = ChunkedArray(values_directory, dtype, shape, encode=encode, decode=decode)
+            self.timestamps = ChunkedArray(timestamps_directory, np.float64, decode=float)
+
+    def is_stored(self) -> bool:
+        """ Returns whether the values are stored on disk """
+        return isinstance(self.values, ChunkedArray)
+
+    def flush(self) -> None:
+        """ Writes the recorded values to disk (if they are stored) """
+        if self.is_stored():
+            self.values.flush()
+            self.timestamps.flush()
+
+    def time_range(self, start_time: float | None = None, end_time: float | None = None) -> tuple[int, int]:
+        """ Returns the indexes [start, stop) of the values recorded between start_time and end_time """
+        start = 0 if start_time is None else bisect.bisect_left(self.timestamps, start_time)
+        stop = len(self.timestamps) if end_time is None else bisect.bisect_right(self.timestamps, end_time)
+        return start, stop
+
+    def frames(self, start_time: float | None = None, end_time: float | None = None) -> "FrameRange":
+        """ Returns the (timestamp, value) frames recorded between start_time and end_time, read lazily """
+        return FrameRange(self, *self.time_range(start_time, end_time))
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the recorded timestamps and values as arrays (only their number, if they are stored).
+        A value reused for several timestamps (e.g. by the grid sampler) is saved once
+        """
+        if self.is_stored():
+            self.flush()
+            return {"count": np.int64(len(self.timestamps))}
+        distinct, index = distinct_values(self.values)
+        return {"timestamps": np.array(self.timestamps, dtype=np.float64), "index": index, **self.encode_values(distinct)}
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        if self.is_stored():
+            self.values.restore(int(state["count"]))
+            self.timestamps.restore(int(state["count"]))
+            return
+        distinct = self.decode_values(state)
+        self.values = [distinct[idx] for idx in state["index"].tolist()]
+        self.timestamps = state["timestamps"].tolist()
+
+    def encode_values(self, values: list) -> dict[str, np.ndarray]:
+        """ Returns a list of values as arrays """
+        raise NotImplementedError(f"{self.name} values can't be saved")
+
+    def decode_values(self, state: dict[str, np.ndarray]) -> list:
+        """ Returns the list of values encoded by encode_values """
+        raise NotImplementedError(f"{self.name} values can't be loaded")
+
+class FrameRange:
+    """ The (timestamp, value) frames of a metric between two indexes.
+    Frames are only read when they are sliced or iterated (by windows of FRAME_WINDOW frames)
+    """
+    def __init__(self, metric: Metric, start: int, stop: int):
+        self.metric = metric
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return max(self.stop - self.start, 0)
+
+    def __getitem__(self, frames: slice) -> list[tuple[float, object]]:
+        start, stop, _ = frames.indices(len(self))
+        start += self.start
+        stop += self.start
+        return list(zip(self.metric.timestamps[start:stop], self.metric.values[start:stop]))
+
+    def __iter__(self):
+        for start in range(0, len(self), FRAME_WINDOW):
+            yield from self[start:start + FRAME_WINDOW]
+
+def distinct_values(values: list) -> tuple[list, np.ndarray]:
+    """ Returns the distinct value objects and the index of each value among them """
+    indexes: dict[int, int] = {}
+    distinct = []
+    index = np.empty(len(values), dtype=np.int64)
+    for k, value in enumerate(values):
+        if id(value) not in indexes:
+            indexes[id(value)] = len(distinct)
+            distinct.append(value)
+        index[k] = indexes[id(value)]
+    return distinct, index
 
 # =========================================
 # Empirical Measure
 # =========================================
 
-EmpirialMeasure = Callable[[float], float]
+@lru_cache(maxsize=8)
+def site_points(n: int) -> np.ndarray:
+    """ Returns the points i/n of the sites 0, ..., n-1 in [0, 1) """
+    return np.arange(n) / n
 
-def get_empirical_measure(state: System) -> EmpirialMeasure:
+class EmpiricalMeasure:
+    """ Empirical measure x -> (number of particles at sites i with i/n <= x)/n.
+    It is represented by the cumulative occupancy (cumulative[k] = number of particles at sites 0, ..., k)
+    and is evaluated at many x at once
+    """
+    def __init__(self, cumulative: np.ndarray):
+        self.cumulative = cumulative
+
+    def __call__(self, x: float | np.ndarray) -> float | np.ndarray:
+        n = len(self.cumulative)
+        # Number of sites i with i/n <= x
+        sites = np.searchsorted(site_points(n), x, side="right")
+        counts = np.where(sites > 0, self.cumulative[np.maximum(sites - 1, 0)], 0)
+        return counts / n
+
+class SampledEmpiricalMeasure:
+    """ Empirical measure known only at some points (e.g. the heat map's):
+    counts[k] is the number of particles at sites i with i/n <= points[k].
+    It is exact at the points and interpolated linearly in between
+    """
+    def __init__(self, points: np.ndarray, counts: np.ndarray, n: int):
+        self.points = points
+        self.counts = counts
+        self.n = n
+
+    def __call__(self, x: float | np.ndarray) -> float | np.ndarray:
+        return np.interp(x, self.points, self.counts) / self.n
+
+class CumulativeOccupancy:
+    """ Cumulative occupancy of a system, kept up to date as a jump observer.
+    The cumulative value at k is partial[k] + offset. A jump from i to j only changes
+    the sites between i and j, and the shift of all sites goes to the offset when the
+    complement is smaller, so a jump costs O(min(d, n - d)) for a jump distance d
+    (O(1) for nearest-neighbour jumps, including the ones across the torus' origin)
+    """
+    def __init__(self, occupancy: np.ndarray):
+        self.partial = np.cumsum(occupancy, dtype=np.int32)
+        self.offset = 0
+
+    def add_range(self, start: int, end: int, value: int) -> None:
+        """ Adds a value to the cumulative occupancy on the sites start, ..., end - 1 """
+        n = len(self.partial)
+        if 2 * (end - start) <= n:
+            self.partial[start:end] += value
+        else:
+            self.offset += value
+            self.partial[:start] -= value
+            self.partial[end:] -= value
+
+    def __call__(self, position: int, new_position: int, time: float) -> None:
+        """ Updates the cumulative occupancy with a jump """
+        if position < new_position:
+            self.add_range(position, new_position, -1)
+        else:
+            self.add_range(new_position, position, 1)
+
+    def cumulative(self) -> np.ndarray:
+        """ Returns (a copy of) the cumulative occupancy """
+        return self.partial + self.offset
+
+def get_empirical_measure(occupancy: np.ndarray) -> EmpiricalMeasure:
     """ Computes the empirical measure """
-
-    # Torus size
-    n: int = len(state.positions)
-
-    # Initial empty function
-    func: EmpirialMeasure = lambda x: 0
-
-    def add_dirac_mass(func: EmpirialMeasure, point: float) -> EmpirialMeasure:
-        # Outputs a new function: func + dirac mass at the given point
-        def new_func(x: float) -> float:
-            if x >= point:
-                return func(x) + 1
-            else:
-                return func(x)
-        return new_func
-
-    # Adds the dirac mass for each point
-    for idx, position in enumerate(state.positions):
-        if position.particle is not None:
-            func = add_dirac_mass(func, idx/n)
-
-    # Normalize by the torus size
-    return lambda x: func(x)/n
+    return EmpiricalMeasure(np.cumsum(occupancy, dtype=np.int32))
 
 class EmpiricalMeasureMetric(Metric):
     """ Empirical Measure Metric """
 
     def __init__(self):
         super().__init__("Empirical Measure",get_empirical_measure,[],[])
+        self.tracker: CumulativeOccupancy | None = None
+
+    def attach(self, system: System) -> None:
+        """ Keeps the cumulative occupancy up to date with the system's jumps """
+        self.tracker = CumulativeOccupancy(system.get_occupancy())
+        system.add_observer(self.tracker)
+
+    def add(self, state: System, timestamp: float) -> None:
+        """ Adds a new value with a timestamp """
+        if self.tracker is None:
+            super().add(state, timestamp)
+            return
+        self.values.append(EmpiricalMeasure(self.tracker.cumulative()))
+        self.timestamps.append(timestamp)
 
-    def animate(self, torus_size: int):
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the recorded values and the tracked cumulative occupancy as arrays """
+        state = super().get_state()
+        if self.tracker is not None:
+            state["partial"] = self.tracker.partial.copy()
+            state["offset"] = np.int64(self.tracker.offset)
+        return state
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        super().set_state(state)
+        if self.tracker is not None:
+            self.tracker.partial[:] = state["partial"]
+            self.tracker.offset = int(state["offset"])
+
+    def encode_values(self, values: list[EmpiricalMeasure]) -> dict[str, np.ndarray]:
+        """ Returns the cumulative occupancies (values x n) """
+        return {"cumulative": np.array([value.cumulative for value in values], dtype=np.int32)}
+
+    def decode_values(self, state: dict[str, np.ndarray]) -> list[EmpiricalMeasure]:
+        """ Returns the empirical measures of the cumulative occupancies """
+        return [EmpiricalMeasure(cumulative) for cumulative in state["cumulative"]]
+
+    def record_spec(self, n: int) -> tuple[np.dtype, tuple, callable, callable]:
+        """ An empirical measure is stored as its cumulative occupancy """
+        return np.int32, (n,), lambda value: value.cumulative, EmpiricalMeasure
+
+    def animate(self, torus_size: int, workers: int | None = None, start_time: float | None = None, end_time: float | None = None):
         """ Animate the empirical measure through time """
+        frames = self.frames(start_time, end_time)
+        y_max = max([value(1) for _, value in frames])
+        renderer = EmpiricalMeasureRenderer(torus_size, y_max)
+        write_video('empirical_measure.mp4', renderer, frames, workers)
 
+class EmpiricalMeasureRenderer:
+    """ Renders frames (timestamp, empirical measure) of the empirical measure animation """
+    size = FIGURE_PIXELS
+
+    def __init__(self, torus_size: int, y_max: float):
+        self.torus_size = torus_size
+        self.y_max = y_max
+
+    def __call__(self, frames: list) -> bytes:
         # Define the x values from 0 to 1
-        x = np.linspace(0, 1, torus_size)
+        x = np.linspace(0, 1, self.torus_size)
 
         # Set up the figure and axis
-        fig, ax = plt.subplots(figsize = (15,8))
+        fig, canvas = create_figure()
+        ax = fig.add_subplot()
         line, = ax.plot([], [], lw=2, linestyle = "-")
-
-        # Set axis limits
         ax.set_xlim(0, 1)
-        ax.set_ylim(0, 0.5)  # Adjust as needed based on function range
-        y_max = max([value(1) for value in self.values])
+        ax.set_ylim(0, self.y_max*1.1)
+        ax.grid()
+        ax.set_ylabel("Empirical Measure")
+        ax.set_xlabel("x")
         timestamp_text = ax.text(0.05, 0.95, '', transform=ax.transAxes, ha='left', va='top', color='black')
 
-        # Initialization function for FuncAnimation
-        def init():
-            line.set_data([], [])
-            timestamp_text = ax.text(0.05, 0.95, '', transform=ax.transAxes, ha='left', va='top', color='black')
-            return line, timestamp_text
-
-        # Animation function: updates the line for each frame
-        def animate(i):
-            y = [self.values[i](xx) for xx in x]
-            line.set_data(x, y)
-            timestamp_text.set_text(f'Timestamp: {self.timestamps[i]}')
-            return line, timestamp_text
-
-        # Create the animation
-        anim = FuncAnimation(fig, animate, init_func=init, frames=len(self.values), interval=1)
-
-        plt.grid()
-        ax.set_ylim(0, y_max*1.1)
-        plt.ylabel("Empirical Measure")
-        plt.xlabel("x")
-
-        anim.save('empirical_measure.mp4', writer='ffmpeg', fps=30)
-
-        # plt.show()
-        plt.close()
+        # Only the line and the timestamp change between frames
+        images = []
+        for timestamp, value in frames:
+            line.set_data(x, value(x))
+            timestamp_text.set_text(f'Timestamp: {timestamp}')
+            images.append(figure_bytes(canvas))
+        return b"".join(images)
 
 # =========================================
 # Position Profile
 # =========================================
 
-def get_position_profile(state: System) -> list[int]:
+def get_position_profile(occupancy: np.ndarray) -> list[int]:
     """ Returns a list of x indexes where particles are located (from 0 to n-1) """
-    ret = []
-
-    for idx, pos in enumerate(state.positions):
-        # Add position index if it has a particle
-        if pos.particle is not None:
-            ret.append(idx)
-
-    return ret
+    return np.flatnonzero(occupancy).tolist()
 
 class PositionProfileMetric(Metric):
     """ Position Profile Metric """
@@ -131,47 +348,70 @@ class PositionProfileMetric(Metric):
     def __init__(self):
         super().__init__("Position Profile", get_position_profile, [], [])
 
-    def animate(self, torus_size: int):
+    def encode_values(self, values: list[list[int]]) -> dict[str, np.ndarray]:
+        """ Returns the concatenated positions and the number of positions of each value """
+        return {
+            "positions": np.array([position for positions in values for position in positions], dtype=np.int64),
+            "counts": np.array([len(positions) for positions in values], dtype=np.int64),
+        }
+
+    def decode_values(self, state: dict[str, np.ndarray]) -> list[list[int]]:
+        """ Returns the lists of positions """
+        splits = np.cumsum(state["counts"])[:-1]
+        return [positions.tolist() for positions in np.split(state["positions"], splits)] if len(state["counts"]) else []
+
+    def record_spec(self, n: int) -> tuple[np.dtype, tuple, callable, callable]:
+        """ A position profile is stored as the occupancy packed as bits """
+        def encode(positions: list[int]) -> np.ndarray:
+            occupancy = np.zeros(n, dtype=np.uint8)
+            occupancy[positions] = 1
+            return np.packbits(occupancy)
+
+        def decode(record: np.ndarray) -> list[int]:
+            return np.flatnonzero(np.unpackbits(record, count=n)).tolist()
+
+        return np.uint8, ((n + 7) // 8,), encode, decode
+
+    def animate(self, torus_size: int, workers: int | None = None, start_time: float | None = None, end_time: float | None = None):
         """ Create an animation of the particle movements on the grid """
-        fig, ax = plt.subplots(figsize = (15,8))
-        ax.set_xlim(0, torus_size)
+        renderer = PositionProfileRenderer(torus_size)
+        write_video('position_profile.mp4', renderer, self.frames(start_time, end_time), workers)
+
+class PositionProfileRenderer:
+    """ Renders frames (timestamp, particle positions) of the position profile animation """
+    size = FIGURE_PIXELS
+
+    def __init__(self, torus_size: int):
+        self.torus_size = torus_size
+
+    def __call__(self, frames: list) -> bytes:
+        fig, canvas = create_figure()
+        ax = fig.add_subplot()
+        ax.set_xlim(0, self.torus_size)
         ax.set_ylim(0.49, 0.51)
         ax.set_yticks([])
-        ax.set_xticks([i for i in range(torus_size)])
-        plt.axhline(y=0.5, color='gray', linestyle='-', linewidth=1)
+        ax.set_xticks([i for i in range(self.torus_size)])
+        ax.axhline(y=0.5, color='gray', linestyle='-', linewidth=1)
+        ax.set_ylabel("Position Profile")
+        ax.set_xlabel("x")
 
         scatter = ax.scatter([], [], s=100, color='blue')
         timestamp_text = ax.text(0.05, 0.95, '', transform=ax.transAxes, ha='left', va='top', color='black')
 
-        def init1():
-            scatter.set_offsets(np.empty((0, 2)))
-            timestamp_text = ax.text(0.05, 0.95, '', transform=ax.transAxes, ha='left', va='top', color='black')
-            return scatter, timestamp_text
-
-        def update1(frame):
-            x = self.values[frame]
-            y = [0.5] * len(x)
-            scatter.set_offsets(np.c_[x, y])
-            timestamp_text.set_text(f'Timestamp: {self.timestamps[frame]}')
-            return scatter, timestamp_text
-
-        anim = FuncAnimation(fig, update1, frames=len(self.values), init_func=init1, interval=1)
-        # plt.grid()
-        plt.ylabel("Position Profile")
-        plt.xlabel("x")
-
-        anim.save('position_profile.mp4', writer='ffmpeg', fps=30)
-
-        # plt.show()
-        plt.close()
+        images = []
+        for timestamp, positions in frames:
+            scatter.set_offsets(np.c_[positions, [0.5] * len(positions)])
+            timestamp_text.set_text(f'Timestamp: {timestamp}')
+            images.append(figure_bytes(canvas))
+        return b"".join(images)
 
 
 # TODO
-def heat_map(all_metrics: list[EmpiricalMeasureMetric]) -> None:
-    """ Animate the empirical measure through time """
+def heat_map(all_metrics: list[EmpiricalMeasureMetric], start_time: float | None = None, end_time: float | None = None) -> None:
+    """ Animate the empirical measure through time (between start_time and end_time) """
 
     # Define the x values from 0 to 1
-    x = np.linspace(0, 1, 100)
+    x = np.linspace(0, 1, HEAT_MAP_POINTS)
 
     # Set up the figure and axis
     fig, ax = plt.subplots()
@@ -179,17 +419,17 @@ def heat_map(all_metrics: list[EmpiricalMeasureMetric]) -> None:
     # Set axis limits
     ax.set_xlim(0, 1)
     ax.set_ylim(0, 0.5)  # Adjust as needed based on function range
-    y_max = max([value(1) for value in all_metrics[0].values])
+    y_max = max([value(1) for _, value in all_metrics[0].frames(start_time, end_time)])
     ylim = y_max*1.1
     timestamp_text = ax.text(0.05, 0.95, '', transform=ax.transAxes, ha='left', va='top', color='green')
 
     data: dict[float, list] = {}
 
     for metric in all_metrics:
-        for idx, timestamp in enumerate(metric.timestamps):
+        for timestamp, value in metric.frames(start_time, end_time):
             if timestamp not in data:
                 data[timestamp] = []
-            data[timestamp] += [(xx, metric.values[idx](xx)) for xx in x]
+            data[timestamp].append(value(x))
     timestamps = sorted(list(data.keys()))
 
     # Initialization function for FuncAnimation
@@ -201,8 +441,8 @@ def heat_map(all_metrics: list[EmpiricalMeasureMetric]) -> None:
     def animate(i):
         ax.clear()  # Clear the axis to redraw the histogram
         timestamp = timestamps[i]
-        x_values = [x[0] for x in data[timestamp]]
-        y_values = [x[1] for x in data[timestamp]]
+        x_values = np.tile(x, len(data[timestamp]))
+        y_values = np.concatenate(data[timestamp])
         ax.hist2d(x_values, y_values, bins=30, range=[[0, 1], [0, ylim]], cmap='viridis')
         ax.text(0.05, 0.95, f'Timestamp: {timestamp}', transform=ax.transAxes, ha='left', va='top', color='green')
 
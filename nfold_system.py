@@ -0,0 +1,160 @@
+""" N-fold way System """
+
+from dataclasses import dataclass
+import time
+import numpy as np
+import clock
+from indexed_set import IndexedSet
+from stats import RunStats
+from system import JumpObserver
+
+# Jump directions of a move. A move is encoded as 2 * position + direction
+LEFT = 0
+RIGHT = 1
+
+@dataclass
+class NFoldSystem:
+    """ n-fold way (BKL) kinetic Monte Carlo engine for the symmetric nearest-neighbour dynamics.
+
+    Instead of ringing every clock and rejecting jumps onto occupied sites,
+    it keeps the set of mobile moves (a particle and a direction whose target is empty).
+    Each move happens at rate (site rate)/2, so the time until the next successful jump is
+    exponential with the total rate of the mobile moves, and the move is chosen proportionally to its rate.
+    Only successful jumps are simulated, so current_time is the time of the last jump.
+
+    The system is characterized by:
+    - n: the torus' size
+    - occupancy: uint8 array with 1 where there's a particle and 0 otherwise
+    - bulk_rate: the clock rate of the sites != 0
+    - rate_at_0: the clock rate of site 0
+    - bulk_moves: the mobile moves from sites != 0
+    - moves_at_0: the mobile moves from site 0
+    - current_time: the current time
+    - observers: the jump observers notified before each particle jump
+    - stats: the run statistics (None unless the instrumentation is enabled)
+    """
+    n: int
+    occupancy: np.ndarray
+    bulk_rate: float
+    rate_at_0: float
+    bulk_moves: IndexedSet
+    moves_at_0: IndexedSet
+    current_time: float
+    observers: list[JumpObserver]
+    stats: RunStats | None
+
+    def __init__(self, n: int, occupancy: list[int], rates: list[float]):
+        if len(set(rates[1:])) > 1:
+            raise ValueError("N-fold way engine requires the same rate at every site != 0 (use the fenwick engine for other profiles)")
+
+        self.n = n
+        self.occupancy = np.array(occupancy, dtype=np.uint8)
+        self.bulk_rate = float(rates[1]) if n > 1 else 0.0
+        self.rate_at_0 = float(rates[0])
+        self.bulk_moves = IndexedSet()
+        self.moves_at_0 = IndexedSet()
+        self.current_time = 0
+        self.observers = []
+        self.stats = None
+
+        # Fill up the mobile moves
+        for idx in np.flatnonzero(self.occupancy).tolist():
+            self.refresh_moves(idx)
+
+    def is_empty(self, position: int) -> bool:
+        """ Returns whether a position is empty or not """
+        return self.occupancy[position] == 0
+
+    def get_occupancy(self) -> np.ndarray:
+        """ Returns the occupancy array (1 if there's a particle, 0 otherwise) """
+        return self.occupancy
+
+    def target(self, move: int) -> int:
+        """ Returns the target position of a move """
+        position, direction = divmod(move, 2)
+        if direction == LEFT:
+            return (position - 1) % self.n
+        return (position + 1) % self.n
+
+    def refresh_moves(self, position: int) -> None:
+        """ Recomputes whether the two moves from a position are mobile """
+        moves = self.moves_at_0 if position == 0 else self.bulk_moves
+        for direction in (LEFT, RIGHT):
+            move = 2 * position + direction
+            if not self.is_empty(position) and self.is_empty(self.target(move)):
+                moves.add(move)
+            else:
+                moves.remove(move)
+
+    def total_rate(self) -> float:
+        """ Returns the total rate of the mobile moves """
+        return (len(self.bulk_moves) * self.bulk_rate + len(self.moves_at_0) * self.rate_at_0) / 2
+
+    def add_observer(self, observer: JumpObserver) -> None:
+        """ Adds an observer notified before each particle jump """
+        self.observers.append(observer)
+
+    def move(self, position: int, new_position: int) -> None:
+        """ Moves a particle to a new position.
+        It assumes the new position is empty
+        """
+        if not self.is_empty(new_position):
+            raise AssertionError("Position is occupied")
+        if self.is_empty(position):
+            raise AssertionError("No particle is position")
+
+        # Notify observers while the state is still the one before the jump
+        if self.stats is None:
+            for observer in self.observers:
+                observer(position, new_position, self.current_time)
+        else:
+            self.stats.notify(self.observers, position, new_position, self.current_time)
+
+        # Update state
+        self.occupancy[new_position] = 1
+        self.occupancy[position] = 0
+
+        # Only the moves from the two sites and their neighbours can change
+        for site in {position, new_position, (position - 1) % self.n, (position + 1) % self.n,
+                     (new_position - 1) % self.n, (new_position + 1) % self.n}:
+            self.refresh_moves(site)
+
+    def select_move(self, total_rate: float) -> int:
+        """ Selects a mobile move proportionally to its rate """
+        weight_at_0 = len(self.moves_at_0) * self.rate_at_0 / 2
+        if weight_at_0 > 0 and clock.random_source.uniform() * total_rate < weight_at_0:
+            return self.moves_at_0.choice(clock.random_source.uniform())
+        return self.bulk_moves.choice(clock.random_source.uniform())
+
+    def process_next_event(self) -> None:
+        """ Processes the next successful jump """
+        total_rate = self.total_rate()
+        if total_rate <= 0:
+            raise AssertionError("No more events in the queue")
+
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
+        self.current_time += clock.random_source.exponential() / total_rate
+        move = self.select_move(total_rate)
+
+        if stats is None:
+            self.move(move // 2, self.target(move))
+            return
+
+        start = stats.selected(move // 2, start, len(self.bulk_moves) + len(self.moves_at_0))
+        self.move(move // 2, self.target(move))
+        stats.processed(start)
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the state as arrays: occupancy, mobile moves (in sampling order) and current time """
+        return {"occupancy": self.occupancy.copy(), "bulk_moves": np.array(self.bulk_moves.items, dtype=np.int64),
+                "moves_at_0": np.array(self.moves_at_0.items, dtype=np.int64), "current_time": np.float64(self.current_time)}
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        self.occupancy[:] = state["occupancy"]
+        self.bulk_moves = IndexedSet(state["bulk_moves"].tolist())
+        self.moves_at_0 = IndexedSet(state["moves_at_0"].tolist())
+        self.current_time = float(state["current_time"])
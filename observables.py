@@ -0,0 +1,339 @@
+""" Observables """
+
+import abc
+import matplotlib.pyplot as plt
+import numpy as np
+from metrics import Metric
+from welford import WelfordStats
+
+# Default number of bins of the density profile
+PROFILE_BINS = 100
+
+# Number of times of the grid whose ensemble-averaged profiles are plotted
+PROFILE_CURVES = 5
+
+def jump_displacement(position: int, new_position: int, n: int) -> int:
+    """ Returns the signed displacement of a jump on the torus (the shortest one, e.g. +1 from n-1 to 0).
+    It is the jump's own displacement for jumps shorter than n/2 (which JumpKernel.check enforces)
+    """
+    return (new_position - position + n // 2) % n - n // 2
+
+def get_particle_ids(system) -> np.ndarray:
+    """ Returns the id of the particle at each site (-1 if empty).
+    Only the object engine carries the particles' ids (Particle.id); the particles of the
+    array-based engines are labelled by their current site, as the object engine does initially
+    """
+    if hasattr(system, "particle_ids"):
+        return system.particle_ids()
+    return np.where(system.get_occupancy() > 0, np.arange(system.n), -1)
+
+class ObservableMetric(Metric):
+    """ ObservableMetric is a metric accumulated from the system's jumps, in O(1) per jump:
+    the metric is a jump observer that updates its accumulators, and add samples their value
+    (after every event, or at the grid points with the grid sampler).
+    Since it needs the jumps, it must be attached and can't be rebuilt from occupancy snapshots
+    """
+    def __init__(self, name: str):
+        super().__init__(name, None, [], [])
+        self.n = 0
+
+    def attach(self, system) -> None:
+        """ Starts accumulating from the system's current state and observes its jumps """
+        self.n = system.n
+        self.reset(system)
+        system.add_observer(self)
+
+    @abc.abstractmethod
+    def reset(self, system) -> None:
+        """ Resets the accumulators to the system's current state """
+
+    @abc.abstractmethod
+    def __call__(self, position: int, new_position: int, time: float) -> None:
+        """ Updates the accumulators with a jump """
+
+    @abc.abstractmethod
+    def value(self, timestamp: float):
+        """ Returns the value at a timestamp (not before the last jump) """
+
+    @abc.abstractmethod
+    def get_accumulators(self) -> dict[str, np.ndarray]:
+        """ Returns the accumulators as arrays """
+
+    @abc.abstractmethod
+    def set_accumulators(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores accumulators returned by get_accumulators """
+
+    def add(self, state, timestamp: float) -> None:
+        """ Adds the value at a timestamp """
+        self.values.append(self.value(timestamp))
+        self.timestamps.append(timestamp)
+
+    def add_occupancy(self, occupancy: np.ndarray, timestamp: float) -> None:
+        raise ValueError(f"{self.name} is accumulated from the jumps, it can't be computed from an occupancy")
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the recorded values and the accumulators as arrays """
+        return {**super().get_state(), **self.get_accumulators()}
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        super().set_state(state)
+        self.set_accumulators(state)
+
+    def encode_values(self, values: list) -> dict[str, np.ndarray]:
+        """ Returns the values as an array """
+        return {"values": np.array(values)}
+
+    def decode_values(self, state: dict[str, np.ndarray]) -> list:
+        """ Returns the list of values """
+        return state["values"].tolist()
+
+# =========================================
+# Bond current
+# =========================================
+
+class BondCurrentMetric(ObservableMetric):
+    """ Net number of particles that crossed the bond between the sites bond and bond + 1:
+    +1 for each crossing from left to right and -1 for each crossing from right to left
+    """
+    def __init__(self, bond: int = 0):
+        super().__init__(f"Current across bond {bond}")
+        self.bond = bond
+        self.current = 0
+
+    def reset(self, system) -> None:
+        self.current = 0
+
+    def __call__(self, position: int, new_position: int, time: float) -> None:
+        displacement = jump_displacement(position, new_position, self.n)
+        if displacement > 0 and (self.bond - position) % self.n < displacement:
+            self.current += 1
+        elif displacement < 0 and (position - self.bond - 1) % self.n < -displacement:
+            self.current -= 1
+
+    def value(self, timestamp: float) -> int:
+        return self.current
+
+    def get_accumulators(self) -> dict[str, np.ndarray]:
+        return {"current": np.int64(self.current)}
+
+    def set_accumulators(self, state: dict[str, np.ndarray]) -> None:
+        self.current = int(state["current"])
+
+    def record_spec(self, n: int) -> tuple[np.dtype, tuple, callable, callable]:
+        """ A current is stored as an integer """
+        return np.int64, (), None, int
+
+# =========================================
+# Occupation time
+# =========================================
+
+class OccupationTimeMetric(ObservableMetric):
+    """ Time during which a site was occupied, since the metric was attached """
+
+    # The value grows between jumps, so the grid sampler computes it at every grid point
+    varies_between_jumps = True
+
+    def __init__(self, site: int = 0):
+        super().__init__(f"Occupation time of site {site}")
+        self.site = site
+        self.occupied = 0
+        self.integral = 0.0  # Occupation time until last_time
+        self.last_time = 0.0
+
+    def reset(self, system) -> None:
+        self.occupied = int(system.get_occupancy()[self.site])
+        self.integral = 0.0
+        self.last_time = float(system.current_time)
+
+    def __call__(self, position: int, new_position: int, time: float) -> None:
+        if self.site in (position, new_position):
+            self.integral += self.occupied * (time - self.last_time)
+            self.last_time = time
+            self.occupied = int(new_position == self.site)
+
+    def value(self, timestamp: float) -> float:
+        return self.integral + self.occupied * (timestamp - self.last_time)
+
+    def get_accumulators(self) -> dict[str, np.ndarray]:
+        return {"occupied": np.int64(self.occupied), "integral": np.float64(self.integral), "last_time": np.float64(self.last_time)}
+
+    def set_accumulators(self, state: dict[str, np.ndarray]) -> None:
+        self.occupied = int(state["occupied"])
+        self.integral = float(state["integral"])
+        self.last_time = float(state["last_time"])
+
+    def record_spec(self, n: int) -> tuple[np.dtype, tuple, callable, callable]:
+        """ An occupation time is stored as a float """
+        return np.float64, (), None, float
+
+# =========================================
+# Tagged displacement
+# =========================================
+
+class TaggedDisplacementMetric(ObservableMetric):
+    """ Displacement (unwrapped, so it can exceed the torus' size) of tagged particles since the metric was attached.
+    The particles are tagged by id (all of them by default), and each value is the array of their displacements
+    """
+    def __init__(self, particles: list[int] | None = None):
+        super().__init__("Tagged displacement")
+        self.tagged = None if particles is None else np.array(particles, dtype=np.int64)
+        self.site_ids = np.empty(0, dtype=np.int64)  # Id of the particle at each site (-1 if empty)
+        self.displacement = np.empty(0, dtype=np.int64)  # Displacement of each particle id
+
+    def reset(self, system) -> None:
+        self.site_ids = np.array(get_particle_ids(system), dtype=np.int64)
+        ids = self.site_ids[self.site_ids >= 0]
+        if self.tagged is None:
+            self.tagged = np.sort(ids)
+        self.displacement = np.zeros(int(ids.max(initial=-1)) + 1, dtype=np.int64)
+
+    def __call__(self, position: int, new_position: int, time: float) -> None:
+        particle = self.site_ids[position]
+        self.site_ids[new_position] = particle
+        self.site_ids[position] = -1
+        self.displacement[particle] += jump_displacement(position, new_position, self.n)
+
+    def value(self, timestamp: float) -> np.ndarray:
+        return self.displacement[self.tagged]
+
+    def encode_values(self, values: list[np.ndarray]) -> dict[str, np.ndarray]:
+        """ Returns the displacements (values x tagged particles) """
+        return {"values": np.array(values, dtype=np.int64).reshape(len(values), len(self.tagged))}
+
+    def decode_values(self, state: dict[str, np.ndarray]) -> list[np.ndarray]:
+        """ Returns the displacement arrays """
+        return list(state["values"])
+
+    def get_accumulators(self) -> dict[str, np.ndarray]:
+        return {"tagged": self.tagged.copy(), "site_ids": self.site_ids.copy(), "displacement": self.displacement.copy()}
+
+    def set_accumulators(self, state: dict[str, np.ndarray]) -> None:
+        self.tagged = np.array(state["tagged"], dtype=np.int64)
+        self.site_ids = np.array(state["site_ids"], dtype=np.int64)
+        self.displacement = np.array(state["displacement"], dtype=np.int64)
+
+    def record_spec(self, n: int) -> tuple[np.dtype, tuple, callable, callable]:
+        """ The displacements are stored as an integer array (the particles must be tagged, i.e. the metric attached, first) """
+        return np.int64, (len(self.tagged),), None, None
+
+    def mean_squared_displacement(self) -> np.ndarray:
+        """ Returns the mean squared displacement of the tagged particles at each timestamp """
+        return np.array([np.mean(np.square(value)) if len(value) else 0.0 for value in self.values])
+
+# =========================================
+# Density profile
+# =========================================
+
+class DensityProfileMetric(ObservableMetric):
+    """ Time-weighted mean and variance of the density of each bin of sites (the occupancy coarse-grained into bins),
+    since the metric was attached.
+
+    Between two jumps, each bin's density is constant, so it's added to the bin's Welford statistics
+    with its holding time as weight. The bins are updated lazily: a jump only adds the holding time of
+    the (at most two) bins whose density changes, in O(1), and a sample adds the pending holding times
+    of every bin to a copy. Each value is the WelfordStats of the bins at its timestamp.
+    """
+
+    # The time averages change between jumps, so the grid sampler computes them at every grid point
+    varies_between_jumps = True
+
+    # A sample copies every bin, so the profile is only sampled at the stopping time
+    recorded_at_end = True
+
+    def __init__(self, bins: int = PROFILE_BINS):
+        super().__init__("Density profile")
+        self.bins = bins
+        self.site_bins = np.empty(0, dtype=np.int64)  # Bin of each site
+        self.widths = np.empty(0, dtype=np.float64)  # Number of sites of each bin
+        self.counts = np.empty(0, dtype=np.int64)  # Number of particles in each bin
+        self.last_times = np.empty(0, dtype=np.float64)  # Time until which each bin is accumulated
+        self.accumulator = WelfordStats.empty(bins)
+
+    def reset(self, system) -> None:
+        if self.bins > self.n:
+            raise ValueError(f"The density profile can't have more bins ({self.bins}) than sites ({self.n})")
+        self.site_bins = np.arange(self.n) * self.bins // self.n
+        self.widths = np.bincount(self.site_bins, minlength=self.bins).astype(np.float64)
+        self.counts = np.bincount(self.site_bins, weights=system.get_occupancy(), minlength=self.bins).astype(np.int64)
+        self.last_times = np.full(self.bins, float(system.current_time))
+        self.accumulator = WelfordStats.empty(self.bins)
+
+    def accumulate(self, bin_index: int, time: float) -> None:
+        """ Adds a bin's density with its holding time until time """
+        self.accumulator.add_at(bin_index, self.counts[bin_index] / self.widths[bin_index], time - self.last_times[bin_index])
+        self.last_times[bin_index] = time
+
+    def __call__(self, position: int, new_position: int, time: float) -> None:
+        bin_from = self.site_bins[position]
+        bin_to = self.site_bins[new_position]
+        if bin_from == bin_to:
+            return
+        self.accumulate(bin_from, time)
+        self.accumulate(bin_to, time)
+        self.counts[bin_from] -= 1
+        self.counts[bin_to] += 1
+
+    def value(self, timestamp: float) -> WelfordStats:
+        stats = self.accumulator.copy()
+        stats.add(self.counts / self.widths, timestamp - self.last_times)
+        return stats
+
+    def encode_values(self, values: list[WelfordStats]) -> dict[str, np.ndarray]:
+        """ Returns the weights, means and m2 of the values (values x 3 x bins) """
+        return {"values": np.array([encode_stats(value) for value in values]).reshape(len(values), 3, self.bins)}
+
+    def decode_values(self, state: dict[str, np.ndarray]) -> list[WelfordStats]:
+        """ Returns the Welford statistics """
+        return [WelfordStats(*record) for record in state["values"]]
+
+    def get_accumulators(self) -> dict[str, np.ndarray]:
+        return {"counts": self.counts.copy(), "last_times": self.last_times.copy(), "accumulator": encode_stats(self.accumulator)}
+
+    def set_accumulators(self, state: dict[str, np.ndarray]) -> None:
+        self.counts = np.array(state["counts"], dtype=np.int64)
+        self.last_times = np.array(state["last_times"], dtype=np.float64)
+        self.accumulator = WelfordStats(*state["accumulator"])
+
+    def record_spec(self, n: int) -> tuple[np.dtype, tuple, callable, callable]:
+        """ The Welford statistics are stored as their weights, means and m2 (3 x bins) """
+        return np.float64, (3, self.bins), encode_stats, lambda record: WelfordStats(*record)
+
+def encode_stats(stats: WelfordStats) -> np.ndarray:
+    """ Returns the weights, means and m2 of Welford statistics (3 x entries) """
+    return np.stack([stats.weight, stats.mean, stats.m2])
+
+def plot_time_averaged_profile(profile: WelfordStats) -> None:
+    """ Plots the time-averaged density profile of a run with its standard deviation in time """
+    x = (np.arange(len(profile.mean)) + 0.5) / len(profile.mean)
+    deviation = np.sqrt(profile.variance())
+    plt.plot(x, profile.mean, label="Mean")
+    plt.fill_between(x, profile.mean - deviation, profile.mean + deviation, alpha=0.3, label="Standard deviation in time")
+    plt.grid()
+    plt.xlabel("x")
+    plt.ylabel("Time-averaged density")
+    plt.legend()
+    plt.show()
+
+def plot_density_profile(ensemble: WelfordStats) -> None:
+    """ Plots the ensemble-averaged time-averaged density profile with its confidence interval """
+    x = (np.arange(len(ensemble.mean)) + 0.5) / len(ensemble.mean)
+    low, high = ensemble.confidence_interval()
+    plt.plot(x, ensemble.mean, label="Mean")
+    plt.fill_between(x, low, high, alpha=0.3, label="95% confidence interval")
+    plt.grid()
+    plt.xlabel("x")
+    plt.ylabel("Time-averaged density")
+    plt.legend()
+    plt.show()
+
+def plot_ensemble_profiles(time_grid: np.ndarray, profile: np.ndarray, curves: int = PROFILE_CURVES) -> None:
+    """ Plots the ensemble-averaged density profile (time grid x n) at evenly spaced times of the grid """
+    x = np.arange(profile.shape[1]) / profile.shape[1]
+    for index in np.unique(np.linspace(0, len(time_grid) - 1, curves).round().astype(int)):
+        plt.plot(x, profile[index], label=f"t = {time_grid[index]:.2f}")
+    plt.grid()
+    plt.xlabel("x")
+    plt.ylabel("Ensemble-averaged density")
+    plt.legend()
+    plt.show()
@@ -1,7 +1,7 @@
 """ Probability transition function """
 
-import random
 from typing import Callable
+from clock import random_source
 from position import Position
 
 # The transition function. It receives:
@@ -15,7 +15,7 @@ def symmetric_transition() -> ProbabilityTransitionFunction:
     """ Symmetric transition function """
 
     def rule(position: Position, n: int) -> Position:
-        shift = random.choice([-1, 1]) # Randomly chose to go left or right
+        shift = random_source.direction() # Randomly chose to go left or right
         new_position = position + shift
         return new_position % n
     return rule
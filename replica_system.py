@@ -0,0 +1,156 @@
+""" Replica System """
+
+from dataclasses import dataclass
+import numpy as np
+import clock
+from jump_kernels import JumpKernel
+from simulator import SimulatorConfig, get_site_rates
+from system import create_initial_state
+
+@dataclass
+class ReplicaSystem:
+    """ Lock-step engine for R independent replicas of the same configuration.
+
+    Every step advances each replica by one event with vectorized operations across the replica axis,
+    so the Python overhead of an event is paid once for all the replicas.
+    Since every replica has the same number of particles m, the events are drawn by uniformization:
+    each replica's next event happens after an exponential time of rate m * max_rate, a uniform particle
+    is picked and its clock is accepted with probability rate(site)/max_rate (so any per-site rate profile works).
+    The accepted particle then tries to jump to a uniform neighbour, or to a target drawn from the jump kernel
+    (the targets of all the replicas are sampled at once from its alias table).
+    The time each site has been occupied is accumulated lazily, when its particle leaves, so the time-averaged
+    occupancy of every replica costs O(1) per event.
+
+    The system is characterized by:
+    - n: the torus' size
+    - occupancy: uint8 array (replicas x n) with 1 where there's a particle and 0 otherwise
+    - particles: array (replicas x m) with the position of each particle
+    - rates: float64 array with the clock rate of each site
+    - current_time: float64 array with the current time of each replica
+    - occupied_time: float64 array (replicas x n) with the time each site has been occupied, until its particle's arrival
+    - occupied_since: float64 array (replicas x n) with the arrival time of each site's particle
+    - kernel: the jump kernel (None for the symmetric nearest-neighbour jumps)
+    """
+    n: int
+    occupancy: np.ndarray
+    particles: np.ndarray
+    rates: np.ndarray
+    current_time: np.ndarray
+    occupied_time: np.ndarray
+    occupied_since: np.ndarray
+    kernel: JumpKernel | None
+
+    def __init__(self, n: int, occupancy: np.ndarray, rates: list[float], kernel: JumpKernel | None = None):
+        self.n = n
+        self.occupancy = np.array(occupancy, dtype=np.uint8)
+        replicas = self.occupancy.shape[0]
+
+        if replicas == 0:
+            raise ValueError("The replica system needs at least one replica")
+        num_particles = self.occupancy.sum(axis=1)
+        if (num_particles != num_particles[0]).any():
+            raise ValueError("Every replica must have the same number of particles")
+        # The uniformization rate is proportional to the number of particles
+        if num_particles[0] == 0:
+            raise ValueError("Every replica needs at least one particle")
+
+        # Row-major order of nonzero entries gives the positions of each replica in its own row
+        self.particles = np.nonzero(self.occupancy)[1].reshape(replicas, num_particles[0])
+        self.rates = np.array(rates, dtype=np.float64)
+        self.max_rate = float(self.rates.max())
+        self.current_time = np.zeros(replicas, dtype=np.float64)
+        self.occupied_time = np.zeros((replicas, n), dtype=np.float64)
+        self.occupied_since = np.zeros((replicas, n), dtype=np.float64)
+        self.rows = np.arange(replicas)
+        self.kernel = kernel
+
+    @property
+    def replicas(self) -> int:
+        """ Returns the number of replicas """
+        return self.occupancy.shape[0]
+
+    def draw_events(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """ Draws the next event of each replica of rows. Returns:
+        - the new time of each replica
+        - the index of the triggered particle of each replica
+        - the target position of each replica's jump
+        - whether each replica's jump happens (clock accepted and target empty)
+        """
+        rng = clock.rng
+        count = len(rows)
+        num_particles = self.particles.shape[1]
+
+        new_time = self.current_time[rows] + rng.standard_exponential(count) / (num_particles * self.max_rate)
+
+        # Uniform particle, accepted according to its site's rate
+        particle = rng.integers(0, num_particles, size=count)
+        position = self.particles[rows, particle]
+        accepted = rng.random(count) * self.max_rate < self.rates[position]
+
+        if self.kernel is None:
+            # Symmetric nearest-neighbour jump
+            target = (position + 2 * rng.integers(0, 2, size=count) - 1) % self.n
+        else:
+            target = self.kernel.sample_targets(position, self.n, rng)
+        jumps = accepted & (self.occupancy[rows, target] == 0)
+        return new_time, particle, target, jumps
+
+    def apply_events(self, rows: np.ndarray, new_time: np.ndarray, particle: np.ndarray, target: np.ndarray, jumps: np.ndarray) -> None:
+        """ Applies the events drawn by draw_events for the replicas of rows """
+        moved = rows[jumps]
+        time = new_time[jumps]
+        particle = particle[jumps]
+        source = self.particles[moved, particle]
+        target = target[jumps]
+
+        # The source's occupation ends and the target's starts
+        self.occupied_time[moved, source] += time - self.occupied_since[moved, source]
+        self.occupied_since[moved, target] = time
+
+        self.occupancy[moved, source] = 0
+        self.occupancy[moved, target] = 1
+        self.particles[moved, particle] = target
+        self.current_time[rows] = new_time
+
+    def process_next_event(self) -> None:
+        """ Processes the next event of every replica """
+        self.apply_events(self.rows, *self.draw_events(self.rows))
+
+    def time_averaged_occupancy(self) -> np.ndarray:
+        """ Returns the time-averaged occupancy of each site of each replica (replicas x n), from time 0 to its current time """
+        occupied_time = self.occupied_time + self.occupancy * (self.current_time[:, np.newaxis] - self.occupied_since)
+        return np.divide(occupied_time, self.current_time[:, np.newaxis],
+                         out=self.occupancy.astype(np.float64), where=self.current_time[:, np.newaxis] > 0)
+
+    def run(self, max_time: float, time_grid: list[float]) -> np.ndarray:
+        """ Runs every replica until max_time and returns the ensemble-averaged
+        density profile (time grid x n) at each time of the grid.
+        A replica stops at max_time, without the event past it, and draws no more events
+        """
+        grid = np.asarray(time_grid, dtype=np.float64)
+        profile = np.zeros((len(grid), self.n), dtype=np.float64)
+        next_index = np.zeros(self.replicas, dtype=np.int64)  # First grid point not yet recorded of each replica
+        last_index = len(grid) - 1
+
+        while len(rows := self.rows[self.current_time < max_time]) > 0:
+            new_time, particle, target, jumps = self.draw_events(rows)
+
+            # Before the jumps, record the grid points each replica goes past
+            while last_index >= 0:
+                due = (next_index[rows] <= last_index) & (grid[np.minimum(next_index[rows], last_index)] < new_time)
+                if not due.any():
+                    break
+                due_rows = rows[due]
+                np.add.at(profile, next_index[due_rows], self.occupancy[due_rows])
+                next_index[due_rows] += 1
+
+            self.apply_events(rows, np.minimum(new_time, max_time), particle, target, jumps & (new_time <= max_time))
+
+        return profile / self.replicas
+
+def create_replica_system(config: SimulatorConfig, replicas: int) -> ReplicaSystem:
+    """ Creates a replica system with the simulator's initial states, site rates and jump kernel """
+    occupancy = np.array([create_initial_state(config.n, config.density) for _ in range(replicas)], dtype=np.uint8)
+    if config.jump_kernel is not None:
+        config.jump_kernel.check(config.n)
+    return ReplicaSystem(config.n, occupancy, get_site_rates(config), config.jump_kernel)
@@ -1,17 +1,46 @@
 """ Simulator """
 
 from dataclasses import dataclass
-import math
+import os
+import time
 
 from matplotlib import pyplot as plt
 from matplotlib.animation import FuncAnimation
 import numpy as np
 from system import System, create_initial_state
+from array_system import ArraySystem
+from superposition_system import SuperpositionSystem
+from nfold_system import NFoldSystem
+from fenwick_system import FenwickSystem
 from position import Position
+import clock
 from clock import Clock, exponential_generator
 from particle import Particle
-from probability_transition_function import symmetric_transition
+from jump_kernels import JumpKernel
+from probability_transition_function import ProbabilityTransitionFunction, symmetric_transition
+from site_rates import slow_site_rates
 from metrics import (EmpiricalMeasureMetric, Metric, PositionProfileMetric)
+from observables import BondCurrentMetric, DensityProfileMetric, OccupationTimeMetric, TaggedDisplacementMetric
+from stats import PROGRESS_INTERVAL, RunStats
+from trajectory import TrajectoryRecorder
+from time_grid import GridSampler, linear_time_grid
+
+# Engines
+OBJECT_ENGINE = "object"
+ARRAY_ENGINE = "array"
+SUPERPOSITION_ENGINE = "superposition"
+NFOLD_ENGINE = "nfold"
+FENWICK_ENGINE = "fenwick"
+ENGINES = [OBJECT_ENGINE, ARRAY_ENGINE, SUPERPOSITION_ENGINE, NFOLD_ENGINE, FENWICK_ENGINE]
+
+# Recording modes
+EVENT_RECORDING = "event" # metrics are computed after every event
+TRAJECTORY_RECORDING = "trajectory" # only an event log is kept, metrics are rebuilt later
+GRID_RECORDING = "grid" # metrics are computed only at the points of a time grid
+RECORDINGS = [EVENT_RECORDING, TRAJECTORY_RECORDING, GRID_RECORDING]
+
+# Default wall-clock time (in seconds) between two checkpoints of a run
+CHECKPOINT_INTERVAL = 600.0
 
 @dataclass
 class SimulatorConfig:
@@ -21,43 +50,86 @@ class SimulatorConfig:
     beta: float
     density: float
     max_time: float
+    engine: str = OBJECT_ENGINE
+    recording: str = EVENT_RECORDING
+    time_grid: list[float] | None = None # grid recording times (default: a linear grid until max_time)
+    store: str | None = None # directory where the metrics and the trajectory are stored (default: in memory)
+    instrument: bool = False # whether the run statistics (counters and phase timers) are collected
+    observables: bool = False # whether the site 0 current and occupation time and the tagged displacements are recorded
+    profile_bins: int = 0 # number of bins of the time-averaged density profile (0: not recorded)
+    site_rates: list[float] | None = None # clock rate of each site (default: alpha/n^beta at site 0 and 1 elsewhere)
+    jump_kernel: JumpKernel | None = None # jump distribution (default: symmetric nearest-neighbour jumps)
+
+def get_site_rates(config: SimulatorConfig) -> list[float]:
+    """ Returns the clock rate of each site: the configured profile, or alpha/n^beta at site 0 and 1 elsewhere """
+    if config.site_rates is None:
+        return slow_site_rates(config.n, config.alpha, config.beta)
+    if len(config.site_rates) != config.n:
+        raise ValueError(f"Expected {config.n} site rates, got {len(config.site_rates)}")
+    return [float(rate) for rate in config.site_rates]
+
+def get_transition_function(config: SimulatorConfig) -> ProbabilityTransitionFunction:
+    """ Returns the transition function: the configured jump kernel, or the symmetric nearest-neighbour jumps """
+    if config.jump_kernel is None:
+        return symmetric_transition()
+    config.jump_kernel.check(config.n)
+    return config.jump_kernel
+
+def create_system(config: SimulatorConfig, state: list[int], rates: list[float]) -> System | ArraySystem | SuperpositionSystem | NFoldSystem | FenwickSystem:
+    """ Creates the system for the configured engine """
+    if config.engine == OBJECT_ENGINE:
+        # Create positions 0, ..., n-1
+        positions: list[Position] = []
+        for i in range(config.n):
+            # Add particle if any
+            particle = None
+            if state[i] == 1:
+                particle = Particle(i)
+
+            # Add position (the clock generator is parametrized by its mean, i.e. 1/rate)
+            position = Position(i, Clock(0, exponential_generator(1/rates[i])), particle)
+            positions.append(position)
+
+        return System(config.n, positions, get_transition_function(config))
+    if config.engine == ARRAY_ENGINE:
+        return ArraySystem(config.n, state, rates, get_transition_function(config))
+    if config.engine == SUPERPOSITION_ENGINE:
+        return SuperpositionSystem(config.n, state, rates, get_transition_function(config))
+    if config.engine == NFOLD_ENGINE:
+        if config.jump_kernel is not None:
+            raise ValueError("N-fold way engine only handles the symmetric nearest-neighbour jumps")
+        return NFoldSystem(config.n, state, rates)
+    if config.engine == FENWICK_ENGINE:
+        return FenwickSystem(config.n, state, rates, get_transition_function(config))
+    raise ValueError(f"Unknown engine: {config.engine}")
 
 class Simulator:
     """ Simulator """
 
     def __init__(self, config: SimulatorConfig):
         self.config: SimulatorConfig = config
-        self.system: System | None = None
+        self.system: System | ArraySystem | SuperpositionSystem | NFoldSystem | FenwickSystem | None = None
         self.metrics: dict[callable, Metric]| None = None
+        self.trajectory: TrajectoryRecorder | None = None
+        self.sampler: GridSampler | None = None
+        self.final_sampler: GridSampler | None = None  # Records the metrics recorded at the end at the stopping time
+        self.recorded_metrics: list[Metric] = []  # Metrics recorded after each event or on the time grid
+        self.resumed: bool = False
+        self.stats: RunStats | None = None
 
     def setup(self):
         """ Setups the simulator by:
         - creating an initial state
-        - creating the positions 0, ..., n-1
-        - initializing the metrics
+        - creating the system with the configured engine
+        - initializing the metrics (and the observables, the trajectory recorder or the grid sampler)
+        - enabling the run statistics (if configured)
         """
 
         # Create initial state
         state = create_initial_state(self.config.n, self.config.density)
 
-        # Create positions 0, ..., n-1
-        positions: list[Position] = []
-        for i in range(self.config.n):
-            # Add particle if any
-            particle = None
-            if state[i] == 1:
-                particle = Particle(i)
-
-            # Set clock rate according to position
-            rate = 1
-            if i == 0:
-                rate = self.config.alpha/pow(self.config.n, self.config.beta)
-
-            # Add position
-            position = Position(i, Clock(0, exponential_generator(rate)), particle)
-            positions.append(position)
-
-        self.system = System(self.config.n, positions, symmetric_transition())
+        # Create system
+        self.system = create_system(self.config, state, get_site_rates(self.config))
 
         # Init metrics
         self.metrics: dict[callable, Metric] = {
@@ -65,51 +137,174 @@ class Simulator:
             PositionProfileMetric: PositionProfileMetric(),
         }
 
-    def update_metrics(self, state: System) -> None:
+        # The observables follow the jumps, so they can't be rebuilt from a trajectory's snapshots
+        if (self.config.observables or self.config.profile_bins > 0) and self.config.recording == TRAJECTORY_RECORDING:
+            raise ValueError("Observables can't be rebuilt from a trajectory, use the event or grid recording")
+        if self.config.observables:
+            self.metrics.update({
+                BondCurrentMetric: BondCurrentMetric(),
+                OccupationTimeMetric: OccupationTimeMetric(),
+                TaggedDisplacementMetric: TaggedDisplacementMetric(),
+            })
+        if self.config.profile_bins > 0:
+            self.metrics[DensityProfileMetric] = DensityProfileMetric(self.config.profile_bins)
+
+        self.recorded_metrics = [metric for metric in self.metrics.values() if not metric.recorded_at_end]
+
+        # Init trajectory recording
+        if self.config.recording == TRAJECTORY_RECORDING:
+            directory = None if self.config.store is None else os.path.join(self.config.store, "trajectory")
+            self.trajectory = TrajectoryRecorder(self.system.get_occupancy(), directory=directory)
+            self.system.add_observer(self.trajectory)
+        elif self.config.recording == GRID_RECORDING:
+            time_grid = self.config.time_grid
+            if time_grid is None:
+                time_grid = linear_time_grid(self.config.max_time)
+            self.sampler = GridSampler(self.system, self.recorded_metrics, time_grid)
+            self.system.add_observer(self.sampler)
+        elif self.config.recording != EVENT_RECORDING:
+            raise ValueError(f"Unknown recording mode: {self.config.recording}")
+
+        # The metrics recorded at the end are sampled once, at the stopping time (before the jump that goes past it)
+        final_metrics = [metric for metric in self.metrics.values() if metric.recorded_at_end]
+        if final_metrics:
+            self.final_sampler = GridSampler(self.system, final_metrics, [self.config.max_time])
+            self.system.add_observer(self.final_sampler)
+
+        # Attach metrics (after the grid sampler, which must read them before they follow a jump).
+        # In trajectory recording, the metrics are rebuilt from snapshots, so they don't follow the jumps
+        if self.config.recording != TRAJECTORY_RECORDING:
+            for metric in self.metrics.values():
+                metric.attach(self.system)
+
+        # Keep the recorded values on disk (once attached, since the tagged particles are known then)
+        if self.config.store is not None:
+            for metric in self.metrics.values():
+                metric.store(os.path.join(self.config.store, type(metric).__name__), self.config.n)
+
+        if self.config.instrument:
+            self.stats = RunStats()
+            self.system.stats = self.stats
+
+    def update_metrics(self, state: System | ArraySystem | SuperpositionSystem | NFoldSystem | FenwickSystem) -> None:
         """ Updates each metric according to new state """
-        for metric in self.metrics.values():
+        if self.stats is not None:
+            start = time.perf_counter()
+        for metric in self.recorded_metrics:
             metric.add(state, state.current_time)
+        if self.stats is not None:
+            self.stats.recorded(start)
 
-    def add_repeted_metrics(self, t1: float, t2: float, delta_t: float) -> None:
-        """ The new update is only on metric t2.
-        So, from t1 to t2 (with delta_t), we copy the state on
-        t1 + delta, t1 + 2*delta, ...
-        until t2
-        we use the timestamps of the form D.DD
+    def run(self, checkpoint_path: str | None = None, checkpoint_interval: float = CHECKPOINT_INTERVAL,
+            progress_interval: float = PROGRESS_INTERVAL) -> None:
+        """ Runs the simulation until the stopping time.
+        With a checkpoint path, a checkpoint is saved every checkpoint_interval seconds (wall-clock) and at the end.
+        With the run statistics enabled, a progress line is printed every progress_interval seconds (wall-clock)
         """
-        def next_d_dd(a):
-            # Takes the minimum number of form D.DD which is greater than a
-            x = math.ceil(a * 100) / 100
-            if x == a:
-                x += delta_t
-            return x
-        t = next_d_dd(t1)
-        while t < t2:
-            # Create repeted metric values
-            for metric in self.metrics.values():
-                metric.values.append(metric.values[-1])
-                metric.timestamps.append(t)
-            # Update time
-            t += delta_t
-
-    def run(self) -> None:
-        """ Runs the simulation until the stopping time """
 
         current_time = self.system.current_time
-        time_step = 0.01
+        next_checkpoint = time.monotonic() + checkpoint_interval
+        next_progress = time.monotonic() + progress_interval
 
-        self.update_metrics(self.system)
+        # In trajectory and grid recording, the jumps are handled by the system's observers instead.
+        # A resumed run already recorded its initial state
+        record_events = self.config.recording == EVENT_RECORDING
+        if record_events and not self.resumed:
+            self.update_metrics(self.system)
 
         while current_time < self.config.max_time:
             self.system.process_next_event()
-            new_time = self.system.current_time
-            # self.add_repeted_metrics(current_time, new_time, time_step)
-            current_time = new_time
-            self.update_metrics(self.system)
+            current_time = self.system.current_time
+            if record_events:
+                self.update_metrics(self.system)
+            if checkpoint_path is not None and time.monotonic() >= next_checkpoint:
+                self.save_checkpoint(checkpoint_path)
+                next_checkpoint = time.monotonic() + checkpoint_interval
+            if self.stats is not None and time.monotonic() >= next_progress:
+                print(self.stats.progress_line(current_time, self.config.max_time), flush=True)
+                next_progress = time.monotonic() + progress_interval
+
+        # Record the grid points after the last jump
+        if self.sampler is not None:
+            self.sampler.record_until(self.config.max_time, inclusive=True)
+        if self.final_sampler is not None:
+            self.final_sampler.record_until(self.config.max_time, inclusive=True)
+
+        self.flush()
+        if checkpoint_path is not None:
+            self.save_checkpoint(checkpoint_path)
 
         return self.metrics
 
-def animate_matrics(metrics: dict[callable,Metric], config: SimulatorConfig) -> None:
-    """ Runs metrics animation """
-    metrics[PositionProfileMetric].animate(config.n)
-    metrics[EmpiricalMeasureMetric].animate(config.n)
+    def flush(self) -> None:
+        """ Writes the recorded metrics and trajectory to disk (if they are stored) """
+        for metric in self.metrics.values():
+            metric.flush()
+        if self.trajectory is not None:
+            self.trajectory.flush()
+
+    def save_checkpoint(self, path: str) -> None:
+        """ Saves a compact binary (npz) checkpoint between two events:
+        - the system's state (occupancy, pending clock times, current time)
+        - the random generator's state and the buffered random values
+        - the recorded metrics and the recording progress
+        It is written to a temporary file first, so an interrupted save keeps the previous checkpoint
+        """
+        state = {"n": np.int64(self.config.n), "engine": np.array(self.config.engine), "recording": np.array(self.config.recording)}
+        state.update(with_prefix("system", self.system.get_state()))
+        state.update(with_prefix("random", clock.get_random_state()))
+        for metric in self.metrics.values():
+            state.update(with_prefix(f"metric/{type(metric).__name__}", metric.get_state()))
+        if self.trajectory is not None:
+            state.update(with_prefix("trajectory", self.trajectory.get_state()))
+        if self.sampler is not None:
+            state.update(with_prefix("sampler", self.sampler.get_state()))
+        # The final sampler has no progress to save: it records once, at the end of the run
+
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, **state)
+        os.replace(temporary_path, path)
+
+    def load_checkpoint(self, path: str) -> None:
+        """ Restores a checkpoint saved by save_checkpoint, so the run continues exactly as the saved one would.
+        The simulator must be set up with the same torus size, engine and recording mode
+        (the stopping time may differ, e.g. to extend a run)
+        """
+        with np.load(path) as checkpoint:
+            state = {key: checkpoint[key] for key in checkpoint.files}
+        for key, value in (("n", self.config.n), ("engine", self.config.engine), ("recording", self.config.recording)):
+            if state[key].item() != value:
+                raise ValueError(f"Checkpoint has {key} {state[key].item()} but the simulator has {value}")
+
+        self.system.set_state(without_prefix("system", state))
+        clock.set_random_state(without_prefix("random", state))
+        for metric in self.metrics.values():
+            metric.set_state(without_prefix(f"metric/{type(metric).__name__}", state))
+        if self.trajectory is not None:
+            self.trajectory.set_state(without_prefix("trajectory", state))
+        if self.sampler is not None:
+            self.sampler.set_state(without_prefix("sampler", state))
+        self.resumed = True
+
+    def replay_trajectory(self, times: list[float]) -> dict[callable, Metric]:
+        """ Rebuilds the metrics at the given times from the recorded trajectory """
+        if self.trajectory is None:
+            raise AssertionError("No trajectory was recorded")
+        self.trajectory.replay(list(self.metrics.values()), times)
+        self.flush()
+        return self.metrics
+
+def with_prefix(prefix: str, state: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """ Returns the state with its keys prefixed by prefix/ """
+    return {f"{prefix}/{key}": value for key, value in state.items()}
+
+def without_prefix(prefix: str, state: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """ Returns the entries of the state whose keys start with prefix/, without the prefix """
+    start = len(prefix) + 1
+    return {key[start:]: value for key, value in state.items() if key.startswith(prefix + "/")}
+
+def animate_matrics(metrics: dict[callable,Metric], config: SimulatorConfig, workers: int | None = None) -> None:
+    """ Runs metrics animation, rendering the frames with a number of worker processes """
+    metrics[PositionProfileMetric].animate(config.n, workers)
+    metrics[EmpiricalMeasureMetric].animate(config.n, workers)
@@ -3,12 +3,85 @@
 import numpy as np
 import taichi as ti
 
+# xorshift64 random streams, used where each stream must be independent and reproducible.
+# The left shift is masked so that it never overflows (debug mode reports overflows), which keeps the same bits
+XORSHIFT_SHIFT_MASK = (1 << 39) - 1
+
+# Maximum number of x points of the metrics computed on device
+METRIC_RESOLUTION = 1000
+
+# Fields of an ExclusionProcess saved in its checkpoints
+CHECKPOINT_FIELDS = ["x", "clocks", "tree", "current_time", "rng_state", "calls_per_site", "samples", "next_sample"]
+
+def seed_states(num_streams: int, seed: int | None = None) -> np.ndarray:
+    """ Returns the (nonzero) initial states of independent random streams spawned from a root seed """
+    states = np.random.SeedSequence(seed).generate_state(num_streams, dtype=np.uint64)
+    states[states == 0] = 1
+    return states
+
+def create_rates(size: int, alpha: float, beta: float, site_rates: list[float] | None = None):
+    """ Returns a field with the clock rate of each site: alpha/(size^beta) at site 0 and 1 elsewhere,
+    unless the site rates are given (e.g. several slow sites, a slow region or a random environment)
+    """
+    if site_rates is None:
+        site_rates = [alpha / (size ** beta)] + [1.0] * (size - 1)
+    if len(site_rates) != size:
+        raise ValueError(f"Expected {size} site rates, got {len(site_rates)}")
+    rates = ti.field(ti.f32, shape=size)
+    rates.from_numpy(np.asarray(site_rates, dtype=np.float32))
+    return rates
+
+@ti.data_oriented
+class AliasFields:
+    """ Alias table of a jump kernel copied to the device, so a jump's displacement is sampled in O(1)
+    from two draws of the random stream (see sample and jump_kernels.JumpKernel). It holds:
+    - displacements: the jump displacements
+    - probability: the probability of keeping each column
+    - alias: the displacement index used instead when a column is not kept
+    """
+    def __init__(self, jump_kernel):
+        displacements, probability, alias = jump_kernel.alias_arrays()
+        self.size = len(displacements)
+        self.displacements = ti.field(ti.i32, shape=self.size)
+        self.displacements.from_numpy(displacements.astype(np.int32))
+        self.probability = ti.field(ti.f32, shape=self.size)
+        self.probability.from_numpy(probability.astype(np.float32))
+        self.alias = ti.field(ti.i32, shape=self.size)
+        self.alias.from_numpy(alias.astype(np.int32))
+
+    @ti.func
+    def sample(self, bits: ti.u64, uniform: ti.f32) -> ti.i32:
+        """ Returns the displacement sampled by 64 random bits (the column) and a uniform value in [0, 1) (the keep test).
+        A single f32 uniform only has 24 bits, too few for both the column and its keep probability on large tables
+        """
+        column = ti.i32(bits % ti.u64(self.size))
+        if uniform >= self.probability[column]:
+            column = self.alias[column]
+        return self.displacements[column]
+
+@ti.func
+def xorshift_next(state: ti.u64) -> ti.u64:
+    """ Advances a xorshift64 state """
+    state ^= state >> 12
+    state ^= (state & ti.u64(XORSHIFT_SHIFT_MASK)) << 25
+    state ^= state >> 27
+    return state
+
+@ti.func
+def xorshift_uniform(state: ti.u64) -> ti.f32:
+    """ Returns a uniform value in [0, 1) from a xorshift64 state (its 24 most significant bits) """
+    return ti.f32(state >> 40) * (1.0 / 16777216.0)
+
 
 @ti.data_oriented
 class ExclusionProcess:
     """ Exclusion process """
 
-    def __init__(self, particles: list[int], alpha: float, beta: float, max_particles_per_site: int):
+    def __init__(self, particles: list[int], alpha: float, beta: float, max_particles_per_site: int, sample_times: list[float] | None = None, seed: int | None = None,
+                 site_rates: list[float] | None = None, jump_kernel=None):
+        # The events are the rings of the occupied sites' clocks: without a particle there is no next event
+        if sum(particles) == 0:
+            raise ValueError("The exclusion process needs at least one particle")
         self.size = len(particles)
         self.alpha = alpha
         self.beta = beta
@@ -22,46 +95,109 @@ class ExclusionProcess:
         # Initialize a list of clocks for each position
         self.clocks = ti.field(ti.f32, shape=self.size)
 
+        # Tournament tree over the clocks: leaf tree_size + i holds site i, and each
+        # internal node holds the site with the minimum clock of its subtree (root at 1)
+        self.tree_size = 1
+        while self.tree_size < self.size:
+            self.tree_size *= 2
+        self.tree = ti.field(ti.i32, shape=2 * self.tree_size)
+
         # Initialize current time variable
         self.current_time = ti.field(ti.f32, shape=())
         self.current_time[None] = 0.0  # Start with current_time = 0.0
 
-        # Compute only once the parameter for the exponential distribution at site 0
-        self.exp_parameter_at_0 = ti.field(ti.f32, shape=())
-        self.exp_parameter_at_0[None] = self.alpha / (self.size ** self.beta)
+        # Compute only once the parameter of the exponential distribution at each site
+        self.rates = create_rates(self.size, self.alpha, self.beta, site_rates)
 
-        # !Deprecated for using taichi random numbers
-        # # Get Random Number Generator
-        # now = datetime.now()
-        # curr_nanoseconds = now.timestamp() * 1_000_000_000
-        # seed_for_rng = int(curr_nanoseconds % 1000)
-        # self.rng = np.random.default_rng(seed_for_rng)
+        # Alias table of the jump kernel (None for the symmetric nearest-neighbour jumps)
+        self.has_jump_kernel = jump_kernel is not None
+        self.jumps = AliasFields(jump_kernel) if self.has_jump_kernel else None
+
+        # xorshift64 random stream (instead of ti.random), so its state can be saved and restored
+        self.rng_state = ti.field(ti.u64, shape=())
+        self.rng_state[None] = seed_states(1, seed)[0]
 
         self.calls_per_site = ti.field(ti.i64, shape=self.size)
 
-    @ti.kernel
+        # Preallocated samples of the occupancy at given times (filled by the multi-step kernels)
+        sample_times = [] if sample_times is None else sample_times
+        self.num_samples = len(sample_times)
+        self.sample_times = ti.field(ti.f32, shape=max(self.num_samples, 1))
+        self.samples = ti.field(ti.i32, shape=(max(self.num_samples, 1), self.size))
+        self.next_sample = ti.field(ti.i32, shape=())
+        for s, sample_time in enumerate(sample_times):
+            self.sample_times[s] = sample_time
+
     def setup(self):
+        """ Setups the clocks' values and the tournament tree over them """
+        self.init_clocks()
+        self.build_tree()
+
+    @ti.kernel
+    def init_clocks(self):
         """ Setups the clocks' values: -1 if site is empty, else an exponential random value"""
+        # Serial, since every clock draws from the single shared random stream
+        ti.loop_config(serialize=True)
         for i in self.x:
             if self.x[i]:
                 self.clocks[i] = self.current_time[None] + self.get_exponential(i)
             else:
                 self.clocks[i] = -1
 
+    @ti.kernel
+    def build_tree(self):
+        """ Builds the tournament tree from the current clocks' values """
+        for leaf in range(self.tree_size):
+            self.tree[self.tree_size + leaf] = leaf if leaf < self.size else -1
+
+        # Internal nodes are filled bottom-up
+        ti.loop_config(serialize=True)
+        for k in range(self.tree_size - 1):
+            node = self.tree_size - 1 - k
+            self.tree[node] = self.winner(self.tree[2 * node], self.tree[2 * node + 1])
+
+    @ti.func
+    def clock_key(self, position: ti.i32) -> ti.f32:
+        """ Returns the clock value of a position, or infinity if it has no clock """
+        key = ti.math.inf
+        if position != -1 and self.clocks[position] != -1:
+            key = self.clocks[position]
+        return key
+
+    @ti.func
+    def winner(self, a: ti.i32, b: ti.i32) -> ti.i32:
+        """ Returns the position with the minimum clock among a and b """
+        ans = a
+        if self.clock_key(b) < self.clock_key(a):
+            ans = b
+        return ans
+
+    @ti.func
+    def update_tree(self, position: ti.i32):
+        """ Updates the tournament tree after a change of the clock at a position, in O(log n) """
+        node = (self.tree_size + position) // 2
+        while node >= 1:
+            self.tree[node] = self.winner(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    @ti.func
+    def random_bits(self) -> ti.u64:
+        """ Returns the next 64 bits of the process' random stream """
+        self.rng_state[None] = xorshift_next(self.rng_state[None])
+        return self.rng_state[None]
+
+    @ti.func
+    def uniform(self) -> ti.f32:
+        """ Returns a uniform value in [0, 1) from the process' random stream """
+        return xorshift_uniform(self.random_bits())
+
     @ti.func
     def get_exponential(self, position: int):
         """ Returns an exponential random value according to the position
         (the position is relevant due to the different exponential parameters at different sites)
         Generation is performed by converting an uniform random value to an exponential one
         """
-        ans = 0.0
-        if position == 0:
-            ans = -1/(self.exp_parameter_at_0[None]) * ti.log(ti.random(ti.f32))
-        else:
-            num_particles_at_site = self.x[position]
-            num_particles_at_site = 1
-            ans = -1/(num_particles_at_site) * ti.log(ti.random(float))
-        return ans
+        return -1/(self.rates[position]) * ti.log(1 - self.uniform())
 
     @ti.kernel
     def print_values(self):
@@ -69,35 +205,40 @@ class ExclusionProcess:
         for i in range(self.x.shape[0]):
             print(f"Index {i}: Particle={self.x[i]}, Value={self.clocks[i]}")
 
-    @ti.kernel
-    def process_next_event(self):
-        """ Process the next clock event, jumps the particle if possible, and updates the clocks """
+    @ti.func
+    def next_event_position(self) -> ti.i32:
+        """ Returns the position with minimum clock value (ignoring -1 values), read at the tournament tree's root """
+        selected_pos = self.tree[1]
+        if self.clock_key(selected_pos) == ti.math.inf:
+            selected_pos = -1
+        return selected_pos
 
-        # Find position with minimum clock value (ignoring -1 values)
-        min_value = float('inf')
-        selected_pos = -1
-        for i in range(self.clocks.shape[0]):
-            if self.clocks[i] != -1 and self.clocks[i] < min_value:
-                min_value = self.clocks[i]
-                selected_pos = i
+    @ti.func
+    def process_event(self, selected_pos: ti.i32):
+        """ Process the clock event at the selected position, jumps the particle if possible, and updates the clocks """
 
         # Sanity checks
         assert selected_pos != -1 # Should find a value
         assert self.x[selected_pos] >= 1 # Should have a particle at the selected site
 
         # Update current time
+        min_value = self.clocks[selected_pos]
         assert self.current_time[None] <= min_value
         self.current_time[None] = min_value
 
         self.calls_per_site[selected_pos] += 1
 
-        # Determine random jump direction (left or right) and destination
-        direction = ti.random()
+        # Determine random jump direction (left or right) and destination, or draw it from the jump kernel
         new_pos = -1
-        if direction < 0.5:  # Jump left
-            new_pos = (selected_pos - 1) % self.x.shape[0]
-        else:  # Jump right
-            new_pos = (selected_pos + 1) % self.x.shape[0]
+        if ti.static(self.has_jump_kernel):
+            bits = self.random_bits()
+            new_pos = (selected_pos + self.jumps.sample(bits, self.uniform())) % self.x.shape[0]
+        else:
+            direction = self.uniform()
+            if direction < 0.5:  # Jump left
+                new_pos = (selected_pos - 1) % self.x.shape[0]
+            else:  # Jump right
+                new_pos = (selected_pos + 1) % self.x.shape[0]
 
         # Only move the particle if the destination is empty
         if self.x[new_pos] < self.max_particles_per_site:
@@ -112,23 +253,401 @@ class ExclusionProcess:
                 self.clocks[selected_pos] = self.current_time[None] + self.get_exponential(position=selected_pos)
 
             self.clocks[new_pos] = self.current_time[None] + self.get_exponential(position=new_pos)
+            self.update_tree(new_pos)
         else:
             # If couldn't jump, restarts the clock at the selected position
             self.clocks[selected_pos] = self.current_time[None] + self.get_exponential(position=selected_pos)
 
+        self.update_tree(selected_pos)
+
+    @ti.func
+    def record_samples(self, time: ti.f32, inclusive: ti.i32):
+        """ Copies the occupancy into the samples whose time is before the given time (or equal, if inclusive) """
+        while self.next_sample[None] < self.num_samples and (
+                self.sample_times[self.next_sample[None]] < time
+                or (inclusive and self.sample_times[self.next_sample[None]] == time)):
+            s = self.next_sample[None]
+            for i in range(self.size):
+                self.samples[s, i] = self.x[i]
+            self.next_sample[None] += 1
+
+    @ti.kernel
+    def run_steps(self, steps: ti.i32):
+        """ Processes the next `steps` events in a single kernel launch """
+        ti.loop_config(serialize=True)
+        for _ in range(steps):
+            selected_pos = self.next_event_position()
+            self.record_samples(self.clocks[selected_pos], 0)
+            self.process_event(selected_pos)
+
+    @ti.kernel
+    def run_until(self, end_time: ti.f32):
+        """ Processes, in a single kernel launch, all the events until the given time """
+        ti.loop_config(serialize=True)
+        for _ in range(1):
+            selected_pos = self.next_event_position()
+            while self.clocks[selected_pos] <= end_time:
+                self.record_samples(self.clocks[selected_pos], 0)
+                self.process_event(selected_pos)
+                selected_pos = self.next_event_position()
+            self.record_samples(end_time, 1)
+
+    def process_next_event(self):
+        """ Process the next clock event, jumps the particle if possible, and updates the clocks """
+        self.run_steps(1)
+
+    def save_checkpoint(self, path: str):
+        """ Saves a compact binary (npz) checkpoint of the process: occupancy, clocks, tournament tree,
+        current time, random stream state, calls per site and the samples recorded so far
+        """
+        np.savez(path, **{name: getattr(self, name).to_numpy() for name in CHECKPOINT_FIELDS})
+
+    def load_checkpoint(self, path: str):
+        """ Restores a checkpoint saved by save_checkpoint (instead of setup), so the run continues exactly as the saved one would """
+        with np.load(path) as checkpoint:
+            for name in CHECKPOINT_FIELDS:
+                getattr(self, name).from_numpy(checkpoint[name])
+
 @ti.data_oriented
 class ExclusionProcessWithMetric(ExclusionProcess):
-    """ Exclusion Process with metrics """
-    def __init__(self, particles: list[int], alpha: float, beta: float, max_particles_per_site: int):
-        super().__init__(particles, alpha, beta, max_particles_per_site)
+    """ Exclusion Process with metrics:
+    - the empirical measure (normalized cumulative occupancy) at `resolution` evenly spaced x points
+    - the coarse-grained density in `resolution` bins
+    Both are computed on device (with a parallel prefix sum) and only the downsampled values are transferred
+    """
+    def __init__(self, particles: list[int], alpha: float, beta: float, max_particles_per_site: int, sample_times: list[float] | None = None, resolution: int | None = None, seed: int | None = None,
+                 site_rates: list[float] | None = None, jump_kernel=None):
+        super().__init__(particles, alpha, beta, max_particles_per_site, sample_times, seed, site_rates, jump_kernel)
 
         num_particles: int = len(particles)
-        self.metric_x_points = np.array([i/num_particles for i in range(num_particles)]) # Discretized t in [0, 1]
-        self.metric_values = ti.field(ti.f32, shape=(num_particles,))  # Discretized t in [0, 1]
+        self.resolution = min(num_particles, METRIC_RESOLUTION) if resolution is None else resolution
+        self.metric_x_points = np.arange(self.resolution) / self.resolution # Discretized t in [0, 1]
+        self.metric_values = ti.field(ti.f32, shape=(self.resolution,))  # Discretized t in [0, 1]
+        self.density_values = ti.field(ti.f32, shape=(self.resolution,))  # Density in each bin
+
+        # Cumulative occupancy, computed by blocks: each block is scanned in parallel,
+        # then the block offsets are added
+        self.cumulative = ti.field(ti.i32, shape=num_particles)
+        self.block_size = max(1, int(np.ceil(np.sqrt(num_particles))))
+        self.num_blocks = (num_particles + self.block_size - 1) // self.block_size
+        self.block_offsets = ti.field(ti.i32, shape=self.num_blocks)
+
+    @ti.kernel
+    def compute_cumulative(self):
+        """ Computes the cumulative occupancy with a parallel (blocked) prefix sum """
+        # Inclusive scan of each block, in parallel
+        for b in range(self.num_blocks):
+            total = 0
+            for i in range(b * self.block_size, ti.min((b + 1) * self.block_size, self.size)):
+                total += self.x[i]
+                self.cumulative[i] = total
+            self.block_offsets[b] = total
+
+        # Exclusive scan of the block totals
+        ti.loop_config(serialize=True)
+        for k in range(1):
+            offset = 0
+            for b in range(self.num_blocks):
+                total = self.block_offsets[b]
+                self.block_offsets[b] = offset
+                offset += total
+
+        # Add each block's offset, in parallel
+        for i in range(self.size):
+            self.cumulative[i] += self.block_offsets[i // self.block_size]
+
+    @ti.kernel
+    def downsample_metric(self):
+        """ Computes the empirical measure at the metric x points from the cumulative occupancy """
+        for k in range(self.resolution):
+            # Last site i with i/n <= k/resolution
+            last_site = ti.cast(ti.cast(k, ti.i64) * self.size // self.resolution, ti.i32)
+            self.metric_values[k] = self.cumulative[last_site] / self.size
 
     @ti.kernel
+    def downsample_density(self):
+        """ Computes the density in each bin from the cumulative occupancy """
+        for k in range(self.resolution):
+            start = ti.cast(ti.cast(k, ti.i64) * self.size // self.resolution, ti.i32)
+            end = ti.cast(ti.cast(k + 1, ti.i64) * self.size // self.resolution, ti.i32)
+            before = 0
+            if start > 0:
+                before = self.cumulative[start - 1]
+            self.density_values[k] = (self.cumulative[end - 1] - before) / ti.max(end - start, 1)
+
     def compute_metric(self):
         """Compute the metric for all metric x points"""
-        n = self.size
-        for k in range(len(self.metric_x_points)):
-            self.metric_values[k] = self.x[k]
+        self.compute_cumulative()
+        self.downsample_metric()
+
+    def compute_binned_density(self):
+        """ Computes the coarse-grained density in each bin """
+        self.compute_cumulative()
+        self.downsample_density()
+
+@ti.data_oriented
+class ReplicaExclusionProcess:
+    """ Exclusion process for several independent replicas run in parallel (one replica per thread).
+    The fields are indexed by (replica, site) and each replica has its own xorshift64 random stream.
+    The ensemble-averaged profile at the sample times and the calls per site are reduced on device.
+    """
+
+    def __init__(self, particles: np.ndarray, alpha: float, beta: float, max_particles_per_site: int, sample_times: list[float] | None = None, seed: int | None = None,
+                 site_rates: list[float] | None = None, jump_kernel=None):
+        particles = np.asarray(particles, dtype=np.int32)
+        if (particles.sum(axis=1) == 0).any():
+            raise ValueError("Every replica needs at least one particle")
+        self.replicas, self.size = particles.shape
+        self.alpha = alpha
+        self.beta = beta
+        self.max_particles_per_site = max_particles_per_site
+
+        # Occupancy and clocks of each replica
+        self.x = ti.field(ti.i32, shape=(self.replicas, self.size))
+        self.x.from_numpy(particles)
+        self.clocks = ti.field(ti.f32, shape=(self.replicas, self.size))
+        self.current_time = ti.field(ti.f32, shape=self.replicas)
+
+        # Tournament tree of each replica (see ExclusionProcess)
+        self.tree_size = 1
+        while self.tree_size < self.size:
+            self.tree_size *= 2
+        self.tree = ti.field(ti.i32, shape=(self.replicas, 2 * self.tree_size))
+
+        # Independent random stream of each replica
+        self.rng_state = ti.field(ti.u64, shape=self.replicas)
+        self.rng_state.from_numpy(seed_states(self.replicas, seed))
+
+        self.rates = create_rates(self.size, self.alpha, self.beta, site_rates)
+        self.has_jump_kernel = jump_kernel is not None
+        self.jumps = AliasFields(jump_kernel) if self.has_jump_kernel else None
+
+        # Reduced over the replicas
+        self.calls_per_site = ti.field(ti.i64, shape=self.size)
+
+        # Sum over the replicas of the occupancy at each sample time
+        sample_times = [] if sample_times is None else sample_times
+        self.num_samples = len(sample_times)
+        self.sample_times = ti.field(ti.f32, shape=max(self.num_samples, 1))
+        self.profile_sum = ti.field(ti.i32, shape=(max(self.num_samples, 1), self.size))
+        self.next_sample = ti.field(ti.i32, shape=self.replicas)
+        for s, sample_time in enumerate(sample_times):
+            self.sample_times[s] = sample_time
+
+    def setup(self):
+        """ Setups the clocks' values and the tournament trees over them """
+        self.init_clocks()
+        self.build_trees()
+
+    @ti.func
+    def random_bits(self, replica: ti.i32) -> ti.u64:
+        """ Returns the next 64 bits of the replica's random stream """
+        self.rng_state[replica] = xorshift_next(self.rng_state[replica])
+        return self.rng_state[replica]
+
+    @ti.func
+    def uniform(self, replica: ti.i32) -> ti.f32:
+        """ Returns a uniform value in [0, 1) from the replica's random stream """
+        return xorshift_uniform(self.random_bits(replica))
+
+    @ti.func
+    def get_exponential(self, replica: ti.i32, position: ti.i32) -> ti.f32:
+        """ Returns an exponential random value according to the position """
+        return -1 / self.rates[position] * ti.log(1 - self.uniform(replica))
+
+    @ti.kernel
+    def init_clocks(self):
+        """ Setups the clocks' values: -1 if site is empty, else an exponential random value"""
+        for r in range(self.replicas):
+            for i in range(self.size):
+                if self.x[r, i]:
+                    self.clocks[r, i] = self.current_time[r] + self.get_exponential(r, i)
+                else:
+                    self.clocks[r, i] = -1
+
+    @ti.kernel
+    def build_trees(self):
+        """ Builds the tournament trees from the current clocks' values """
+        for r in range(self.replicas):
+            for leaf in range(self.tree_size):
+                self.tree[r, self.tree_size + leaf] = leaf if leaf < self.size else -1
+            for k in range(self.tree_size - 1):
+                node = self.tree_size - 1 - k
+                self.tree[r, node] = self.winner(r, self.tree[r, 2 * node], self.tree[r, 2 * node + 1])
+
+    @ti.func
+    def clock_key(self, replica: ti.i32, position: ti.i32) -> ti.f32:
+        """ Returns the clock value of a position, or infinity if it has no clock """
+        key = ti.math.inf
+        if position != -1 and self.clocks[replica, position] != -1:
+            key = self.clocks[replica, position]
+        return key
+
+    @ti.func
+    def winner(self, replica: ti.i32, a: ti.i32, b: ti.i32) -> ti.i32:
+        """ Returns the position with the minimum clock among a and b """
+        ans = a
+        if self.clock_key(replica, b) < self.clock_key(replica, a):
+            ans = b
+        return ans
+
+    @ti.func
+    def update_tree(self, replica: ti.i32, position: ti.i32):
+        """ Updates the replica's tournament tree after a change of the clock at a position """
+        node = (self.tree_size + position) // 2
+        while node >= 1:
+            self.tree[replica, node] = self.winner(replica, self.tree[replica, 2 * node], self.tree[replica, 2 * node + 1])
+            node //= 2
+
+    @ti.func
+    def process_event(self, replica: ti.i32, selected_pos: ti.i32):
+        """ Process the replica's clock event at the selected position (see ExclusionProcess.process_event) """
+        self.current_time[replica] = self.clocks[replica, selected_pos]
+        self.calls_per_site[selected_pos] += 1
+
+        new_pos = (selected_pos + 1) % self.size
+        if ti.static(self.has_jump_kernel):
+            bits = self.random_bits(replica)
+            new_pos = (selected_pos + self.jumps.sample(bits, self.uniform(replica))) % self.size
+        elif self.uniform(replica) < 0.5:
+            new_pos = (selected_pos - 1) % self.size
+
+        if self.x[replica, new_pos] < self.max_particles_per_site:
+            self.x[replica, selected_pos] -= 1
+            self.x[replica, new_pos] += 1
+            if self.x[replica, selected_pos] == 0:
+                self.clocks[replica, selected_pos] = -1
+            else:
+                self.clocks[replica, selected_pos] = self.current_time[replica] + self.get_exponential(replica, selected_pos)
+            self.clocks[replica, new_pos] = self.current_time[replica] + self.get_exponential(replica, new_pos)
+            self.update_tree(replica, new_pos)
+        else:
+            self.clocks[replica, selected_pos] = self.current_time[replica] + self.get_exponential(replica, selected_pos)
+
+        self.update_tree(replica, selected_pos)
+
+    @ti.func
+    def record_samples(self, replica: ti.i32, time: ti.f32, inclusive: ti.i32):
+        """ Adds the replica's occupancy to the profiles whose sample time is before the given time (or equal, if inclusive) """
+        while self.next_sample[replica] < self.num_samples and (
+                self.sample_times[self.next_sample[replica]] < time
+                or (inclusive and self.sample_times[self.next_sample[replica]] == time)):
+            s = self.next_sample[replica]
+            for i in range(self.size):
+                self.profile_sum[s, i] += self.x[replica, i]
+            self.next_sample[replica] += 1
+
+    @ti.kernel
+    def run_steps(self, steps: ti.i32):
+        """ Processes the next `steps` events of every replica """
+        for r in range(self.replicas):
+            for _ in range(steps):
+                selected_pos = self.tree[r, 1]
+                self.record_samples(r, self.clock_key(r, selected_pos), 0)
+                self.process_event(r, selected_pos)
+
+    @ti.kernel
+    def run_until(self, end_time: ti.f32):
+        """ Processes the events of every replica until the given time """
+        for r in range(self.replicas):
+            selected_pos = self.tree[r, 1]
+            while self.clock_key(r, selected_pos) <= end_time:
+                self.record_samples(r, self.clock_key(r, selected_pos), 0)
+                self.process_event(r, selected_pos)
+                selected_pos = self.tree[r, 1]
+            self.record_samples(r, end_time, 1)
+
+    def mean_profiles(self) -> np.ndarray:
+        """ Returns the ensemble-averaged occupancy (sample times x sites) """
+        return self.profile_sum.to_numpy()[:self.num_samples] / self.replicas
+
+@ti.data_oriented
+class SublatticeExclusionProcess:
+    """ Approximate fixed-dt exclusion process for very large tori, updated in parallel.
+
+    Each time step is split into phases (color, direction). The sites are colored by parity
+    (if n is odd, site n-1 gets a third color), and in a phase every particle of the given color
+    tries to jump in the given direction with probability 1 - exp(-rate * dt / 2).
+    Within a phase the sources share a color and the targets don't, and all the jumps go the same way,
+    so no two jumps compete for a site and exclusion holds exactly. Each site keeps its rate (alpha/n^beta at site 0 by default).
+    The phases are run in a random order at each step, and the error is O(dt) (see sublattice_error).
+
+    Several replicas can be run at once: the fields are indexed by (replica, site).
+    Each (replica, site) draws from its own xorshift64 stream seeded from seed, so a seeded run is reproducible.
+    """
+
+    def __init__(self, particles: np.ndarray, alpha: float, beta: float, max_particles_per_site: int, seed: int | None = None,
+                 site_rates: list[float] | None = None):
+        particles = np.asarray(particles, dtype=np.int32)
+        if particles.ndim == 1:
+            particles = particles[np.newaxis, :]
+        self.replicas, self.size = particles.shape
+        self.alpha = alpha
+        self.beta = beta
+        self.max_particles_per_site = max_particles_per_site
+
+        self.x = ti.field(ti.i32, shape=(self.replicas, self.size))
+        self.x.from_numpy(particles)
+        self.current_time = 0.0
+
+        self.rates = create_rates(self.size, self.alpha, self.beta, site_rates)
+
+        # Random stream of each (replica, site): a phase draws once per source site
+        self.rng_state = ti.field(ti.u64, shape=(self.replicas, self.size))
+        self.rng_state.from_numpy(seed_states(self.replicas * self.size, seed).reshape(self.replicas, self.size))
+
+        # Phases (color, direction) and the generator of their order
+        self.num_colors = 2 if self.size % 2 == 0 else 3
+        self.phases = [(color, direction) for color in range(self.num_colors) for direction in (-1, 1)]
+        self.phase_rng = np.random.default_rng(seed)
+
+    @ti.func
+    def color(self, position: ti.i32) -> ti.i32:
+        """ Returns the color of a site: its parity, or 2 for the last site of an odd torus """
+        ans = position % 2
+        if position == self.size - 1 and self.size % 2 == 1:
+            ans = 2
+        return ans
+
+    @ti.kernel
+    def phase(self, color: ti.i32, direction: ti.i32, dt: ti.f32):
+        """ Every particle of the given color tries to jump in the given direction """
+        for r, i in ti.ndrange(self.replicas, self.size):
+            if self.color(i) == color and self.x[r, i] > 0:
+                target = (i + direction) % self.size
+                rate = self.rates[i]
+                self.rng_state[r, i] = xorshift_next(self.rng_state[r, i])
+                if self.x[r, target] < self.max_particles_per_site and xorshift_uniform(self.rng_state[r, i]) < 1 - ti.exp(-rate * dt / 2):
+                    self.x[r, i] -= 1
+                    self.x[r, target] += 1
+
+    def step(self, dt: float):
+        """ Advances the time by dt """
+        for phase in self.phase_rng.permutation(len(self.phases)):
+            color, direction = self.phases[phase]
+            self.phase(color, direction, dt)
+        self.current_time += dt
+
+    def run_until(self, end_time: float, dt: float):
+        """ Advances the time by steps of dt until the given time """
+        for _ in range(int(round((end_time - self.current_time) / dt))):
+            self.step(dt)
+
+def sublattice_error(particles: list[int], alpha: float, beta: float, dt: float, end_time: float, replicas: int = 1000, seed: int | None = None) -> tuple[float, float]:
+    """ Compares the sublattice approximation against the exact engine on a (small) torus.
+    Both are run for several replicas until end_time, and it returns:
+    - the maximum over the sites of the difference between the mean occupancies
+    - the statistical noise of that difference (standard deviation of the difference at a half-filled site)
+    """
+    replica_particles = np.tile(np.asarray(particles, dtype=np.int32), (replicas, 1))
+
+    exact = ReplicaExclusionProcess(replica_particles, alpha, beta, 1, sample_times=[end_time], seed=seed)
+    exact.setup()
+    exact.run_until(end_time)
+
+    approximate = SublatticeExclusionProcess(replica_particles, alpha, beta, 1, seed=seed)
+    approximate.run_until(end_time, dt)
+
+    error = np.abs(exact.mean_profiles()[0] - approximate.x.to_numpy().mean(axis=0)).max()
+    noise = np.sqrt(2 * 0.25 / replicas)
+    return float(error), float(noise)
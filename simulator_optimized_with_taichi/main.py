@@ -1,19 +1,31 @@
 """ Main """
 
 import argparse
-import random
+import os
+import sys
 import taichi as ti
 import matplotlib.pyplot as plt
 import numpy as np
 
 from visualization import (ExecutionConfig, visualize_particles_and_metric_combined, visualize_simulation)
-from exclusion_process import ExclusionProcessWithMetric
+from render_pipeline import COMBINED_VIEW, METRIC_VIEW, PARTICLES_VIEW, render_simulation
+from exclusion_process import ExclusionProcessWithMetric, ReplicaExclusionProcess, SublatticeExclusionProcess, sublattice_error
+
+# The jump kernels (and their alias tables) are shared with the CPU simulator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from jump_kernels import JUMP_KERNELS, SYMMETRIC_JUMPS, create_jump_kernel
 
 # Plot type
 PARTICLES = "particles"
 MEASURE = "measure"
 ALL = "all"
 COMBINED = "combined"
+HEADLESS = "headless"
+ENSEMBLE = "ensemble"
+SUBLATTICE = "sublattice"
+
+# Torus size of the sublattice error check
+ERROR_CHECK_SIZE = 50
 
 # Initialize Taichi
 ti.init(arch=ti.cpu, debug=True)
@@ -25,11 +37,103 @@ parser.add_argument("--d", type=float, required=True, help="Density of particles
 parser.add_argument("--alpha", type=float, required=True, help="Alpha value.")
 parser.add_argument("--beta", type=float, required=True, help="Beta value.")
 parser.add_argument("--max_p", type=int, required=False, default = 1, help="Maximum particles per site.")
-parser.add_argument("--steps", type=int, required=True, help="Number of steps.")
+parser.add_argument("--steps", type=int, required=False, help=f"Number of steps (required, except for a {HEADLESS} run with --time and the {ENSEMBLE} and {SUBLATTICE} runs).")
 parser.add_argument("--skipped_steps", type=int, default = 0, required=False, help="Number of steps to skip for speed-up.")
 parser.add_argument("--out", type=str, required=False, help="Output directory for video.")
 parser.add_argument("--delay", type=float, required=False, help="Time delay between iterations for better live visualization.")
-parser.add_argument("--plot", type=str, required=True, help=f"Plot to be done: {PARTICLES},{MEASURE},{ALL},{COMBINED}.")
+parser.add_argument("--plot", type=str, required=True, help=f"Plot to be done: {PARTICLES},{MEASURE},{ALL},{COMBINED},{HEADLESS},{ENSEMBLE},{SUBLATTICE}.")
+parser.add_argument("--time", type=float, required=False, help=f"Stopping time of a {HEADLESS}, {ENSEMBLE} or {SUBLATTICE} run (instead of a number of steps).")
+parser.add_argument("--samples", type=int, default=0, required=False, help=f"Number of occupancy samples of a {HEADLESS} or {ENSEMBLE} run until --time.")
+parser.add_argument("--replicas", type=int, default=1, required=False, help=f"Number of replicas of an {ENSEMBLE} run.")
+parser.add_argument("--seed", type=int, required=False, help=f"Seed of the random streams (of the replicas, in an {ENSEMBLE} run).")
+parser.add_argument("--checkpoint", type=str, required=False, help=f"Checkpoint file of a {HEADLESS} run (the run resumes from it if it exists).")
+parser.add_argument("--checkpoint_every", type=float, required=False, help=f"Simulation time between two checkpoints of a {HEADLESS} run until --time.")
+parser.add_argument("--render_workers", type=int, default=0, required=False, help=f"Number of background render processes per video (0 renders in the simulation loop with a live GUI).")
+parser.add_argument("--dt", type=float, default=0.01, required=False, help=f"Time step of a {SUBLATTICE} run.")
+parser.add_argument("--site_rates", type=str, required=False, help="Text file with the clock rate of each site (overrides --alpha and --beta).")
+parser.add_argument("--jump", type=str, default=SYMMETRIC_JUMPS, choices=JUMP_KERNELS, required=False, help=f"Jump kernel (the {SUBLATTICE} run only handles {SYMMETRIC_JUMPS} jumps).")
+parser.add_argument("--p", type=float, default=0.5, required=False, help="Probability of a right jump (asymmetric, finite_range and long_range jumps).")
+parser.add_argument("--jump_range", type=int, required=False, help="Maximum jump distance (finite_range and long_range jumps).")
+parser.add_argument("--jump_exponent", type=float, default=1.0, required=False, help="Exponent of the long_range jumps (a distance d has weight d^-(1 + exponent)).")
+parser.add_argument("--bins", type=int, default=100, required=False, help=f"Number of bins of the density profile of a {SUBLATTICE} run.")
+
+
+def load_site_rates(args) -> list[float] | None:
+    """ Returns the site rates read from the --site_rates file (None for the alpha/n^beta rate at site 0) """
+    if args.site_rates is None:
+        return None
+    return np.loadtxt(args.site_rates, dtype=np.float64, ndmin=1).tolist()
+
+def get_jump_kernel(args):
+    """ Returns the jump kernel of the --jump arguments (None for the symmetric jumps) """
+    return create_jump_kernel(args.jump, args.n, args.p, args.jump_range, args.jump_exponent)
+
+def run_ensemble(args, particles: list[int]):
+    """ Runs the replicas in parallel and plots the ensemble-averaged profiles """
+    sample_times = np.linspace(0, args.time, max(args.samples, 1)).tolist()
+
+    # Each replica starts from its own shuffled configuration, drawn from --seed
+    rng = np.random.default_rng(args.seed)
+    replica_particles = np.array([rng.permutation(particles) for _ in range(args.replicas)])
+    exclusion_process = ReplicaExclusionProcess(particles = replica_particles, alpha = args.alpha, beta = args.beta, max_particles_per_site = args.max_p, sample_times = sample_times, seed = args.seed, site_rates = load_site_rates(args), jump_kernel = get_jump_kernel(args))
+    exclusion_process.setup()
+    exclusion_process.run_until(args.time)
+
+    # Plot the ensemble-averaged profiles
+    for sample_time, profile in zip(sample_times, exclusion_process.mean_profiles()):
+        plt.plot(np.arange(args.n) / args.n, profile, label=f"t = {sample_time:.2f}")
+    plt.xlabel('x')
+    plt.ylabel('Mean occupancy')
+    plt.title(f'Ensemble-averaged profile ({args.replicas} replicas)')
+    plt.legend()
+    plt.show()
+
+    return exclusion_process
+
+def run_sublattice(args, particles: list[int]):
+    """ Runs the approximate sublattice engine and plots the binned density profile """
+    if args.jump != SYMMETRIC_JUMPS:
+        raise ValueError(f"The {SUBLATTICE} engine only handles {SYMMETRIC_JUMPS} jumps")
+
+    # Built-in error check against the exact engine on a small torus
+    small_particles = particles[::max(1, args.n // ERROR_CHECK_SIZE)][:ERROR_CHECK_SIZE]
+    error, noise = sublattice_error(small_particles, args.alpha, args.beta, args.dt, min(args.time, 10.0), seed=args.seed)
+    print(f"Sublattice error check (n={len(small_particles)}, dt={args.dt}): max error {error:.4f} (statistical noise {noise:.4f})")
+
+    exclusion_process = SublatticeExclusionProcess(particles = particles, alpha = args.alpha, beta = args.beta, max_particles_per_site = args.max_p, seed = args.seed, site_rates = load_site_rates(args))
+    exclusion_process.run_until(args.time, args.dt)
+
+    # Plot the binned density profile
+    occupancy = exclusion_process.x.to_numpy()[0]
+    bins = np.array_split(occupancy, args.bins)
+    plt.plot(np.linspace(0, 1, args.bins), [b.mean() for b in bins])
+    plt.xlabel('x')
+    plt.ylabel('Density')
+    plt.title(f'Binned density profile at t = {exclusion_process.current_time:.2f}')
+    plt.show()
+
+
+def run_headless(args, exclusion_process: ExclusionProcessWithMetric):
+    """ Runs without rendering: the events are processed on device without a Python round-trip per event.
+    With a checkpoint file, the run resumes from it and saves it periodically (every --checkpoint_every time units) and at the end
+    """
+    if args.checkpoint is not None and os.path.exists(args.checkpoint):
+        exclusion_process.load_checkpoint(args.checkpoint)
+
+    if args.time is None:
+        exclusion_process.run_steps(args.steps)
+    elif args.checkpoint is None or args.checkpoint_every is None:
+        exclusion_process.run_until(args.time)
+    else:
+        # Running until intermediate times gives exactly the same events as a single run
+        end_time = exclusion_process.current_time[None]
+        while end_time < args.time:
+            end_time = min(end_time + args.checkpoint_every, args.time)
+            exclusion_process.run_until(end_time)
+            exclusion_process.save_checkpoint(args.checkpoint)
+
+    if args.checkpoint is not None:
+        exclusion_process.save_checkpoint(args.checkpoint)
 
 
 def main():
@@ -37,18 +141,38 @@ def main():
 
     # Parse arguments
     args = parser.parse_args()
+    if args.plot in (ENSEMBLE, SUBLATTICE) and args.time is None:
+        parser.error(f"--time is required with --plot {args.plot}")
+    step_based = args.plot not in (ENSEMBLE, SUBLATTICE) and not (args.plot == HEADLESS and args.time is not None)
+    if step_based and args.steps is None:
+        parser.error(f"--steps is required with --plot {args.plot}" + (" (or --time)" if args.plot == HEADLESS else ""))
 
     # Create particles list
     num_particles = int(args.n * args.d)
+    if num_particles == 0:
+        parser.error(f"--d {args.d} gives no particle on a torus of size {args.n}")
     particles = [1] * num_particles + [0] * (args.n - num_particles)
     # random.shuffle(particles)
     # particles = 50*[0] + [100]  + [0] * 49
 
+    if args.plot == ENSEMBLE:
+        exclusion_process = run_ensemble(args, particles)
+        plot_calls_per_site(exclusion_process.calls_per_site.to_numpy())
+        return
+    if args.plot == SUBLATTICE:
+        run_sublattice(args, particles)
+        return
+
+    # Evenly spaced sample times of a headless run
+    sample_times = None
+    if args.plot == HEADLESS and args.time is not None and args.samples > 0:
+        sample_times = np.linspace(0, args.time, args.samples).tolist()
+
     # Create exclusion process object
-    exclusion_process = ExclusionProcessWithMetric(particles = particles, alpha = args.alpha, beta = args.beta, max_particles_per_site = args.max_p)
+    exclusion_process = ExclusionProcessWithMetric(particles = particles, alpha = args.alpha, beta = args.beta, max_particles_per_site = args.max_p, sample_times = sample_times, seed = args.seed, site_rates = load_site_rates(args), jump_kernel = get_jump_kernel(args))
     exclusion_process.setup()
 
-    output_dir = "./output/" + args.out
+    output_dir = "./output/" + str(args.out)
 
     ec = ExecutionConfig(
         exclusion_process = exclusion_process,
@@ -57,7 +181,12 @@ def main():
         delay = args.delay,
         output_dir=output_dir)
 
-    if args.plot == COMBINED:
+    # Videos rendered in background processes, without a live GUI
+    render_views = {COMBINED: [COMBINED_VIEW], PARTICLES: [PARTICLES_VIEW], MEASURE: [METRIC_VIEW], ALL: [PARTICLES_VIEW, METRIC_VIEW]}
+
+    if args.render_workers > 0 and args.plot in render_views:
+        render_simulation(ec, render_views[args.plot], args.render_workers)
+    elif args.plot == COMBINED:
         visualize_particles_and_metric_combined(ec)
     elif args.plot == PARTICLES:
         visualize_simulation(ec, show_particles = True, show_measure = False)
@@ -65,11 +194,16 @@ def main():
         visualize_simulation(ec, show_particles = False, show_measure = True)
     elif args.plot == ALL:
         visualize_simulation(ec, show_particles = True, show_measure = True)
+    elif args.plot == HEADLESS:
+        run_headless(args, exclusion_process)
 
     print(str(ec.exclusion_process.calls_per_site))
+    plot_calls_per_site(ec.exclusion_process.calls_per_site.to_numpy())
+
+def plot_calls_per_site(count_values: np.ndarray):
+    """ Plots the histogram of the calls per site """
 
     # Convert absolute frequencies to percentages
-    count_values = ec.exclusion_process.calls_per_site.to_numpy()
     total = sum(count_values)
     print("Total:", total)
     bins = list(range(len(count_values)))
@@ -0,0 +1,176 @@
+""" Background rendering pipeline """
+
+from dataclasses import dataclass
+import multiprocessing
+import os
+import sys
+import numpy as np
+import taichi as ti
+
+from exclusion_process import ExclusionProcessWithMetric
+from visualization import ExecutionConfig, draw_combined, draw_metric, draw_particles, skip_states_for_speed_up
+
+# The ffmpeg encoder is shared with the CPU simulator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from video import FfmpegEncoder
+
+# Views and their GUI sizes
+PARTICLES_VIEW = "particle"
+METRIC_VIEW = "metric"
+COMBINED_VIEW = "combined"
+VIEW_SIZES = {PARTICLES_VIEW: (800, 200), METRIC_VIEW: (800, 400), COMBINED_VIEW: (800, 600)}
+
+# Frames per second of the videos
+FRAMERATE = 24
+
+# Maximum number of frames waiting in each queue
+QUEUE_SIZE = 64
+
+@dataclass
+class Frame:
+    """ Compact data of a frame, sent from the simulation to the render workers:
+    - time: the simulation time
+    - torus_size: the number of sites
+    - occupancy: the occupied sites packed as bits (None if no view draws the particles)
+    - metric: the downsampled metric values (None if no view draws the metric)
+    """
+    time: float
+    torus_size: int
+    occupancy: np.ndarray | None
+    metric: np.ndarray | None
+
+    def unpack_occupancy(self) -> np.ndarray:
+        """ Returns the occupancy array (1 if a site is occupied, 0 otherwise) """
+        return np.unpackbits(self.occupancy, count=self.torus_size)
+
+def draw_frame(gui, view: str, frame: Frame, metric_x_points: np.ndarray):
+    """ Draws a frame of a view """
+    if view == PARTICLES_VIEW:
+        draw_particles(gui, frame.unpack_occupancy(), frame.time)
+    elif view == METRIC_VIEW:
+        draw_metric(gui, metric_x_points, frame.metric, frame.time)
+    else:
+        draw_combined(gui, frame.unpack_occupancy(), metric_x_points, frame.metric, frame.time)
+
+def render_worker(view: str, metric_x_points: np.ndarray, frames, images):
+    """ Draws the frames of a view off-screen and sends their raw RGB images to the encoder """
+    gui = ti.GUI(view, VIEW_SIZES[view], show_gui=False)
+    while (item := frames.get()) is not None:
+        index, frame = item
+        draw_frame(gui, view, frame, metric_x_points)
+        image = ti.tools.image.cook_image_to_bytes(gui.get_image())[:, :, :3]
+        images.put((index, image.tobytes()))
+    images.put(None)
+
+def encoder_worker(path: str, size: tuple, framerate: int, workers: int, images):
+    """ Streams the rendered images, in frame order, to an ffmpeg encoder.
+    If ffmpeg fails, the remaining images are drained (so the workers and the simulation don't block on full queues)
+    and its error is raised at the end
+    """
+    encoder = FfmpegEncoder(path, size, framerate, ti.tools.video.get_ffmpeg_path())
+
+    # The workers finish their frames out of order, so the images wait until the previous ones are written
+    pending = {}
+    next_index = 0
+    finished = 0
+    error = None
+    while finished < workers:
+        item = images.get()
+        if item is None:
+            finished += 1
+            continue
+        if error is not None:
+            continue
+        index, image = item
+        pending[index] = image
+        try:
+            while next_index in pending:
+                encoder.write(pending.pop(next_index))
+                next_index += 1
+        except RuntimeError as exception:
+            error = exception
+            pending.clear()
+
+    if error is not None:
+        raise error
+    encoder.close()
+
+class RenderPipeline:
+    """ RenderPipeline renders and encodes the video of a view in background processes.
+
+    The simulation pushes compact frames into a bounded queue and moves on.
+    Render worker processes draw the frames off-screen and an encoder process writes them,
+    in order, as raw frames to ffmpeg's stdin. The simulation only waits when the queues
+    are full, which bounds the memory used by the frames in flight.
+    """
+    def __init__(self, view: str, output_dir: str, metric_x_points: np.ndarray, workers: int,
+                 queue_size: int = QUEUE_SIZE, framerate: int = FRAMERATE):
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Fresh worker processes, so they don't inherit the simulation's Taichi runtime
+        context = multiprocessing.get_context("spawn")
+        self.frames = context.Queue(queue_size)
+        self.images = context.Queue(queue_size)
+        self.count = 0
+
+        self.workers = [context.Process(target=render_worker, args=(view, metric_x_points, self.frames, self.images))
+                        for _ in range(workers)]
+        self.path = os.path.join(output_dir, "video.mp4")
+        self.encoder = context.Process(target=encoder_worker, args=(self.path, VIEW_SIZES[view], framerate, workers, self.images))
+        for process in self.workers + [self.encoder]:
+            process.start()
+
+    def push(self, frame: Frame):
+        """ Queues a frame to be rendered """
+        self.frames.put((self.count, frame))
+        self.count += 1
+
+    def close(self):
+        """ Waits until every queued frame is encoded, and raises a RuntimeError if the encoder failed
+        (its error, with ffmpeg's output, is printed by the encoder process)
+        """
+        for _ in self.workers:
+            self.frames.put(None)
+        for process in self.workers + [self.encoder]:
+            process.join()
+        if self.encoder.exitcode != 0:
+            raise RuntimeError(f"The encoder of {self.path} failed with exit code {self.encoder.exitcode}")
+
+def render_simulation(execution_config: ExecutionConfig, views: list[str], workers: int):
+    """ Run simulation and render the videos of the views in background processes (without a live GUI) """
+
+    # Unpack config
+    exclusion_process: ExclusionProcessWithMetric = execution_config.exclusion_process
+    steps: int = execution_config.steps
+    state_skip_for_speed_up: int = execution_config.state_skip_for_speed_up
+    output_dir: str = execution_config.output_dir
+
+    torus_size = exclusion_process.x.shape[0]
+    metric_x_points = exclusion_process.metric_x_points
+
+    # The combined view is saved to the output directory, the others to a subdirectory each
+    pipelines = [RenderPipeline(view, output_dir if view == COMBINED_VIEW else os.path.join(output_dir, view), metric_x_points, workers)
+                 for view in views]
+    with_particles = any(view != METRIC_VIEW for view in views)
+    with_metric = any(view != PARTICLES_VIEW for view in views)
+
+    for _ in range(steps):
+        exclusion_process.process_next_event()
+
+        # Only the data drawn by the views is copied from the device
+        occupancy, metric = None, None
+        if with_particles:
+            occupancy = np.packbits(exclusion_process.x.to_numpy() > 0)
+        if with_metric:
+            exclusion_process.compute_metric()
+            metric = exclusion_process.metric_values.to_numpy()
+
+        frame = Frame(exclusion_process.current_time[None], torus_size, occupancy, metric)
+        for pipeline in pipelines:
+            pipeline.push(frame)
+
+        skip_states_for_speed_up(exclusion_process, state_skip_for_speed_up)
+
+    # Finalize videos
+    for pipeline in pipelines:
+        pipeline.close()
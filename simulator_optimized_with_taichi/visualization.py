@@ -4,9 +4,10 @@ from dataclasses import dataclass
 import os
 import sys
 import time
+import numpy as np
 import taichi as ti
 
-from exclusion_process import ExclusionProcess, ExclusionProcessWithMetric
+from exclusion_process import ExclusionProcessWithMetric
 
 @dataclass
 class ExecutionConfig:
@@ -23,12 +24,29 @@ def init_gui(name: str, size: tuple, output_dir: str):
     video_manager = ti.tools.VideoManager(output_dir=output_dir, framerate=24, automatic_build=False)
     return gui, video_manager
 
-def add_particles(gui, ep: ExclusionProcess, torus_size: int, x_0: float, x_scale: float, y: float):
-    # Render particles
-    for i in range(ep.size):
-        if ep.x[i] == 1:
-            x_coord = (i / torus_size) * x_scale + x_0
-            gui.circle((x_coord, y), radius=10, color=0x3D3BF3)
+def occupied_points(occupancy: np.ndarray, width: int) -> np.ndarray:
+    """ Returns the x coordinates in [0, 1) of the occupied sites.
+    If there are more sites than pixels, the sites are decimated to the pixel width
+    (a pixel is drawn if any of its sites is occupied)
+    """
+    torus_size = len(occupancy)
+    occupied = np.flatnonzero(occupancy)
+    if torus_size <= width:
+        return occupied / torus_size
+    return np.unique(occupied * width // torus_size) / width
+
+def decimate(x: np.ndarray, y: np.ndarray, width: int) -> tuple[np.ndarray, np.ndarray]:
+    """ Keeps at most `width` evenly spaced points of a curve """
+    if len(x) <= width:
+        return x, y
+    idx = np.linspace(0, len(x) - 1, width).astype(np.int64)
+    return x[idx], y[idx]
+
+def add_particles(gui, occupancy: np.ndarray, x_0: float, x_scale: float, y: float):
+    # Render particles in a single batch
+    x_coords = occupied_points(occupancy, gui.res[0]) * x_scale + x_0
+    if len(x_coords) > 0:
+        gui.circles(np.stack([x_coords, np.full(len(x_coords), y)], axis=1), radius=10, color=0x3D3BF3)
 
 def add_x_axis(gui, x0, x1, y):
     gui.line((x0, y), (x1, y), radius=2, color=0x222222)
@@ -45,37 +63,74 @@ def add_chart_labels(gui, x0, x1, y0, y1):
     gui.text(content="1", pos=(x1, y0), color=0x000000)
 
 def add_grid(gui, x0, x1, y0, y1):
-    # Grid
-    for i in range(11):
-        # Vertical
-        x_pos = x0 + i * (x1-x0)/10
-        gui.line(begin=(x_pos, y0), end=(x_pos, y1), radius=1, color=0xDDDDDD)
+    # Grid: vertical and horizontal lines in a single batch
+    x_pos = np.linspace(x0, x1, 11)
+    y_pos = np.linspace(y0, y1, 11)
+    begin = np.concatenate([np.stack([x_pos, np.full(11, y0)], axis=1), np.stack([np.full(11, x0), y_pos], axis=1)])
+    end = np.concatenate([np.stack([x_pos, np.full(11, y1)], axis=1), np.stack([np.full(11, x1), y_pos], axis=1)])
+    gui.lines(begin=begin, end=end, radius=1, color=0xDDDDDD)
+
+def add_metric(gui, x, y, base=0.5):
+    # Keep at most one point per pixel
+    x, y = decimate(np.asarray(x), np.asarray(y), gui.res[0])
+    if len(x) < 2:
+        return
+    left = np.stack([x[:-1], y[:-1]], axis=1)
+    right = np.stack([x[1:], y[1:]], axis=1)
+    left_base = np.stack([x[:-1], np.full(len(x) - 1, base)], axis=1)
+    right_base = np.stack([x[1:], np.full(len(x) - 1, base)], axis=1)
 
-        # Horizontal
-        y_pos = y0 + i * (y1-y0)/10
-        gui.line(begin=(x0, y_pos), end=(x1, y_pos), radius=1, color=0xDDDDDD)
-
-def add_metric(gui, x, y):
     # Draw the fill between the line and the x-axis
-    for i in range(len(x) - 1):
-        x0, y0 = x[i], y[i]
-        x1, y1 = x[i + 1], y[i + 1]
-        gui.triangle((x0, y0), (x1, y1), (x1, 0.5), color = 0x3D3BF3)
-        gui.triangle((x0, y0), (x0, 0.5), (x1, 0.5), color=0x3D3BF3)
-
+    gui.triangles(left, right, right_base, color=0x3D3BF3)
+    gui.triangles(left, left_base, right_base, color=0x3D3BF3)
 
-    for i in range(len(x) - 1):
-        gui.line(begin=(x[i], y[i]),
-                    end=(x[i + 1], y[i + 1]),
-                    radius=2,
-                    color=0x3D3BF3)
+    gui.lines(begin=left, end=right, radius=2, color=0x3D3BF3)
 
 def skip_states_for_speed_up(exclusion_process, state_skip_for_speed_up):
     if state_skip_for_speed_up > 0:
-        for _ in range(state_skip_for_speed_up):
-            exclusion_process.process_next_event()
+        exclusion_process.run_steps(state_skip_for_speed_up)
     return exclusion_process
 
+def draw_particles(gui, occupancy: np.ndarray, current_time: float):
+    """ Draws the particles GUI """
+    gui.clear(0xFFFFFF)
+    add_x_axis(gui, 0, 1, 0.5)
+    add_particles(gui, occupancy, 0, 1, 0.5)
+    add_time(gui, current_time, (0.8, 0.92))
+
+def draw_metric(gui, x: np.ndarray, y: np.ndarray, current_time: float):
+    """ Draws the metric GUI """
+    gui.clear(0xFFFFFF)
+    add_x_axis(gui, 0.1, 0.9, 0.1)
+    add_y_axis(gui, 0.1, 0.1, 0.9)
+    add_chart_labels(gui, 0.07, 0.9, 0.05, 0.92)
+    add_grid(gui, 0.1, 0.9, 0.1, 0.9)
+
+    x_scaled = (x * 0.8) + 0.1
+    y_scaled = (y * 0.8) + 0.1
+    add_metric(gui, x_scaled, y_scaled, base=0.1)
+
+    add_time(gui, current_time, (0.8, 0.92))
+
+def draw_combined(gui, occupancy: np.ndarray, x: np.ndarray, y: np.ndarray, current_time: float):
+    """ Draws the particles and metric GUI """
+
+    # Scale metric to GUI coordinates (top half)
+    x_scaled = (x * 0.8) + 0.1
+    y_scaled = (y * 0.4) + 0.5
+
+    gui.clear(0xFFFFFF)
+    add_x_axis(gui, 0.1, 0.9, 0.5)
+    add_y_axis(gui, 0.1, 0.5, 0.9)
+    add_grid(gui, 0.1, 0.9, 0.5, 0.9)
+    add_chart_labels(gui, 0.07, 0.9, 0.47, 0.9)
+    add_metric(gui, x_scaled, y_scaled)
+
+    add_x_axis(gui, 0.1, 0.9, 0.25)
+    add_particles(gui, occupancy, 0.1, 0.8, 0.25)
+
+    add_time(gui, current_time, (0.8, 0.92))
+
 def visualize_simulation(execution_config: ExecutionConfig, show_particles: bool, show_measure: bool):
     """ Run simulation and visualize particles and metric """
 
@@ -86,7 +141,6 @@ def visualize_simulation(execution_config: ExecutionConfig, show_particles: bool
     delay: float = execution_config.delay
     output_dir: str = execution_config.output_dir
 
-    torus_size = exclusion_process.x.shape[0]
     last_time = 0
 
     # Create GUIs
@@ -108,10 +162,7 @@ def visualize_simulation(execution_config: ExecutionConfig, show_particles: bool
         # Render particles GUI
         # -------------------
         if show_particles:
-            particle_gui.clear(0xFFFFFF)
-            add_x_axis(particle_gui, 0, 1, 0.5)
-            add_particles(particle_gui, exclusion_process, torus_size, 0, 1, 0.5)
-            add_time(particle_gui, current_time, (0.8, 0.92))
+            draw_particles(particle_gui, exclusion_process.x.to_numpy(), current_time)
             particle_video_manager.write_frame(particle_gui.get_image())
             particle_gui.show()
 
@@ -119,21 +170,8 @@ def visualize_simulation(execution_config: ExecutionConfig, show_particles: bool
         # Render metric GUI
         # -------------------
         if show_measure:
-            metric_gui.clear(0xFFFFFF)
-            add_x_axis(metric_gui, 0.1, 0.9, 0.1)
-            add_y_axis(metric_gui, 0.1, 0.1, 0.9)
-            add_chart_labels(metric_gui, 0.07, 0.9, 0.05, 0.92)
-            add_grid(metric_gui, 0.1, 0.9, 0.1, 0.9)
-
             exclusion_process.compute_metric()
-            x = exclusion_process.metric_x_points
-            y = exclusion_process.metric_values.to_numpy()
-            x_scaled = (x * 0.8) + 0.1
-            y_scaled = (y * 0.8) + 0.1
-            add_metric(metric_gui, x_scaled, y_scaled)
-
-            add_time(metric_gui, current_time, (0.8, 0.92))
-
+            draw_metric(metric_gui, exclusion_process.metric_x_points, exclusion_process.metric_values.to_numpy(), current_time)
             metric_video_manager.write_frame(metric_gui.get_image())
             metric_gui.show()
 
@@ -161,7 +199,6 @@ def visualize_particles_and_metric_combined(execution_config: ExecutionConfig):
     delay: float = execution_config.delay
     output_dir: str = execution_config.output_dir
 
-    torus_size = exclusion_process.x.shape[0]
     last_time = 0
 
     gui, video_manager = init_gui("Particles and Metric Visualization", (800, 600), output_dir)
@@ -177,24 +214,8 @@ def visualize_particles_and_metric_combined(execution_config: ExecutionConfig):
         # Compute metric
         # -------------------
         exclusion_process.compute_metric()
-        x = exclusion_process.metric_x_points
-        y = exclusion_process.metric_values.to_numpy()
-
-        # Scale metric to GUI coordinates (top half)
-        x_scaled = (x * 0.8) + 0.1
-        y_scaled = (y * 0.4) + 0.5
-
-        gui.clear(0xFFFFFF)
-        add_x_axis(gui, 0.1, 0.9, 0.5)
-        add_y_axis(gui, 0.1, 0.5, 0.9)
-        add_grid(gui, 0.1, 0.9, 0.5, 0.9)
-        add_chart_labels(gui, 0.07, 0.9, 0.47, 0.9)
-        add_metric(gui, x_scaled, y_scaled)
-
-        add_x_axis(gui, 0.1, 0.9, 0.25)
-        add_particles(gui, exclusion_process, torus_size, 0.1, 0.8, 0.25)
-
-        add_time(gui, current_time, (0.8, 0.92))
+        draw_combined(gui, exclusion_process.x.to_numpy(), exclusion_process.metric_x_points,
+                      exclusion_process.metric_values.to_numpy(), current_time)
 
         # Save to video
         video_manager.write_frame(gui.get_image())
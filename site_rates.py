@@ -0,0 +1,19 @@
+""" Site rate profiles """
+
+import numpy as np
+
+def slow_site_rates(n: int, alpha: float, beta: float) -> list[float]:
+    """ Returns the default profile: alpha/n^beta at site 0 and 1 elsewhere """
+    rates = [1.0] * n
+    rates[0] = alpha/pow(n, beta)
+    return rates
+
+def random_environment_rates(n: int, low: float, high: float, seed: int | None = None) -> list[float]:
+    """ Returns a random environment: independent uniform rates in [low, high).
+    It has its own generator, so the same seed gives the same environment to every run
+    """
+    return np.random.default_rng(seed).uniform(low, high, size=n).tolist()
+
+def load_site_rates(path: str) -> list[float]:
+    """ Reads a profile from a text file (one rate per site, whitespace separated) """
+    return np.loadtxt(path, dtype=np.float64, ndmin=1).tolist()
@@ -0,0 +1,99 @@
+""" Run statistics """
+
+import time
+
+# Phases of an event timed by the instrumentation
+SELECTION_PHASE = "selection" # picking the triggered clock (heap pop, or superposed clock and sampling)
+JUMP_PHASE = "jump" # trying the jump: target, state and clock updates
+METRICS_PHASE = "metrics" # recording the metrics (after each event, or in the jump observers)
+PHASES = [SELECTION_PHASE, JUMP_PHASE, METRICS_PHASE]
+
+# Default wall-clock time (in seconds) between two progress lines
+PROGRESS_INTERVAL = 10.0
+
+class RunStats:
+    """ RunStats holds the opt-in counters and phase timers of a run:
+    - events: the processed clock events
+    - jumps: the successful jumps (the other events are blocked jumps)
+    - triggers_at_0: the events triggered by the clock of site 0
+    - stale_entries: the popped heap entries that no longer matched their clock
+      (always 0 with the indexed TimestampHeap, which updates its entries in place)
+    - queue_size, max_queue_size: the current and largest number of pending events
+      (heap entries, occupied sites or mobile moves, depending on the engine)
+    - phase_times: the wall-clock seconds spent in each phase
+
+    A system only calls it when its stats attribute is set, so a run without instrumentation
+    pays a single None check per event.
+    """
+    def __init__(self):
+        self.events = 0
+        self.jumps = 0
+        self.triggers_at_0 = 0
+        self.stale_entries = 0
+        self.queue_size = 0
+        self.max_queue_size = 0
+        self.phase_times = dict.fromkeys(PHASES, 0.0)
+        self.start_time = time.perf_counter()
+        self.observed_time = 0.0  # Time spent in the observers during the current event
+
+    @property
+    def blocked_jumps(self) -> int:
+        """ Returns the number of events whose jump was blocked by an occupied target """
+        return self.events - self.jumps
+
+    def selected(self, position: int, start: float, queue_size: int) -> float:
+        """ Records the selection of an event started at start, and returns the start of its jump phase """
+        now = time.perf_counter()
+        self.phase_times[SELECTION_PHASE] += now - start
+        self.events += 1
+        if position == 0:
+            self.triggers_at_0 += 1
+        self.queue_size = queue_size
+        self.max_queue_size = max(self.max_queue_size, queue_size)
+        self.observed_time = 0.0
+        return now
+
+    def notify(self, observers: list, position: int, new_position: int, time_of_jump: float) -> None:
+        """ Records a successful jump and notifies the observers (timed as metric recording) """
+        self.jumps += 1
+        start = time.perf_counter()
+        for observer in observers:
+            observer(position, new_position, time_of_jump)
+        elapsed = time.perf_counter() - start
+        self.phase_times[METRICS_PHASE] += elapsed
+        self.observed_time += elapsed
+
+    def processed(self, start: float) -> None:
+        """ Records the end of an event's jump phase started at start (without the observers' time) """
+        self.phase_times[JUMP_PHASE] += time.perf_counter() - start - self.observed_time
+
+    def recorded(self, start: float) -> None:
+        """ Records a metric recording started at start """
+        self.phase_times[METRICS_PHASE] += time.perf_counter() - start
+
+    def summary(self) -> dict:
+        """ Returns the counters, the event rate and the share of each phase in the timed time """
+        elapsed = time.perf_counter() - self.start_time
+        timed = sum(self.phase_times.values())
+        return {
+            "events": self.events,
+            "jumps": self.jumps,
+            "blocked_jumps": self.blocked_jumps,
+            "triggers_at_0": self.triggers_at_0,
+            "stale_entries": self.stale_entries,
+            "queue_size": self.queue_size,
+            "max_queue_size": self.max_queue_size,
+            "wall_time": elapsed,
+            "events_per_second": self.events / elapsed if elapsed > 0 else 0.0,
+            "phase_times": dict(self.phase_times),
+            "phase_shares": {phase: seconds / timed if timed > 0 else 0.0 for phase, seconds in self.phase_times.items()},
+        }
+
+    def progress_line(self, current_time: float, max_time: float) -> str:
+        """ Returns a one-line progress report of a run until max_time """
+        summary = self.summary()
+        shares = " ".join(f"{phase} {share:.0%}" for phase, share in summary["phase_shares"].items())
+        return (f"t={current_time:.4g}/{max_time:.4g} ({current_time / max_time:.1%}) "
+                f"events={self.events} ({summary['events_per_second']:.0f}/s) "
+                f"jumps={self.jumps} blocked={self.blocked_jumps} site 0={self.triggers_at_0} "
+                f"queue={self.queue_size} stale={self.stale_entries} | {shares}")
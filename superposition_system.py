@@ -0,0 +1,136 @@
+""" Superposition System """
+
+from dataclasses import dataclass
+import time
+import numpy as np
+import clock
+from indexed_set import IndexedSet
+from probability_transition_function import ProbabilityTransitionFunction
+from stats import RunStats
+from system import JumpObserver
+
+@dataclass
+class SuperpositionSystem:
+    """ Rejection-free engine without one clock per particle.
+
+    The superposition of the particles' exponential clocks is itself an exponential clock
+    with rate (#particles off site 0) * bulk_rate + occ(0) * rate_at_0.
+    So each event draws a single exponential time and then the triggered particle:
+    the one at site 0 with probability rate_at_0 / total_rate, otherwise a uniform one
+    among the occupied sites != 0.
+
+    The system is characterized by:
+    - n: the torus' size
+    - occupancy: uint8 array with 1 where there's a particle and 0 otherwise
+    - bulk_rate: the clock rate of the sites != 0
+    - rate_at_0: the clock rate of site 0
+    - occupied: the occupied sites != 0 (allows uniform sampling in O(1))
+    - transition_function: a transition function that accepts (a position, the torus size) and returns a new position
+    - current_time: the current time
+    - observers: the jump observers notified before each particle jump
+    - stats: the run statistics (None unless the instrumentation is enabled)
+    """
+    n: int
+    occupancy: np.ndarray
+    bulk_rate: float
+    rate_at_0: float
+    occupied: IndexedSet
+    transition_function: ProbabilityTransitionFunction
+    current_time: float
+    observers: list[JumpObserver]
+    stats: RunStats | None
+
+    def __init__(self, n: int, occupancy: list[int], rates: list[float], transition_function: ProbabilityTransitionFunction):
+        if len(set(rates[1:])) > 1:
+            raise ValueError("Superposition engine requires the same rate at every site != 0 (use the fenwick engine for other profiles)")
+
+        self.n = n
+        self.occupancy = np.array(occupancy, dtype=np.uint8)
+        self.bulk_rate = float(rates[1]) if n > 1 else 0.0
+        self.rate_at_0 = float(rates[0])
+        self.occupied = IndexedSet([idx for idx in np.flatnonzero(self.occupancy).tolist() if idx != 0])
+        self.transition_function = transition_function
+        self.current_time = 0
+        self.observers = []
+        self.stats = None
+
+    def is_empty(self, position: int) -> bool:
+        """ Returns whether a position is empty or not """
+        return self.occupancy[position] == 0
+
+    def get_occupancy(self) -> np.ndarray:
+        """ Returns the occupancy array (1 if there's a particle, 0 otherwise) """
+        return self.occupancy
+
+    def total_rate(self) -> float:
+        """ Returns the rate of the superposed clock """
+        return len(self.occupied) * self.bulk_rate + self.occupancy[0] * self.rate_at_0
+
+    def add_observer(self, observer: JumpObserver) -> None:
+        """ Adds an observer notified before each particle jump """
+        self.observers.append(observer)
+
+    def move(self, position: int, new_position: int) -> None:
+        """ Moves a particle to a new position.
+        It assumes the new position is empty
+        """
+        if not self.is_empty(new_position):
+            raise AssertionError("Position is occupied")
+        if self.is_empty(position):
+            raise AssertionError("No particle is position")
+
+        # Notify observers while the state is still the one before the jump
+        if self.stats is None:
+            for observer in self.observers:
+                observer(position, new_position, self.current_time)
+        else:
+            self.stats.notify(self.observers, position, new_position, self.current_time)
+
+        # Update state
+        self.occupancy[new_position] = 1
+        self.occupancy[position] = 0
+        if position != 0:
+            self.occupied.remove(position)
+        if new_position != 0:
+            self.occupied.add(new_position)
+
+    def select_position(self, total_rate: float) -> int:
+        """ Selects the position whose clock triggered """
+        weight_at_0 = self.occupancy[0] * self.rate_at_0
+        if weight_at_0 > 0 and clock.random_source.uniform() * total_rate < weight_at_0:
+            return 0
+        return self.occupied.choice(clock.random_source.uniform())
+
+    def process_next_event(self) -> None:
+        """ Processes the next event """
+        total_rate = self.total_rate()
+        if total_rate <= 0:
+            raise AssertionError("No more events in the queue")
+
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
+        self.current_time += clock.random_source.exponential() / total_rate
+        position = self.select_position(total_rate)
+        if stats is not None:
+            start = stats.selected(position, start, len(self.occupied) + int(self.occupancy[0]))
+
+        # Try to move the triggered particle (a blocked jump changes nothing, clocks are memoryless)
+        new_position = self.transition_function(position, self.n)
+        if self.is_empty(new_position):
+            self.move(position, new_position)
+
+        if stats is not None:
+            stats.processed(start)
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the state as arrays: occupancy, occupied sites (in sampling order) and current time """
+        return {"occupancy": self.occupancy.copy(), "occupied": np.array(self.occupied.items, dtype=np.int64),
+                "current_time": np.float64(self.current_time)}
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        self.occupancy[:] = state["occupancy"]
+        self.occupied = IndexedSet(state["occupied"].tolist())
+        self.current_time = float(state["current_time"])
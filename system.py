@@ -1,12 +1,22 @@
 """ System """
 
 from dataclasses import dataclass
-import random
+import time
+from typing import Callable
 import numpy as np
+import clock
+from particle import Particle
 from position import Position
 from probability_transition_function import ProbabilityTransitionFunction
+from stats import RunStats
 from timestamp_heap import TimestampHeap
 
+# A jump observer is notified right before a particle jumps. It receives:
+# - the particle's position
+# - the new position
+# - the jump time
+JumpObserver = Callable[[int, int, float], None]
+
 @dataclass
 class System:
     """ The system is characterized by:
@@ -15,12 +25,16 @@ class System:
     - transition_function: a transition function that accepts (a position, the torus size) and returns a new position
     - event_queue: a queue with clock expiry events
     - current_time: the current time
+    - observers: the jump observers notified before each particle jump
+    - stats: the run statistics (None unless the instrumentation is enabled)
     """
     n: int
     positions: list[Position]
     transition_function: ProbabilityTransitionFunction
     event_queue: TimestampHeap
     current_time: float
+    observers: list[JumpObserver]
+    stats: RunStats | None
 
     def __init__(self, n: int, positions: list[Position], transition_function: ProbabilityTransitionFunction):
         self.n = n
@@ -28,6 +42,8 @@ class System:
         self.transition_function = transition_function
         self.event_queue = TimestampHeap()
         self.current_time = 0
+        self.observers = []
+        self.stats = None
 
         # Fill up the queue
         for idx, position in enumerate(self.positions):
@@ -54,6 +70,14 @@ class System:
         """ Get the triggering time of the clock of a given position """
         return self.positions[position].clock.next_time
 
+    def get_occupancy(self) -> np.ndarray:
+        """ Returns the occupancy array (1 if there's a particle, 0 otherwise) """
+        return np.fromiter((position.particle is not None for position in self.positions), dtype=np.uint8, count=self.n)
+
+    def add_observer(self, observer: JumpObserver) -> None:
+        """ Adds an observer notified before each particle jump """
+        self.observers.append(observer)
+
     def move(self, position: int, new_position: int) -> None:
         """ Moves a particle to a new position.
         It assumes the new position is empty
@@ -63,6 +87,13 @@ class System:
         if self.is_empty(position):
             raise AssertionError("No particle is position")
 
+        # Notify observers while the state is still the one before the jump
+        if self.stats is None:
+            for observer in self.observers:
+                observer(position, new_position, self.current_time)
+        else:
+            self.stats.notify(self.observers, position, new_position, self.current_time)
+
         # Update state
         self.positions[new_position].particle = self.positions[position].particle
         self.positions[position].particle = None
@@ -89,13 +120,55 @@ class System:
 
     def process_next_event(self) -> None:
         """ Processes the next event """
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
         result = self.event_queue.pop_min()
         if result is None:
             raise AssertionError("No more events in the queue")
 
         position = result[0]
         self.current_time = result[1]
+
+        if stats is None:
+            self.clock_triggered(position, self.current_time)
+            return
+
+        if self.get_next_trigger_time(position) != self.current_time:
+            stats.stale_entries += 1
+        start = stats.selected(position, start, len(self.event_queue) + 1)
         self.clock_triggered(position, self.current_time)
+        stats.processed(start)
+
+    def particle_ids(self) -> np.ndarray:
+        """ Returns the id of the particle at each position (-1 if empty) """
+        return np.array([-1 if position.particle is None else position.particle.id for position in self.positions], dtype=np.int64)
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the state as arrays: particle ids (-1 if empty), clock times, event queue and current time """
+        next_times = np.array([position.clock.next_time for position in self.positions], dtype=np.float64)
+        return {"particle_ids": self.particle_ids(), "next_times": next_times, **get_queue_state(self.event_queue),
+                "current_time": np.float64(self.current_time)}
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        for position, particle_id, next_time in zip(self.positions, state["particle_ids"].tolist(), state["next_times"].tolist()):
+            position.particle = None if particle_id == -1 else Particle(particle_id)
+            position.clock.next_time = next_time
+        set_queue_state(self.event_queue, state)
+        self.current_time = float(state["current_time"])
+
+def get_queue_state(event_queue: TimestampHeap) -> dict[str, np.ndarray]:
+    """ Returns the entries of an event queue as arrays, in heap order """
+    return {
+        "queue_times": np.array([timestamp for timestamp, _ in event_queue.heap], dtype=np.float64),
+        "queue_keys": np.array([key for _, key in event_queue.heap], dtype=np.int64),
+    }
+
+def set_queue_state(event_queue: TimestampHeap, state: dict[str, np.ndarray]) -> None:
+    """ Restores the entries of an event queue saved by get_queue_state """
+    event_queue.restore(zip(state["queue_times"].tolist(), state["queue_keys"].tolist()))
 
 def create_initial_state(n, density=0.5) -> np.ndarray[int]:
     """ Creates an initial state """
@@ -104,5 +177,5 @@ def create_initial_state(n, density=0.5) -> np.ndarray[int]:
 
     occupied_spaces = int(density * n)
     state = [1] * occupied_spaces + [0] * (n - occupied_spaces)
-    random.shuffle(state)
+    clock.rng.shuffle(state)
     return state
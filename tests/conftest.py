@@ -0,0 +1,58 @@
+""" Shared test fixtures """
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import clock
+from simulator import Simulator, SimulatorConfig
+from welford import WelfordStats
+
+# Number of standard errors tolerated between two engines' mean occupations
+TOLERANCE = 4.0
+
+def time_averaged_occupation(system, max_time: float) -> np.ndarray:
+    """ Runs a system until max_time and returns the time-averaged occupation of each site """
+    occupation = np.zeros(system.n, dtype=np.float64)
+    current_occupancy = system.get_occupancy().astype(np.float64)
+    last_time = system.current_time
+    while True:
+        system.process_next_event()
+        next_time = min(system.current_time, max_time)
+        occupation += current_occupancy * (next_time - last_time)
+        if system.current_time >= max_time:
+            break
+        current_occupancy = system.get_occupancy().astype(np.float64)
+        last_time = next_time
+    return occupation / max_time
+
+@pytest.fixture
+def occupation_statistics():
+    """ Returns a function running seeded replicas of a configuration, which returns the mean
+    time-averaged occupation of each site and its standard error
+    """
+    def statistics(config: SimulatorConfig, replicas: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+        occupations = []
+        for replica_seed in np.random.SeedSequence(seed).spawn(replicas):
+            clock.seed_rng(replica_seed)
+            simulator = Simulator(config)
+            simulator.setup()
+            occupations.append(time_averaged_occupation(simulator.system, config.max_time))
+        occupations = np.array(occupations)
+        return occupations.mean(axis=0), occupations.std(axis=0, ddof=1) / np.sqrt(replicas)
+    return statistics
+
+def replica_statistics(ensemble: WelfordStats) -> tuple[np.ndarray, np.ndarray]:
+    """ Returns the mean and standard error of each entry of statistics with one value per replica """
+    return ensemble.mean, np.sqrt(ensemble.sample_variance() / ensemble.weight)
+
+def assert_same_occupation(expected: tuple[np.ndarray, np.ndarray], actual: tuple[np.ndarray, np.ndarray]) -> None:
+    """ Asserts that two engines' mean occupations match at every site within TOLERANCE standard errors """
+    (expected_mean, expected_error), (actual_mean, actual_error) = expected, actual
+    tolerance = TOLERANCE * np.sqrt(expected_error ** 2 + actual_error ** 2)
+    mismatches = np.flatnonzero(np.abs(expected_mean - actual_mean) > tolerance)
+    assert len(mismatches) == 0, (f"Sites {mismatches.tolist()}: expected {expected_mean[mismatches]}, "
+                                  f"got {actual_mean[mismatches]} (tolerance {tolerance[mismatches]})")
@@ -0,0 +1,54 @@
+""" Fenwick engine tests """
+
+from dataclasses import replace
+import numpy as np
+from conftest import assert_same_occupation
+from fenwick_tree import FenwickTree
+from simulator import FENWICK_ENGINE, OBJECT_ENGINE, SimulatorConfig
+from site_rates import random_environment_rates
+
+# Replicas run by each engine
+REPLICAS = 40
+
+def test_tree_matches_brute_force():
+    """ Prefix sums and searches match the cumulative sums of the weights after random updates """
+    rng = np.random.default_rng(0)
+    weights = rng.random(37) * (rng.random(37) < 0.7)
+    tree = FenwickTree(weights.tolist())
+    for _ in range(500):
+        index = int(rng.integers(len(weights)))
+        weights[index] = rng.random() if rng.random() < 0.7 else 0.0
+        tree.update(index, float(weights[index]))
+
+        cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+        assert np.allclose([tree.prefix_sum(count) for count in range(len(weights) + 1)], cumulative)
+        if cumulative[-1] > 0:
+            value = rng.random() * cumulative[-1]
+            found = tree.find(value)
+            assert weights[found] > 0
+            assert cumulative[found] - 1e-12 <= value < cumulative[found + 1] + 1e-12
+
+def test_rebuild_clears_rounding_errors():
+    """ After many updates of weights of different magnitudes, the partial sums of an emptied tree
+    are exactly 0 again within size updates (the next rebuild)
+    """
+    rng = np.random.default_rng(1)
+    size = 64
+    tree = FenwickTree([0.0] * size)
+    for _ in range(10 * size + 17):
+        tree.update(int(rng.integers(size)), float(10.0 ** rng.uniform(-8, 8)))
+    for index in range(2 * size):
+        tree.update(index % size, 0.0)
+    assert tree.total() == 0.0
+    assert tree.tree == [0.0] * (size + 1)
+
+def test_occupation_matches_object_engine(occupation_statistics):
+    """ The time-averaged occupation of each site matches the heap engine's in a random environment """
+    rates = random_environment_rates(20, 0.2, 2.0, seed=0)
+    config = SimulatorConfig(n=20, alpha=1.0, beta=1.0, density=0.4, max_time=400, engine=OBJECT_ENGINE, site_rates=rates)
+    expected = occupation_statistics(config, REPLICAS, seed=1)
+    actual = occupation_statistics(replace(config, engine=FENWICK_ENGINE), REPLICAS, seed=2)
+
+    # Slow sites hold more particles than fast ones, so the comparison is sensitive to the sampling by rate
+    assert expected[0][np.argmin(rates)] > expected[0][np.argmax(rates)] + 0.2
+    assert_same_occupation(expected, actual)
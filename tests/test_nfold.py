@@ -0,0 +1,18 @@
+""" N-fold way engine tests """
+
+from dataclasses import replace
+from conftest import assert_same_occupation
+from simulator import NFOLD_ENGINE, OBJECT_ENGINE, SimulatorConfig
+
+# Replicas run by each engine
+REPLICAS = 40
+
+def test_occupation_matches_object_engine(occupation_statistics):
+    """ The time-averaged occupation of each site matches the heap engine's (with a slow site 0) """
+    config = SimulatorConfig(n=20, alpha=4.0, beta=1.0, density=0.4, max_time=400, engine=OBJECT_ENGINE)
+    expected = occupation_statistics(config, REPLICAS, seed=1)
+    actual = occupation_statistics(replace(config, engine=NFOLD_ENGINE), REPLICAS, seed=2)
+
+    # Only successful jumps are simulated, so a wrong rate of the mobile moves at site 0 shifts its occupation
+    assert expected[0][0] > expected[0][1:].mean() + 0.1
+    assert_same_occupation(expected, actual)
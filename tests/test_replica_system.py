@@ -0,0 +1,29 @@
+""" Lock-step replica engine tests """
+
+import numpy as np
+from conftest import assert_same_occupation, replica_statistics
+from ensemble import lockstep_profile_ensemble, run_profile_ensemble
+from replica_system import create_replica_system
+from simulator import SimulatorConfig
+
+# Replicas run by each engine
+REPLICAS = 40
+
+def test_profile_matches_profile_ensemble():
+    """ The time-averaged density of each site matches the heap engine replicas' (with a slow site 0) """
+    config = SimulatorConfig(n=20, alpha=4.0, beta=1.0, density=0.4, max_time=400, profile_bins=20)
+    _, ensemble = run_profile_ensemble(config, REPLICAS, workers=1, seed=1)
+    expected = replica_statistics(ensemble)
+    actual = replica_statistics(lockstep_profile_ensemble(config, REPLICAS, seed=2))
+
+    assert expected[0][0] > expected[0][1:].mean() + 0.1
+    assert_same_occupation(expected, actual)
+
+def test_replicas_stop_at_max_time():
+    """ Every replica stops exactly at max_time, and its time-averaged occupancy keeps the number of particles """
+    config = SimulatorConfig(n=30, alpha=1.0, beta=1.0, density=0.3, max_time=5.0)
+    system = create_replica_system(config, 16)
+    profile = system.run(config.max_time, [0.0, 2.5, 5.0])
+    assert (system.current_time == config.max_time).all()
+    assert np.allclose(profile.sum(axis=1), 9)
+    assert np.allclose(system.time_averaged_occupancy().sum(axis=1), 9)
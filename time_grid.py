@@ -0,0 +1,60 @@
+""" Time grid sampling """
+
+import numpy as np
+
+# Default step of the time grid
+DEFAULT_TIME_STEP = 0.01
+
+def linear_time_grid(max_time: float, dt: float = DEFAULT_TIME_STEP) -> np.ndarray:
+    """ Returns the grid 0, dt, 2*dt, ... until max_time """
+    return dt * np.arange(int(np.floor(max_time / dt + 1e-9)) + 1)
+
+def log_time_grid(max_time: float, points: int, min_time: float = DEFAULT_TIME_STEP) -> np.ndarray:
+    """ Returns the grid 0 followed by log-spaced points from min_time until max_time """
+    return np.concatenate(([0.0], np.geomspace(min_time, max_time, points)))
+
+class GridSampler:
+    """ GridSampler records metrics only at the points of a time grid.
+
+    It is a jump observer: right before a jump at time t, the state is still the one valid
+    on the grid points before t, so those points are recorded.
+    The metric value is computed once and the same value is reused for all the skipped grid points.
+    """
+    def __init__(self, system, metrics: list, times: list[float]):
+        self.system = system
+        self.metrics = metrics
+        self.times = np.asarray(times, dtype=np.float64)
+        self.next_index = 0  # Index of the first grid point not yet recorded
+
+    def __call__(self, position: int, new_position: int, time: float) -> None:
+        """ Records the grid points before the jump """
+        self.record_until(time)
+
+    def record_until(self, time: float, inclusive: bool = False) -> None:
+        """ Records the grid points before time (or until time, if inclusive) with the current state """
+        side = "right" if inclusive else "left"
+        first = self.next_index
+        last = max(first, int(np.searchsorted(self.times, time, side=side)))
+        if first == last:
+            return
+
+        # Compute each metric once and repeat its value on the skipped grid points
+        for metric in self.metrics:
+            if metric.varies_between_jumps:
+                for timestamp in self.times[first:last].tolist():
+                    metric.add(self.system, timestamp)
+                continue
+            metric.add(self.system, float(self.times[first]))
+            value = metric.values[-1]
+            for timestamp in self.times[first + 1:last].tolist():
+                metric.values.append(value)
+                metric.timestamps.append(timestamp)
+        self.next_index = last
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the recording progress """
+        return {"next_index": np.int64(self.next_index)}
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        self.next_index = int(state["next_index"])
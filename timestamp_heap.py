@@ -1,43 +1,106 @@
 """ TimestampHeap """
 
-import heapq
 from typing import Any
 
 class TimestampHeap:
     """ TimestampHeap is a structure that keeps (key, value) pairs and allows efficient:
     - retrieval of the pair with minimum value
     - update or addition of (key, value) pairs
+    - removal of a key
+
+    It is an indexed binary heap: a position map keeps where each key is in the heap,
+    so updates and removals are done in place and the heap never holds stale entries.
+    Its size is always the number of keys currently stored.
 
     Example:
     - It will be used to manage the clocks' expiry time
     """
     def __init__(self):
-        self.heap = []  # Min-heap to store (timestamp, key) pairs
-        self.timestamps = {}  # Dictionary to store current timestamp for each key
+        self.heap: list[tuple[float, Any]] = []  # Min-heap to store (timestamp, key) pairs
+        self.index: dict[Any, int] = {}  # Dictionary to store the heap position of each key
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.index
+
+    def restore(self, entries: list[tuple[float, Any]]) -> None:
+        """ Replaces the content with (timestamp, key) entries already in heap order (e.g. a saved heap) """
+        self.heap = list(entries)
+        self.index = {key: idx for idx, (_, key) in enumerate(self.heap)}
+
+    def _place(self, idx: int, entry: tuple[float, Any]) -> None:
+        """ Writes an entry at a heap position and updates the position map """
+        self.heap[idx] = entry
+        self.index[entry[1]] = idx
+
+    def _sift_up(self, idx: int) -> None:
+        """ Moves the entry at idx towards the root until the heap property holds """
+        heap = self.heap
+        entry = heap[idx]
+        while idx > 0:
+            parent = (idx - 1) >> 1
+            if heap[parent] <= entry:
+                break
+            self._place(idx, heap[parent])
+            idx = parent
+        self._place(idx, entry)
+
+    def _sift_down(self, idx: int) -> None:
+        """ Moves the entry at idx towards the leaves until the heap property holds """
+        heap = self.heap
+        size = len(heap)
+        entry = heap[idx]
+        child = 2 * idx + 1
+        while child < size:
+            # Pick the smallest child
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            self._place(idx, heap[child])
+            idx = child
+            child = 2 * idx + 1
+        self._place(idx, entry)
 
     def add_or_update(self, key: Any, timestamp: float):
         """ Adds or updates the (key, timestamp) entry """
-        # Update the dictionary with the new timestamp
-        self.timestamps[key] = timestamp
-        # Push the new value onto the heap
-        heapq.heappush(self.heap, (timestamp, key))
+        idx = self.index.get(key)
+        if idx is None:
+            # New key: append it as a leaf and restore the heap property
+            self.heap.append((timestamp, key))
+            self._sift_up(len(self.heap) - 1)
+            return
+
+        # Existing key: update it in place (decrease or increase key)
+        old_timestamp = self.heap[idx][0]
+        self.heap[idx] = (timestamp, key)
+        if timestamp < old_timestamp:
+            self._sift_up(idx)
+        else:
+            self._sift_down(idx)
 
     def remove_key(self, key):
         """ Removes an entry """
-        # Remove the key by deleting it from the dictionary
-        if key in self.timestamps:
-            del self.timestamps[key]
+        idx = self.index.pop(key, None)
+        if idx is None:
+            return
+
+        # Fill the hole with the last leaf and restore the heap property
+        last = self.heap.pop()
+        if idx < len(self.heap):
+            self._place(idx, last)
+            self._sift_up(idx)
+            self._sift_down(self.index[last[1]])
 
     def pop_min(self) -> tuple[Any, float] | None:
         """ Pops and returns the minimum entry """
-        # Remove and return the key with the minimum timestamp
-        while self.heap:
-            timestamp, key = heapq.heappop(self.heap)
-            # Check if this entry is still valid (not removed/updated)
-            if key in self.timestamps and self.timestamps[key] == timestamp:
-                del self.timestamps[key]
-                return key, timestamp
-        return None  # If the heap is empty or all entries are stale
+        if not self.heap:
+            return None  # If the heap is empty
+        timestamp, key = self.heap[0]
+        self.remove_key(key)
+        return key, timestamp
 
 if __name__ == "__main__":
     # Example usage:
@@ -52,4 +115,4 @@ if __name__ == "__main__":
     # Update key 1 and remove it later
     ts_heap.add_or_update(1, 30)
     print(ts_heap.pop_min())  # Should return (1, 30)
-    print(ts_heap.pop_min())  # Should return (1, 30)
+    print(ts_heap.pop_min())  # Should return None
@@ -0,0 +1,110 @@
+""" Trajectory """
+
+import os
+import numpy as np
+from chunked_array import ChunkedArray
+
+# A recorded jump: its time and the (from, to) positions
+MOVE_DTYPE = np.dtype([("time", np.float64), ("from", np.int32), ("to", np.int32)])
+
+# Minimum number of moves between two keyframes
+KEYFRAME_INTERVAL = 100_000
+
+class TrajectoryRecorder:
+    """ TrajectoryRecorder keeps a compact event log of a run:
+    - the initial occupancy
+    - a structured array of (time, from, to) per jump
+    - periodic keyframes (occupancy after a multiple of keyframe_interval jumps) for fast seeking
+
+    It is a jump observer, so it must be added to the system with add_observer.
+    The occupancy at any time is rebuilt lazily from the closest keyframe.
+    The moves and keyframes are chunked arrays: with a directory, they are written to disk
+    as the run goes, and a snapshot only reads the chunks it needs.
+    """
+    def __init__(self, occupancy: np.ndarray, keyframe_interval: int | None = None, directory: str | None = None):
+        self.initial = np.array(occupancy, dtype=np.uint8)
+        self.current = self.initial.copy()  # Occupancy after the last recorded jump
+
+        # Keep keyframes sparse enough so that they cost at most ~1 byte per move
+        if keyframe_interval is None:
+            keyframe_interval = max(KEYFRAME_INTERVAL, len(self.initial))
+        self.keyframe_interval = keyframe_interval
+
+        self.moves = ChunkedArray(None if directory is None else os.path.join(directory, "moves"), MOVE_DTYPE)
+        self.keyframes = ChunkedArray(None if directory is None else os.path.join(directory, "keyframes"),
+                                      np.uint8, self.initial.shape, chunk_size=1)
+        self.keyframes.append(self.initial)
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def __call__(self, position: int, new_position: int, time: float) -> None:
+        """ Records a jump """
+        self.moves.append((time, position, new_position))
+
+        self.current[position] = 0
+        self.current[new_position] = 1
+        if len(self.moves) % self.keyframe_interval == 0:
+            self.keyframes.append(self.current)
+
+    @property
+    def times(self) -> np.ndarray:
+        """ Returns the times of the recorded jumps """
+        return self.moves.read(0, len(self.moves))["time"]
+
+    def snapshot(self, time: float) -> np.ndarray:
+        """ Returns the occupancy at a given time """
+        # Number of jumps that happened until the given time
+        applied = self.moves.searchsorted(time, side="right", field="time")
+
+        # Start from the closest keyframe and replay the remaining jumps
+        keyframe = min(applied // self.keyframe_interval, len(self.keyframes) - 1)
+        moves = self.moves.read(keyframe * self.keyframe_interval, applied)
+
+        # Each site's occupancy is its keyframe value plus arrivals minus departures
+        occupancy = self.keyframes[keyframe].astype(np.int64)
+        np.add.at(occupancy, moves["to"], 1)
+        np.subtract.at(occupancy, moves["from"], 1)
+        return occupancy.astype(np.uint8)
+
+    def replay(self, metrics: list, times: list[float]) -> None:
+        """ Adds to each metric its value at each of the given times """
+        for time in times:
+            occupancy = self.snapshot(time)
+            for metric in metrics:
+                metric.add_occupancy(occupancy, time)
+
+    def flush(self) -> None:
+        """ Writes the recorded moves and keyframes to disk (if they are stored in a directory) """
+        self.moves.flush()
+        self.keyframes.flush()
+
+    def get_state(self) -> dict[str, np.ndarray]:
+        """ Returns the initial and current occupancies and the recorded moves and keyframes as arrays
+        (only their number, if they are stored in a directory)
+        """
+        state = {"initial": self.initial.copy(), "current": self.current.copy()}
+        if self.moves.directory is None:
+            state["moves"] = self.moves.read(0, len(self.moves))
+            state["keyframes"] = self.keyframes.read(0, len(self.keyframes))
+        else:
+            self.flush()
+            state["moves_count"] = np.int64(len(self.moves))
+            state["keyframes_count"] = np.int64(len(self.keyframes))
+        return state
+
+    def set_state(self, state: dict[str, np.ndarray]) -> None:
+        """ Restores a state returned by get_state """
+        self.initial = np.array(state["initial"], dtype=np.uint8)
+        self.current = np.array(state["current"], dtype=np.uint8)
+        if self.moves.directory is None:
+            self.moves.restore(0)
+            self.moves.extend(state["moves"])
+            self.keyframes.restore(0)
+            self.keyframes.extend(state["keyframes"])
+        else:
+            self.moves.restore(int(state["moves_count"]))
+            # The first keyframe file was overwritten by this recorder's own initial occupancy
+            self.keyframes.restore(0)
+            self.keyframes.append(self.initial)
+            self.keyframes.restore(int(state["keyframes_count"]))
@@ -0,0 +1,75 @@
+""" Parallel video encoding """
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+import subprocess
+import tempfile
+import matplotlib.pyplot as plt
+
+# Frames per second of the videos
+FRAMERATE = 30
+
+# Number of frames rendered by each task of a worker
+CHUNK_SIZE = 32
+
+class FfmpegEncoder:
+    """ FfmpegEncoder is an ffmpeg process that encodes the raw RGB frames written to its stdin.
+    Its error output goes to a temporary file (ffmpeg could block on a full pipe) and is reported if it fails
+    """
+    def __init__(self, path: str, size: tuple[int, int], fps: int, ffmpeg_path: str | None = None):
+        width, height = size
+        ffmpeg_path = plt.rcParams["animation.ffmpeg_path"] if ffmpeg_path is None else ffmpeg_path
+        command = [ffmpeg_path, "-loglevel", "error", "-y",
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                   "-c:v", "libx264", "-pix_fmt", "yuv420p", path]
+        self.path = path
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.log)
+
+    def write(self, data: bytes) -> None:
+        """ Writes raw frames, or raises a RuntimeError if ffmpeg has stopped reading them """
+        try:
+            self.process.stdin.write(data)
+            return
+        except BrokenPipeError:
+            pass
+        self.close()
+        raise RuntimeError(f"ffmpeg stopped reading the frames of {self.path}")
+
+    def close(self) -> None:
+        """ Waits until the video is encoded, and raises a RuntimeError with ffmpeg's errors if it failed """
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self.log.seek(0)
+        errors = self.log.read().decode(errors="replace").strip()
+        self.log.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.path} (exit code {returncode}): {errors}")
+
+def write_video(path: str, renderer, frames: list, workers: int | None = None, fps: int = FRAMERATE) -> None:
+    """ Renders the frames on a process pool and streams them, in order, to an ffmpeg encoder.
+
+    The renderer is a picklable callable with a size (width, height) in pixels that turns
+    a chunk of frames into their raw RGB bytes. The frames only need to support len and slicing,
+    and are sliced chunk by chunk. At most 2 chunks per worker are in flight,
+    so the memory used by the frames and the rendered frames is bounded
+    """
+    workers = workers or os.cpu_count()
+    encoder = FfmpegEncoder(path, renderer.size, fps)
+    chunks = (frames[start:start + CHUNK_SIZE] for start in range(0, len(frames), CHUNK_SIZE))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = 2 * workers
+        pending = deque()
+        for chunk in chunks:
+            if len(pending) == in_flight:
+                encoder.write(pending.popleft().result())
+            pending.append(executor.submit(renderer, chunk))
+        while pending:
+            encoder.write(pending.popleft().result())
+
+    encoder.close()
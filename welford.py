@@ -0,0 +1,72 @@
+""" Welford statistics """
+
+import numpy as np
+
+# Normal quantile of the default confidence level (95%)
+CONFIDENCE_Z = 1.96
+
+class WelfordStats:
+    """ WelfordStats keeps the streaming weighted mean and variance of arrays of values (e.g. one entry per bin):
+    - weight: the total weight of the values added to each entry
+    - mean: the weighted mean of each entry
+    - m2: the weighted sum of squared deviations from the mean of each entry
+
+    Values are added one at a time with Welford's update, so no value is kept, and two accumulators
+    of disjoint data are merged with Chan's formula, e.g. to combine replicas run in different processes.
+    With time weights it gives time averages; with unit weights (one value per replica) it gives
+    the sample variance and the confidence interval of the mean.
+    """
+    def __init__(self, weight: np.ndarray, mean: np.ndarray, m2: np.ndarray):
+        self.weight = np.array(weight, dtype=np.float64)
+        self.mean = np.array(mean, dtype=np.float64)
+        self.m2 = np.array(m2, dtype=np.float64)
+
+    @classmethod
+    def empty(cls, size: int) -> "WelfordStats":
+        """ Returns an accumulator of size entries without values """
+        return cls(np.zeros(size), np.zeros(size), np.zeros(size))
+
+    def copy(self) -> "WelfordStats":
+        """ Returns a copy """
+        return WelfordStats(self.weight, self.mean, self.m2)
+
+    def add(self, values: np.ndarray, weights: float | np.ndarray = 1.0) -> None:
+        """ Adds a value with a weight to each entry """
+        weight = self.weight + weights
+        delta = values - self.mean
+        ratio = np.divide(weights, weight, out=np.zeros_like(weight), where=weight > 0)
+        self.mean = self.mean + ratio * delta
+        self.m2 = self.m2 + weights * delta * (values - self.mean)
+        self.weight = weight
+
+    def add_at(self, index: int, value: float, weight: float) -> None:
+        """ Adds a value with a weight to a single entry """
+        total = self.weight[index] + weight
+        if total <= 0:
+            return
+        delta = value - self.mean[index]
+        self.mean[index] += weight / total * delta
+        self.m2[index] += weight * delta * (value - self.mean[index])
+        self.weight[index] = total
+
+    def merge(self, other: "WelfordStats") -> None:
+        """ Merges the statistics of other (computed on disjoint data) into this accumulator """
+        weight = self.weight + other.weight
+        delta = other.mean - self.mean
+        ratio = np.divide(other.weight, weight, out=np.zeros_like(weight), where=weight > 0)
+        self.m2 = self.m2 + other.m2 + delta * delta * self.weight * ratio
+        self.mean = self.mean + delta * ratio
+        self.weight = weight
+
+    def variance(self) -> np.ndarray:
+        """ Returns the weighted (population) variance of each entry, e.g. the variance in time """
+        return np.divide(self.m2, self.weight, out=np.zeros_like(self.m2), where=self.weight > 0)
+
+    def sample_variance(self) -> np.ndarray:
+        """ Returns the unbiased sample variance of each entry (for unit weights) """
+        return np.divide(self.m2, self.weight - 1, out=np.zeros_like(self.m2), where=self.weight > 1)
+
+    def confidence_interval(self, z: float = CONFIDENCE_Z) -> tuple[np.ndarray, np.ndarray]:
+        """ Returns the confidence interval (low, high) of the mean of each entry (for unit weights, e.g. one value per replica) """
+        standard_error = np.sqrt(np.divide(self.sample_variance(), self.weight, out=np.zeros_like(self.m2), where=self.weight > 0))
+        return self.mean - z * standard_error, self.mean + z * standard_error